@@ -1,5 +1,6 @@
 # app.py
-import os, socket, urllib.parse
+import os, time, importlib, urllib.parse
+_T0 = time.perf_counter()
 import streamlit as st
 
 # 1) LỆNH STREAMLIT ĐẦU TIÊN
@@ -10,12 +11,20 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# 2) Import sau khi set_page_config
-from core import get_conn, require_login, header_top, store_selector
-from catalog import page_catalog
-from inventory import page_inventory
-from production import page_production
-from finance import page_finance
+# 2) Import sau khi set_page_config — các trang nạp lười khi được chọn (xem PAGES)
+from core import (get_conn, require_login, header_top, store_selector, is_admin, is_local_mode,
+                  db_health, mark_db_unhealthy, record_run, RUN_STATS, QueryTimeout, timeout_notice)
+import profiling
+import cache
+
+# (nhãn menu, module, hàm trang, chỉ Admin)
+PAGES = [
+    ("Danh mục",  "catalog",    "page_catalog",    False),
+    ("Kho",       "inventory",  "page_inventory",  False),
+    ("Sản xuất",  "production", "page_production", False),
+    ("Tài chính", "finance",    "page_finance",    False),
+    ("Nhật ký",   "audit",      "page_audit",      True),
+]
 
 def _mask_url(url: str) -> str:
     """Ẩn mật khẩu trong connection string khi debug"""
@@ -35,59 +44,111 @@ def _mask_url(url: str) -> str:
         return "<cannot mask>"
 
 def _debug_db_url():
+    """Chỉ hiện thông tin URL/DNS khi kết nối lỗi; kết quả tốt được nhớ cho cả process (core.db_health)."""
     url = os.getenv("DATABASE_URL", "").strip()
     if not url:
         st.error("❌ Thiếu biến môi trường DATABASE_URL (Postgres). Vào Streamlit → Settings → Advanced → Secrets để thêm.")
         st.stop()
 
+    h = db_health()
+    if h["ok"]: return
+
     st.caption("🔗 DATABASE_URL (đã mask):")
     st.code(_mask_url(url))
+    st.write(f"🖥️ Host: `{h['host']}`  •  🔌 Port: `{h['port']}`")
+    if h["ip"]:
+        st.success(f"DNS OK → {h['host']} → {h['ip']}")
+        st.error(f"❌ Không kết nối được Postgres. Kiểm tra lại `DATABASE_URL`, port (6543 cho pooler), và password URL-encode. Chi tiết: {h['error']}")
+    else:
+        st.error(f"❌ DNS lỗi hoặc host sai. Kiểm tra lại host trong Supabase (dạng `db.<project-ref>.supabase.co`). Chi tiết: {h['error']}")
+    st.stop()
 
-    # Hiển thị host/port để người dùng đối chiếu nhanh
-    try:
-        p = urllib.parse.urlsplit(url)
-        hostport = (p.netloc.split("@", 1)[-1])  # phần sau @
-        host = hostport.split(":", 1)[0]
-        port = int(hostport.split(":")[1]) if ":" in hostport else None
-        st.write(f"🖥️ Host: `{host}`  •  🔌 Port: `{port}`")
-        # Thử resolve DNS
-        ip = socket.gethostbyname(host)
-        st.success(f"DNS OK → {host} → {ip}")
-    except Exception as e:
-        st.error(f"❌ DNS lỗi hoặc host sai. Kiểm tra lại host trong Supabase (dạng `db.<project-ref>.supabase.co`). Chi tiết: {e}")
-        st.stop()
-
-def router(conn, user):
+def router(conn, user, stages):
     st.sidebar.markdown("## 📌 Chức năng")
+    visible = [p for p in PAGES if not p[3] or is_admin(user)]
     menu = st.sidebar.radio(
         "",
-        ["Danh mục", "Kho", "Sản xuất", "Tài chính"],
+        [p[0] for p in visible],
         index=0,
         label_visibility="collapsed",
     )
     store_selector(conn, user)
 
-    if menu == "Danh mục":
-        page_catalog(conn, user)
-    elif menu == "Kho":
-        page_inventory(conn, user)
-    elif menu == "Sản xuất":
-        page_production(conn, user)
-    elif menu == "Tài chính":
-        page_finance(conn, user)
+    _, mod, fn, _ = next(p for p in visible if p[0] == menu)
+    t = time.perf_counter()
+    module = importlib.import_module(mod)
+    profiling.instrument(module)
+    page = getattr(module, fn)
+    stages["import"] = (time.perf_counter() - t) * 1000
+    t = time.perf_counter()
+    try:
+        page(conn, user)
+    except QueryTimeout as e:
+        timeout_notice(e)
+    finally:
+        stages["page"] = (time.perf_counter() - t) * 1000
 
-if __name__ == "__main__":
-    # 3) Kiểm tra URL + DNS trước khi kết nối
-    _debug_db_url()
+def _show_timing():
+    """SHOW_TIMING=1: bảng thời gian (ms) lần chạy đầu của process so với rerun gần nhất."""
+    if not os.getenv("SHOW_TIMING"): return
+    with st.sidebar.expander("⏱️ Thời gian chạy (ms)"):
+        rows = {k: v for k, v in (("cold", RUN_STATS["cold"]), ("rerun", RUN_STATS["last"])) if v}
+        st.dataframe({k: {s: round(ms, 1) for s, ms in v.items()} for k, v in rows.items()}, use_container_width=True)
+        st.caption(f"Số lần chạy: {RUN_STATS['runs']} • overhead = total − page")
+
+def _profiling_panel(user):
+    """Admin bật/tắt profiling cho cả process; bảng ms theo hàm của lần rerun vừa rồi."""
+    if not is_admin(user): return
+    with st.sidebar.expander("🔬 Profiling"):
+        def _apply():
+            profiling.set_enabled(st.session_state["prof_on"], st.session_state["prof_mode"], [p[1] for p in PAGES])
+        st.selectbox("Chế độ", profiling.MODES, index=profiling.MODES.index(profiling.mode()),
+                     key="prof_mode", on_change=_apply)
+        st.checkbox("Bật (mọi phiên)", value=profiling.enabled(), key="prof_on", on_change=_apply)
+        last = profiling.last_run()
+        if not last: return
+        st.dataframe([{"hàm": "· " * d + q, "ms": round(ms or 0, 1)} for d, q, ms in last["rows"]],
+                     use_container_width=True, hide_index=True)
+        st.caption(f"Chế độ: {last['mode']}" + (f" • file: `{last['file']}`" if last["file"] else ""))
+
+def _cache_panel(user):
+    """Admin: tỷ lệ hit cache chung (cache.py) theo namespace của worker đang phục vụ phiên này."""
+    if not is_admin(user): return
+    with st.sidebar.expander("🗄️ Cache"):
+        rows = cache.stats()
+        if rows:
+            st.dataframe([{**r, "hit_rate": f"{r['hit_rate']:.0%}"} for r in rows], use_container_width=True, hide_index=True)
+        st.caption(f"Worker pid {os.getpid()} • {cache.backend()}")
 
-    # 4) Kết nối DB
+if __name__ == "__main__":
+    stages = {"boot": (time.perf_counter() - _T0) * 1000}
+    t = time.perf_counter()
     try:
-        conn = get_conn()
-    except Exception as e:
-        st.error(f"❌ Không kết nối được Postgres. Kiểm tra lại `DATABASE_URL`, port (6543 cho pooler), và password URL-encode. Chi tiết: {e}")
-        st.stop()
+        # 3) Kiểm tra URL + DNS trước khi kết nối (chế độ local-first không cần mạng)
+        if not is_local_mode():
+            _debug_db_url()
+        stages["health"] = (time.perf_counter() - t) * 1000
+
+        # 4) Kết nối DB — trả connection về pool khi script kết thúc (kể cả st.stop/st.rerun)
+        t = time.perf_counter()
+        try:
+            conn = get_conn()
+        except Exception as e:
+            mark_db_unhealthy(e)
+            st.error(f"❌ Không kết nối được Postgres. Kiểm tra lại `DATABASE_URL`, port (6543 cho pooler), và password URL-encode. Chi tiết: {e}")
+            st.stop()
+        stages["conn"] = (time.perf_counter() - t) * 1000
 
-    # 5) Auth + UI
-    user = require_login(conn)
-    header_top(conn, user)
-    router(conn, user)
+        with conn:
+            # 5) Auth + UI
+            t = time.perf_counter()
+            user = require_login(conn)
+            header_top(conn, user)
+            stages["auth+header"] = (time.perf_counter() - t) * 1000
+            profiling.profile_run("router", router, conn, user, stages)
+    finally:
+        stages["total"] = (time.perf_counter() - _T0) * 1000
+        record_run(stages)
+    _show_timing()
+    _profiling_panel(user)
+    _cache_panel(user)
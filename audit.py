@@ -0,0 +1,119 @@
+# audit.py
+import os
+from datetime import datetime, date, timedelta
+import streamlit as st
+from core import fetch_df, write_audit, is_admin
+from partitions import ensure_month_partitions, drop_old_partitions
+from finance import archive_transactions
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+PAGE_SIZE = 100
+
+# ===============================
+# Đọc nhật ký (keyset theo ts, id)
+# ===============================
+def syslog_page(conn, actor=None, action=None, dt_from=None, dt_to=None, after=None, limit=PAGE_SIZE):
+    """
+    1 trang nhật ký mới → cũ. after = (ts, id) của dòng cuối trang trước.
+    Lọc bằng so sánh bằng trên actor/action để dùng index (actor|action, ts, id).
+    """
+    where, params = " WHERE 1=1 ", {"n": limit}
+    if actor:
+        where += " AND actor=:a "; params["a"] = actor
+    if action:
+        where += " AND action=:act "; params["act"] = action
+    if dt_from:
+        where += " AND ts >= :f "; params["f"] = dt_from
+    if dt_to:
+        where += " AND ts <= :t "; params["t"] = dt_to
+    if after:
+        where += " AND (ts, id) < (:cts, :cid) "; params["cts"], params["cid"] = after
+    return fetch_df(conn, f"""
+        SELECT id, ts, actor, action, detail
+        FROM syslog
+        {where}
+        ORDER BY ts DESC, id DESC
+        LIMIT :n
+    """, params, report=True)
+
+def syslog_retention(conn, keep_months: int = 12, archive: bool = True) -> list:
+    """Tạo trước phân vùng tháng tới, lưu trữ (gzip) rồi xoá phân vùng cũ hơn keep_months."""
+    ensure_month_partitions(conn, "syslog")
+    return drop_old_partitions(conn, "syslog", keep_months,
+                               archive_dir=(os.path.join(ARCHIVE_DIR, "syslog") if archive else None))
+
+# ===============================
+# Xem nhật ký
+# ===============================
+def tab_log(conn, user):
+    c1, c2, c3, c4 = st.columns(4)
+    with c1: actor = st.text_input("Người dùng (email)").strip()
+    with c2: action = st.text_input("Hành động (vd: INVENTORY_IN)").strip().upper()
+    with c3: dt_from = st.date_input("Từ ngày", value=date.today() - timedelta(days=7), key="aud_from")
+    with c4: dt_to = st.date_input("Đến ngày", value=date.today(), key="aud_to")
+
+    # Đổi bộ lọc thì quay lại trang đầu
+    filt = (actor, action, dt_from, dt_to)
+    if st.session_state.get("aud_filter") != filt:
+        st.session_state["aud_filter"] = filt
+        st.session_state["aud_cursors"] = [None]
+    cursors = st.session_state["aud_cursors"]
+
+    df = syslog_page(conn, actor or None, action or None,
+                     datetime.combine(dt_from, datetime.min.time()),
+                     datetime.combine(dt_to, datetime.max.time()),
+                     after=cursors[-1])
+    st.dataframe(df, use_container_width=True, hide_index=True, height=420)
+
+    b1, b2, b3 = st.columns([1, 1, 4])
+    with b1:
+        if st.button("◀ Trang trước", disabled=len(cursors) <= 1):
+            cursors.pop(); st.rerun()
+    with b2:
+        if st.button("Trang sau ▶", disabled=len(df) < PAGE_SIZE):
+            last = df.iloc[-1]
+            cursors.append((last["ts"].to_pydatetime(), int(last["id"]))); st.rerun()
+    with b3:
+        st.caption(f"Trang {len(cursors)} • {len(df)} dòng")
+
+# ===============================
+# Lưu trữ & dọn phân vùng
+# ===============================
+def tab_retention(conn, user):
+    st.caption("Nhật ký được chia phân vùng theo tháng. Xoá 1 tháng = DROP phân vùng, không quét bảng.")
+    keep = st.number_input("Giữ lại (tháng)", min_value=1, max_value=120, value=12, step=1)
+    archive = st.checkbox("Lưu file .csv.gz trước khi xoá", value=True)
+    if st.button("🧹 Chạy lưu trữ nhật ký", type="primary"):
+        try:
+            done = syslog_retention(conn, int(keep), archive)
+            write_audit(conn, "SYSLOG_RETENTION", f"keep={keep} dropped={len(done)}")
+            if done: st.success(f"Đã xử lý {len(done)} phân vùng."); st.dataframe(done, use_container_width=True)
+            else: st.info("Không có phân vùng nào cần xoá.")
+        except Exception as e:
+            st.error(f"Không chạy được (syslog đã phân vùng chưa? xem sql/001_syslog_partitioned.sql). Chi tiết: {e}")
+
+    st.divider()
+    st.caption("Kho: tháng đã khoá được lưu .csv.gz và gộp thành số dư chuyển kỳ theo (cửa hàng, SP). "
+               "Tồn/giá vốn từ sau kỳ lưu trữ giữ nguyên.")
+    keep_tx = st.number_input("Giữ giao dịch kho (tháng)", min_value=2, max_value=120, value=24, step=1)
+    if st.button("📦 Lưu trữ giao dịch kho"):
+        try:
+            done = archive_transactions(conn, int(keep_tx))
+        except Exception as e:
+            st.error(f"Không chạy được (xem sql/002_transactions_partitioned.sql). Chi tiết: {e}"); return
+        write_audit(conn, "TX_ARCHIVE", f"keep={keep_tx} archived={len(done)}")
+        if done: st.success(f"Đã lưu trữ {len(done)} tháng."); st.dataframe(done, use_container_width=True)
+        else: st.info("Không có tháng nào cần lưu trữ.")
+
+# ===============================
+# ENTRY PAGE NHẬT KÝ
+# ===============================
+def page_audit(conn, user):
+    st.markdown("## 📜 Nhật ký")
+    if not is_admin(user):
+        st.warning("Chỉ Admin được xem nhật ký."); return
+    tabs = st.tabs(["Nhật ký", "Lưu trữ"])
+    with tabs[0]:
+        tab_log(conn, user)
+    with tabs[1]:
+        tab_retention(conn, user)
@@ -0,0 +1,44 @@
+# bench/bench_formula_save.py
+# Đếm số round trip khi lưu công thức với số NVL tăng dần.
+# Chạy: DATABASE_URL=postgresql://... python bench/bench_formula_save.py
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import event, text
+import core
+from catalog import save_formula
+
+SIZES = [5, 20, 50, 200]
+PREFIX = "BENCH_FI_"
+
+def main():
+    conn = core.get_conn()
+    counter = {"n": 0}
+    @event.listens_for(core._ENGINE, "before_cursor_execute")
+    def _count(*_a, **_k): counter["n"] += 1
+
+    n_max = max(SIZES)
+    conn.execute(text("""
+        INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref)
+        SELECT :px || g, 'Bench ' || g, 'PHU_GIA', 'kg', 0, 0 FROM generate_series(1,:n) g
+        ON CONFLICT (code) DO NOTHING
+    """), {"px": PREFIX, "n": n_max}); conn.commit()
+    hdr = {"code": PREFIX + "CT", "name": "Bench CT", "type": "COT", "output_pcode": PREFIX + "1",
+           "recovery": 1.0, "cups_per_kg": 0.0, "note": ""}
+    try:
+        print(f"{'NVL':>6} {'lần lưu':>10} {'round trip':>11} {'ms':>8}")
+        for n in SIZES:
+            for label, qty in (("tạo mới", 0.1), ("sửa hết", 0.2)):
+                inputs = {f"{PREFIX}{i}": (qty, "OTHER") for i in range(1, n+1)}
+                counter["n"] = 0; t0 = time.perf_counter()
+                save_formula(conn, hdr, inputs)
+                ms = (time.perf_counter()-t0)*1000
+                print(f"{n:>6} {label:>10} {counter['n']:>11} {ms:>8.1f}")
+            save_formula(conn, hdr, {})
+    finally:
+        conn.execute(text("DELETE FROM formula_inputs WHERE formula_code=:c"), {"c": hdr["code"]})
+        conn.execute(text("DELETE FROM formulas WHERE code=:c"), {"c": hdr["code"]})
+        conn.execute(text("DELETE FROM products WHERE code LIKE :px"), {"px": PREFIX + "%"})
+        conn.commit(); conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench/loadtest.py
+# Tải đồng thời: N phiên Streamlit (AppTest, chạy thật app.py + page_*) cùng lúc, mỗi phiên lặp kịch bản
+# nhập kho → xuất kho → ghi lô CỐT → mở báo cáo tài chính. In thông lượng, p50/p95/p99 theo bước,
+# thời gian chờ lấy connection (pool) và tỷ lệ lỗi cho từng mức số phiên.
+# AppTest dùng Runtime toàn cục nên không chạy song song trong 1 process → mỗi phiên 1 process (spawn),
+# mỗi process 1 pool riêng: "chờ connection" đo get_conn() (mở kết nối / lấy từ pool), không phải
+# tranh chấp pool chung như khi N phiên cùng 1 server.
+# Chạy: DATABASE_URL=postgresql://localhost/erp python bench/loadtest.py [1 2 4 8 16]
+#   LT_ITER=số vòng / phiên (mặc định 3). Dữ liệu thử có tiền tố LT, xoá khi chạy xong.
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LIVE_REFRESH", "0")
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from streamlit.testing.v1 import AppTest
+import core
+
+LEVELS = [int(x) for x in sys.argv[1:]] or [1, 2, 4, 8]
+ITER = int(os.getenv("LT_ITER", "3"))
+PX = "LT"
+_WAITS = []
+
+# ---------- dữ liệu thử ----------
+def seed(conn, n):
+    core.run_sql(conn, "INSERT INTO categories(code,name) VALUES ('TRAI_CAY','Trái cây'),('COT','Cốt'),('PHU_GIA','Phụ gia') ON CONFLICT (code) DO NOTHING")
+    core.run_sql(conn, f"""INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES
+        ('{PX}_F','{PX} cam','TRAI_CAY','kg',0,20000), ('{PX}_A','{PX} đường','PHU_GIA','kg',0,15000),
+        ('{PX}_C','{PX} cốt cam','COT','kg',40,0) ON CONFLICT (code) DO NOTHING""")
+    for i in range(n):
+        s, ct = f"{PX}{i}", f"{PX}_CT{i}"
+        core.run_sql(conn, "INSERT INTO stores(code,name) VALUES (:s,:n) ON CONFLICT (code) DO NOTHING", {"s": s, "n": f"Load {i}"})
+        core.run_sql(conn, """INSERT INTO users(email,display,password,role,store_code) VALUES (:e,:e,'x','User',:s)
+            ON CONFLICT (email) DO NOTHING""", {"e": f"{s.lower()}@load", "s": s})
+        # mỗi phiên 1 CT riêng: mã lô = CT + giây, 2 phiên cùng CT trong 1 giây sẽ trùng khoá
+        core.run_sql(conn, f"""INSERT INTO formulas(code,name,type,output_pcode,output_uom,recovery,cups_per_kg,note)
+            VALUES (:c,:c,'COT','{PX}_C','kg',0.6,40,'') ON CONFLICT (code) DO NOTHING""", {"c": ct})
+        # formula_inputs không có unique (formula_code,pcode) ở Postgres → xoá rồi chèn, không ON CONFLICT
+        with core.tx(conn):
+            core.exec_sql(conn, "DELETE FROM formula_inputs WHERE formula_code=:c", {"c": ct})
+            core.exec_sql(conn, f"""INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind) VALUES
+                (:c,'{PX}_F',0,'SRC'), (:c,'{PX}_A',0.1,'OTHER')""", {"c": ct})
+        core.run_sql(conn, f"""INSERT INTO transactions(store_code,pcode,qty,type,price_in,note) VALUES
+            (:s,'{PX}_F',100000,'IN',20000,'seed'), (:s,'{PX}_A',100000,'IN',15000,'seed')""", {"s": s})
+
+def cleanup(conn):
+    like = {"px": f"{PX}%"}
+    for sql in ["DELETE FROM wip_cost WHERE batch_id IN (SELECT batch_id FROM production WHERE store_code LIKE :px)",
+                "DELETE FROM production WHERE store_code LIKE :px",
+                "DELETE FROM transactions WHERE store_code LIKE :px",
+                "DELETE FROM formula_inputs WHERE formula_code LIKE :px",
+                "DELETE FROM formulas WHERE code LIKE :px",
+                "DELETE FROM products WHERE code LIKE :px",
+                "DELETE FROM syslog WHERE actor LIKE 'lt%@load'",
+                "DELETE FROM users WHERE email LIKE 'lt%@load'",
+                "DELETE FROM stores WHERE code LIKE :px"]:
+        try: core.run_sql(conn, sql, like)
+        except Exception as e: conn.rollback(); print("cleanup:", e)
+    try: core.run_sql(conn, "DELETE FROM production_yield_agg WHERE store_code LIKE :px", like)
+    except Exception: conn.rollback()
+
+# ---------- 1 phiên ----------
+def _timed_get_conn(orig):
+    def get_conn():
+        t = time.perf_counter()
+        try: return orig()
+        finally: _WAITS.append((time.perf_counter() - t) * 1000)
+    return get_conn
+
+def _menu(at, label):
+    at.sidebar.radio[0].set_value(label)
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+def _num(at, label):
+    return next(n for n in at.number_input if n.label == label)
+
+def session(i):
+    """Chạy trong process con. Trả về (độ trễ theo bước, lỗi, thời gian chờ connection, t bắt đầu, t kết thúc)."""
+    core.get_conn = _timed_get_conn(core.get_conn)
+    lat, errs, t0 = {}, [], time.time()
+    s, ct = f"{PX}{i}", f"{PX}_CT{i}"
+    at = AppTest.from_file("app.py", default_timeout=60)
+    at.session_state["user"] = {"email": f"{s.lower()}@load", "display": s, "role": "User", "store": s}
+
+    def step(name, act):
+        t = time.perf_counter()
+        try:
+            act(); at.run()
+            bad = [e.value for e in at.exception] + [e.value for e in at.error if "❌" in str(e.value)]
+            if bad: errs.append((name, str(bad[0])[:200]))
+        except Exception as e:
+            errs.append((name, f"{type(e).__name__}: {e}"[:200]))
+        lat.setdefault(name, []).append((time.perf_counter() - t) * 1000)
+
+    step("mở app", lambda: None)
+    for _ in range(ITER):
+        step("mở Kho", lambda: _menu(at, "Kho"))
+        def pick_in():
+            at.text_input(key="in_pick_q").set_value(f"{PX}_A").run()
+            at.selectbox(key="in_pick").select(f"{PX}_A — {PX} đường")
+        step("chọn SP nhập", pick_in)
+        def receive():
+            _num(at, "Số lượng (kg)").set_value(5.0); _num(at, "Đơn giá nhập").set_value(15000.0)
+            _button(at, "💾 Ghi nhập").click()
+        step("ghi nhập", receive)
+        def pick_out():
+            at.selectbox(key="in_pick").select("— Chọn —"); at.text_input(key="out_pick_q").set_value(f"{PX}_A").run()
+            at.selectbox(key="out_pick").select(f"{PX}_A — {PX} đường")
+        step("chọn SP xuất", pick_out)
+        def issue():
+            _num(at, "Số lượng (kg)").set_value(2.0); _button(at, "💾 Ghi xuất").click()
+        step("ghi xuất", issue)
+        at.selectbox(key="out_pick").select("— Chọn —")
+        step("mở Sản xuất", lambda: _menu(at, "Sản xuất"))
+        step("chọn CT CỐT", lambda: next(x for x in at.selectbox if x.label == "Công thức CỐT").select(f"{ct} — {ct}"))
+        def post_cot():
+            at.number_input(key=f"cot_tho_{PX}_F").set_value(10.0); _num(at, "kg sau sơ chế").set_value(8.0)
+            _button(at, "✅ Ghi nhận (xuất NVL & nhập TP CỐT)").click()
+        step("ghi lô CỐT", post_cot)
+        step("mở báo cáo", lambda: _menu(at, "Tài chính"))
+    return lat, errs, _WAITS, t0, time.time()
+
+def pct(xs, p):
+    return float(np.percentile(xs, p)) if xs else 0.0
+
+def run_level(n):
+    lat, errs, waits, spans = {}, [], [], []
+    with ProcessPoolExecutor(n, mp_context=get_context("spawn")) as ex:
+        for f in [ex.submit(session, i) for i in range(n)]:
+            l, e, w, a, b = f.result()
+            for k, xs in l.items(): lat.setdefault(k, []).extend(xs)
+            errs += e; waits += w; spans.append((a, b))
+    wall = max(b for _, b in spans) - min(a for a, _ in spans)
+    allv = [v for xs in lat.values() for v in xs]
+    print(f"\n=== {n} phiên • {len(allv)} bước trong {wall:.1f}s • {len(allv)/wall:.1f} bước/s "
+          f"• {n*ITER/wall*60:.1f} kịch bản/phút • lỗi {len(errs)}/{len(allv)} ({len(errs)/max(len(allv),1):.1%})")
+    print(f"{'bước':<14}{'n':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, xs in lat.items():
+        print(f"{name:<14}{len(xs):>5}{pct(xs,50):>9.0f}{pct(xs,95):>9.0f}{pct(xs,99):>9.0f}{max(xs):>9.0f}")
+    w = waits
+    print(f"chờ connection: n={len(w)} p50={pct(w,50):.1f} p95={pct(w,95):.1f} p99={pct(w,99):.1f} max={max(w or [0]):.1f} ms")
+    for name, e in errs[:5]: print(f"  lỗi [{name}] {e}")
+
+def main():
+    conn = core.get_conn()
+    seed(conn, max(LEVELS))
+    try:
+        for n in LEVELS: run_level(n)
+    finally:
+        cleanup(conn); conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# bench/pos_events.py
+# Sinh file sự kiện bán hàng giả cho pos_ingest.py: N dòng CSV (store,pcode,cups,ts), ts tăng dần từ giờ hiện tại.
+# Chạy: python bench/pos_events.py 200000 S1,S2 COT_CAM,MUT_DAU > sales.csv
+#       python pos_ingest.py sales.csv --source bench
+import sys, random
+from datetime import datetime, timedelta, timezone
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    stores = (sys.argv[2] if len(sys.argv) > 2 else "S1").split(",")
+    pcodes = (sys.argv[3] if len(sys.argv) > 3 else "C1").split(",")
+    t, out = datetime.now(timezone.utc).replace(tzinfo=None), sys.stdout
+    out.write("store,pcode,cups,ts\n")
+    for _ in range(n):
+        t += timedelta(milliseconds=random.randint(0, 50))
+        out.write(f"{random.choice(stores)},{random.choice(pcodes)},{random.randint(1, 3)},{t.isoformat()}\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# cache.py
+# Cache kết quả dùng chung cho mọi worker (process) trên cùng 1 máy: 1 file SQLite (WAL) ở CACHE_PATH.
+# - Khoá gắn phiên bản namespace ("catalog", "production", "stock:<store>"): ghi dữ liệu → bump(ns),
+#   phiên bản tăng trong file → mọi process bỏ qua giá trị cũ, không cần xoá từng khoá.
+# - Cache trong process (công thức, đồ thị CT, chỉ mục SP) so version(ns) trước khi dùng.
+#   Phiên bản đọc từ file được nhớ VER_TTL giây → process khác thấy thay đổi chậm tối đa chừng đó.
+# - CACHE_PATH=":memory:" (hoặc không mở được file) → bản thay thế trong process, cùng API.
+# - save_snapshot / snapshot: bản lưu gần nhất không gắn phiên bản (báo cáo quá hạn dùng tạm, xem core.fetch_df).
+# - stats(): hit/miss theo namespace của process hiện tại.
+# - leader(): True ở đúng 1 process / máy (khoá file CACHE_PATH.lock) → việc chỉ cần làm 1 lần / máy (live.py).
+import os, time, pickle, hashlib, sqlite3, tempfile, threading, logging
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+CACHE_TTL = 300
+SNAP_TTL = 7 * 86400
+VER_TTL = float(os.getenv("CACHE_VER_TTL", "0.5"))
+_CLEAN_EVERY = 200          # số lần ghi giữa 2 lần dọn khoá hết hạn
+
+def _default_path():
+    # 1 file / CSDL: 2 app khác DB trên cùng máy không dùng lẫn cache
+    src = os.getenv("LOCAL_DB_PATH", "").strip() or os.getenv("DATABASE_URL", "").strip()
+    return os.path.join(tempfile.gettempdir(), f"erp_cache_{hashlib.md5(src.encode()).hexdigest()[:8]}.db")
+
+CACHE_PATH = os.getenv("CACHE_PATH", "").strip() or _default_path()
+
+_LOCK = threading.Lock()
+_DB = {"pid": None, "conn": None, "path": None, "writes": 0}
+_LEAD = {"pid": None, "fd": None}
+_VER = {}       # ns → (monotonic lúc đọc, phiên bản)
+_STATS = {}     # ns → {"hit", "miss", "set"}
+
+def _open(path):
+    db = sqlite3.connect(path, timeout=2, isolation_level=None, check_same_thread=False)
+    if path != ":memory:":
+        db.execute("PRAGMA journal_mode=WAL"); db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS ns(name TEXT PRIMARY KEY, ver INTEGER NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, ver TEXT NOT NULL, exp REAL NOT NULL, v BLOB NOT NULL)")
+    return db
+
+def _db():
+    """Connection của process (gọi trong _LOCK); mở lại sau fork."""
+    if _DB["pid"] != os.getpid():
+        try:
+            db, path = _open(CACHE_PATH), CACHE_PATH
+        except sqlite3.Error as e:
+            log.warning("cache: không mở được %s (%s) → dùng bộ nhớ process", CACHE_PATH, e)
+            db, path = _open(":memory:"), ":memory:"
+        _DB.update(pid=os.getpid(), conn=db, path=path, writes=0); _VER.clear()
+    return _DB["conn"]
+
+def backend() -> str:
+    with _LOCK:
+        _db(); return _DB["path"]
+
+def _count(ns, what):
+    s = _STATS.setdefault(ns, {"hit": 0, "miss": 0, "set": 0})
+    s[what] += 1
+
+# ===== Phiên bản namespace =====
+def version(ns) -> int:
+    now = time.monotonic()
+    with _LOCK:
+        hit = _VER.get(ns)
+        if hit and now - hit[0] < VER_TTL: return hit[1]
+        try:
+            r = _db().execute("SELECT ver FROM ns WHERE name=?", (ns,)).fetchone()
+        except sqlite3.Error as e:
+            log.warning("cache version %s: %s", ns, e)
+            return hit[1] if hit else 0
+        v = r[0] if r else 0
+        _VER[ns] = (now, v)
+        return v
+
+def bump(*nss):
+    """Dữ liệu của các namespace vừa đổi: tăng phiên bản (mọi process), process này thấy ngay."""
+    with _LOCK:
+        db = _db()
+        for ns in nss:
+            try:
+                db.execute("INSERT INTO ns(name,ver) VALUES (?,1) ON CONFLICT(name) DO UPDATE SET ver=ver+1", (ns,))
+                v = db.execute("SELECT ver FROM ns WHERE name=?", (ns,)).fetchone()[0]
+            except sqlite3.Error as e:
+                log.warning("cache bump %s: %s", ns, e); _VER.pop(ns, None); continue
+            _VER[ns] = (time.monotonic(), v)
+
+# ===== Giá trị =====
+def cached(ns, key, fn, ttl=CACHE_TTL):
+    """
+    Giá trị của `key` trong namespace ns (str, hoặc tuple nếu phụ thuộc nhiều namespace); chưa có,
+    hết hạn hoặc phiên bản cũ → fn() rồi lưu (pickle). Lỗi file cache → gọi thẳng fn().
+    """
+    nss = (ns,) if isinstance(ns, str) else tuple(ns)
+    tag, k = nss[0].split(":")[0], f"{'+'.join(nss)}|{key}"
+    ver = ".".join(str(version(n)) for n in nss)
+    with _LOCK:
+        try:
+            r = _db().execute("SELECT v FROM kv WHERE k=? AND ver=? AND exp>?", (k, ver, time.time())).fetchone()
+        except sqlite3.Error as e:
+            log.warning("cache get %s: %s", k, e); r = None
+        if r is not None:
+            try:
+                val = pickle.loads(r[0]); _count(tag, "hit"); return val
+            except Exception:
+                pass
+        _count(tag, "miss")
+    val = fn()
+    try:
+        blob = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return val
+    with _LOCK:
+        db = _db()
+        try:
+            db.execute("INSERT OR REPLACE INTO kv(k,ver,exp,v) VALUES (?,?,?,?)", (k, ver, time.time() + ttl, blob))
+            _count(tag, "set"); _DB["writes"] += 1
+            if _DB["writes"] % _CLEAN_EVERY == 0:
+                db.execute("DELETE FROM kv WHERE exp<=?", (time.time(),))
+        except sqlite3.Error as e:
+            log.warning("cache set %s: %s", k, e)
+    return val
+
+# ===== Bản lưu gần nhất (snapshot) =====
+def save_snapshot(key, val, ttl=SNAP_TTL):
+    try:
+        blob = pickle.dumps((datetime.now(), val), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return
+    with _LOCK:
+        try:
+            _db().execute("INSERT OR REPLACE INTO kv(k,ver,exp,v) VALUES (?,'snap',?,?)", (f"snap|{key}", time.time() + ttl, blob))
+            _count("snap", "set")
+        except sqlite3.Error as e:
+            log.warning("cache snapshot %s: %s", key, e)
+
+def snapshot(key):
+    """(giá trị, lúc lưu) của save_snapshot(key) còn hạn, hoặc None."""
+    with _LOCK:
+        try:
+            r = _db().execute("SELECT v FROM kv WHERE k=? AND exp>?", (f"snap|{key}", time.time())).fetchone()
+            at, val = pickle.loads(r[0]) if r else (None, None)
+        except Exception as e:
+            log.warning("cache snapshot %s: %s", key, e); at = None
+        _count("snap", "hit" if at else "miss")
+    return (val, at) if at else None
+
+# ===== Process đại diện máy =====
+def leader() -> bool:
+    """
+    Process này giữ khoá CACHE_PATH.lock (flock không chờ). Process giữ khoá chết → OS nhả khoá,
+    lần gọi sau ở process khác lấy được. Cache trong bộ nhớ / không có fcntl → mọi process đều là leader.
+    """
+    if backend() == ":memory:": return True
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    with _LOCK:
+        if _LEAD["pid"] == os.getpid(): return True
+        try:
+            fd = os.open(CACHE_PATH + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            log.warning("cache leader: %s", e); return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd); return False
+        _LEAD.update(pid=os.getpid(), fd=fd)
+        return True
+
+# ===== Số liệu =====
+def stats() -> list:
+    """Hit/miss theo namespace của process này: list dict pid, ns, hit, miss, set, hit_rate."""
+    with _LOCK:
+        return [{"pid": os.getpid(), "ns": ns, **s, "hit_rate": s["hit"] / max(s["hit"] + s["miss"], 1)}
+                for ns, s in sorted(_STATS.items())]
@@ -1,10 +1,211 @@
 # catalog.py
+import time
 import streamlit as st
-from core import fetch_df, run_sql, write_audit
+import pandas as pd
+from core import fetch_df, run_sql, exec_sql, tx, upsert_many, write_audit
+from production import invalidate_formula
+from search import invalidate_products, product_picker
+import cache
+
+def catalog_changed(ct_code=None):
+    """Sau khi ghi danh mục/SP/CT: xoá cache trong process và tăng phiên bản "catalog" cho mọi worker."""
+    invalidate_formula(ct_code)
+    if ct_code is None: invalidate_products()
+    cache.bump("catalog")
+
+def _sync_inputs(conn, inputs_by_code: dict) -> dict:
+    """
+    Đồng bộ formula_inputs cho các CT trong inputs_by_code = {ct: {pcode: (qty_per_kg, kind)}}.
+    So với dữ liệu đang lưu rồi DELETE/UPDATE/INSERT theo tập (unnest) — số round trip cố định.
+    Không commit — gọi bên trong tx().
+    """
+    codes = list(inputs_by_code)
+    if not codes: return {"insert": 0, "update": 0, "delete": 0}
+    df_old = fetch_df(conn, """
+        SELECT formula_code,pcode,qty_per_kg,kind FROM formula_inputs WHERE formula_code = ANY(:cs)
+    """, {"cs": codes})
+    old = {(r.formula_code, r.pcode): (float(r.qty_per_kg or 0.0), r.kind) for r in df_old.itertuples()}
+    new = {(c, p): (float(q or 0.0), k) for c, items in inputs_by_code.items() for p, (q, k) in items.items()}
+    ins = [key for key in new if key not in old]
+    upd = [key for key in new if key in old and old[key] != new[key]]
+    dels = [key for key in old if key not in new]
+
+    if conn.dialect.name == "sqlite":   # chế độ local (localdb.py): không có unnest
+        for c, p in dels:
+            exec_sql(conn, "DELETE FROM formula_inputs WHERE formula_code=:c AND pcode=:p", {"c": c, "p": p})
+        for c, p in ins + upd:
+            exec_sql(conn, """
+                INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind) VALUES (:c,:p,:q,:k)
+                ON CONFLICT (formula_code,pcode) DO UPDATE SET qty_per_kg=EXCLUDED.qty_per_kg, kind=EXCLUDED.kind
+            """, {"c": c, "p": p, "q": new[(c, p)][0], "k": new[(c, p)][1]})
+        return {"insert": len(ins), "update": len(upd), "delete": len(dels)}
+
+    def arrays(keys):
+        return {"cs": [c for c,_ in keys], "ps": [p for _,p in keys],
+                "qs": [new[k][0] for k in keys], "ks": [new[k][1] for k in keys]}
+    if dels:
+        exec_sql(conn, """
+            DELETE FROM formula_inputs fi
+            USING unnest(CAST(:cs AS text[]), CAST(:ps AS text[])) AS d(c,p)
+            WHERE fi.formula_code=d.c AND fi.pcode=d.p
+        """, {"cs": [c for c,_ in dels], "ps": [p for _,p in dels]})
+    if upd:
+        exec_sql(conn, """
+            UPDATE formula_inputs fi SET qty_per_kg=u.q, kind=u.k
+            FROM unnest(CAST(:cs AS text[]), CAST(:ps AS text[]), CAST(:qs AS numeric[]), CAST(:ks AS text[])) AS u(c,p,q,k)
+            WHERE fi.formula_code=u.c AND fi.pcode=u.p
+        """, arrays(upd))
+    if ins:
+        exec_sql(conn, """
+            INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind)
+            SELECT u.c, u.p, u.q, u.k
+            FROM unnest(CAST(:cs AS text[]), CAST(:ps AS text[]), CAST(:qs AS numeric[]), CAST(:ks AS text[])) AS u(c,p,q,k)
+        """, arrays(ins))
+    return {"insert": len(ins), "update": len(upd), "delete": len(dels)}
+
+def save_formula(conn, hdr: dict, inputs: dict):
+    """Lưu CT + NVL (inputs = {pcode: (qty_per_kg, kind)}) trong 1 transaction."""
+    code = hdr["code"]
+    with tx(conn):
+        exec_sql(conn, """
+            INSERT INTO formulas(code,name,type,output_pcode,output_uom,recovery,cups_per_kg,note)
+            VALUES (:c,:n,:t,:o,'kg',:r,:k,:x)
+            ON CONFLICT (code) DO UPDATE SET
+              name=EXCLUDED.name, type=EXCLUDED.type,
+              output_pcode=EXCLUDED.output_pcode, recovery=EXCLUDED.recovery,
+              cups_per_kg=EXCLUDED.cups_per_kg, note=EXCLUDED.note
+        """, {"c": code, "n": hdr["name"], "t": hdr["type"], "o": hdr["output_pcode"],
+              "r": hdr["recovery"], "k": hdr["cups_per_kg"], "x": hdr["note"]})
+        stats = _sync_inputs(conn, {code: inputs})
+    catalog_changed(code)
+    return stats
+
+# ===================== NHẬP HÀNG LOẠT =====================
+CAT_TYPES = ["TRAI_CAY","COT","MUT","PHU_GIA","SINH_TO","TP_KHAC"]
+
+def _num(v, default=0.0):
+    if v is None or (isinstance(v, str) and not v.strip()): return default
+    return float(str(v).replace(",", "."))
+
+def import_catalog(conn, cats=None, prods=None, fms=None, fis=None, batch=500):
+    """
+    Nhập danh mục/SP/CT/NVL từ list dict (đọc từ CSV).
+    Kiểm tra tham chiếu trong bộ nhớ trước, rồi upsert theo lô trong 1 transaction.
+    Trả về (stats, rejects) — rejects là list dict {bảng, dòng, mã, lý do}.
+    MUT: cột g_per_cup (g/cốc) > 0 được đổi sang cups_per_kg = 1000/g như form.
+    """
+    t0 = time.perf_counter()
+    rejects = []
+    def reject(tbl, i, code, why): rejects.append({"bảng": tbl, "dòng": i+2, "mã": code, "lý do": why})
+
+    known_cat = set(fetch_df(conn, "SELECT code FROM categories")["code"]) | set(CAT_TYPES)
+    known_prod = set(fetch_df(conn, "SELECT code FROM products")["code"])
+    known_fm = set(fetch_df(conn, "SELECT code FROM formulas")["code"])
+
+    ok_cats = {}
+    for i, r in enumerate(cats or []):
+        code, name = str(r.get("code") or "").strip(), str(r.get("name") or "").strip()
+        if not code or not name: reject("categories", i, code, "thiếu code/name"); continue
+        ok_cats[code] = {"code": code, "name": name}
+    known_cat |= set(ok_cats)
+
+    ok_prods = {}
+    for i, r in enumerate(prods or []):
+        code, name = str(r.get("code") or "").strip(), str(r.get("name") or "").strip()
+        cat = str(r.get("cat_code") or "").strip()
+        if not code or not name: reject("products", i, code, "thiếu code/name"); continue
+        if cat not in known_cat: reject("products", i, code, f"nhóm '{cat}' không tồn tại"); continue
+        try:
+            gpc = _num(r.get("g_per_cup"))
+            cups_per_kg = (1000.0/gpc) if cat == "MUT" and gpc > 0 else _num(r.get("cups_per_kg"))
+            price_ref = _num(r.get("price_ref"))
+        except ValueError:
+            reject("products", i, code, "số không hợp lệ"); continue
+        ok_prods[code] = {"code": code, "name": name, "cat_code": cat,
+                          "uom": str(r.get("uom") or "kg").strip() or "kg",
+                          "cups_per_kg": cups_per_kg, "price_ref": price_ref}
+    known_prod |= set(ok_prods)
+
+    ok_fms = {}
+    for i, r in enumerate(fms or []):
+        code, name = str(r.get("code") or "").strip(), str(r.get("name") or "").strip()
+        typ, out = str(r.get("type") or "").strip().upper(), str(r.get("output_pcode") or "").strip()
+        if not code or not name: reject("formulas", i, code, "thiếu code/name"); continue
+        if typ not in ("COT","MUT"): reject("formulas", i, code, f"loại '{typ}' không hợp lệ"); continue
+        if out not in known_prod: reject("formulas", i, code, f"SP đầu ra '{out}' không tồn tại"); continue
+        try:
+            recovery = _num(r.get("recovery"), 1.0) if typ == "COT" else 1.0
+            gpc = _num(r.get("g_per_cup"))
+            cups_per_kg = (1000.0/gpc) if typ == "MUT" and gpc > 0 else _num(r.get("cups_per_kg"))
+        except ValueError:
+            reject("formulas", i, code, "số không hợp lệ"); continue
+        if recovery <= 0: reject("formulas", i, code, "hệ số thu hồi phải > 0"); continue
+        ok_fms[code] = {"code": code, "name": name, "type": typ, "output_pcode": out, "output_uom": "kg",
+                        "recovery": recovery, "cups_per_kg": cups_per_kg, "note": str(r.get("note") or "").strip()}
+    known_fm |= set(ok_fms)
+
+    inputs_by_code = {}
+    for i, r in enumerate(fis or []):
+        fc, pc = str(r.get("formula_code") or "").strip(), str(r.get("pcode") or "").strip()
+        kind = str(r.get("kind") or "").strip().upper()
+        if fc not in known_fm: reject("formula_inputs", i, fc, "CT không tồn tại"); continue
+        if pc not in known_prod: reject("formula_inputs", i, f"{fc}/{pc}", "NVL không tồn tại"); continue
+        if kind not in ("SRC","OTHER"): reject("formula_inputs", i, f"{fc}/{pc}", f"kind '{kind}' không hợp lệ"); continue
+        try: q = 0.0 if kind == "SRC" else _num(r.get("qty_per_kg"))
+        except ValueError: reject("formula_inputs", i, f"{fc}/{pc}", "số không hợp lệ"); continue
+        inputs_by_code.setdefault(fc, {})[pc] = (q, kind)
+
+    with tx(conn):
+        n = upsert_many(conn, "categories", ["code","name"], list(ok_cats.values()), "code", batch=batch)
+        n += upsert_many(conn, "products", ["code","name","cat_code","uom","cups_per_kg","price_ref"],
+                         list(ok_prods.values()), "code", batch=batch)
+        n += upsert_many(conn, "formulas", ["code","name","type","output_pcode","output_uom","recovery","cups_per_kg","note"],
+                         list(ok_fms.values()), "code", batch=batch)
+        fi_stats = _sync_inputs(conn, inputs_by_code)
+    catalog_changed()
+
+    n += sum(len(v) for v in inputs_by_code.values())
+    sec = max(time.perf_counter() - t0, 1e-9)
+    stats = {"categories": len(ok_cats), "products": len(ok_prods), "formulas": len(ok_fms),
+             "formula_inputs": fi_stats, "rows": n, "seconds": sec, "rows_per_sec": n/sec}
+    return stats, rejects
+
+def tab_import(conn, user):
+    st.caption("CSV có dòng tiêu đề. • categories: code,name • products: code,name,cat_code,uom,cups_per_kg,g_per_cup,price_ref "
+               "• formulas: code,name,type,output_pcode,recovery,cups_per_kg,g_per_cup,note "
+               "• formula_inputs: formula_code,pcode,qty_per_kg,kind (SRC/OTHER). "
+               "NVL của 1 CT trong file sẽ thay thế NVL đang lưu của CT đó.")
+    files = {}
+    c1, c2 = st.columns(2)
+    with c1:
+        files["cats"] = st.file_uploader("categories.csv", type="csv", key="imp_cat")
+        files["prods"] = st.file_uploader("products.csv", type="csv", key="imp_prod")
+    with c2:
+        files["fms"] = st.file_uploader("formulas.csv", type="csv", key="imp_fm")
+        files["fis"] = st.file_uploader("formula_inputs.csv", type="csv", key="imp_fi")
+
+    data = {k: (pd.read_csv(f, dtype=str, keep_default_na=False).to_dict("records") if f else [])
+            for k, f in files.items()}
+    st.caption(" • ".join(f"{k}: {len(v)} dòng" for k, v in data.items()))
+    if st.button("📥 Nhập hàng loạt", type="primary", disabled=not any(data.values())):
+        try:
+            stats, rejects = import_catalog(conn, **data)
+        except Exception as e:
+            st.error(f"Nhập thất bại, đã rollback. Chi tiết: {e}"); return
+        write_audit(conn, "CATALOG_IMPORT",
+                    f"cat={stats['categories']} prod={stats['products']} ct={stats['formulas']} rej={len(rejects)}")
+        st.success(f"Đã nhập {stats['rows']} dòng trong {stats['seconds']:.2f}s "
+                   f"({stats['rows_per_sec']:,.0f} dòng/giây). NVL: {stats['formula_inputs']}")
+        if rejects:
+            df_rej = pd.DataFrame(rejects)
+            st.warning(f"{len(df_rej)} dòng bị loại:")
+            st.dataframe(df_rej, use_container_width=True, hide_index=True)
+            st.download_button("Tải dòng bị loại (CSV)", df_rej.to_csv(index=False).encode("utf-8"),
+                               "rejected.csv", "text/csv")
 
 def page_catalog(conn, user):
     st.markdown("## 🧾 Danh mục")
-    tabs = st.tabs(["Danh mục SP", "Sản phẩm", "Công thức"])
+    tabs = st.tabs(["Danh mục SP", "Sản phẩm", "Công thức", "Nhập hàng loạt"])
 
     # ---------------- TAB 1: DANH MỤC ----------------
     with tabs[0]:
@@ -21,11 +222,11 @@ def page_catalog(conn, user):
                         INSERT INTO categories(code,name) VALUES (:c,:n)
                         ON CONFLICT (code) DO UPDATE SET name=EXCLUDED.name
                     """, {"c": code.strip(), "n": name.strip()})
-                    write_audit(conn, "CAT_UPSERT", code); st.rerun()
+                    catalog_changed(); write_audit(conn, "CAT_UPSERT", code); st.rerun()
         del_code = st.selectbox("Xoá nhóm", ["—"]+[r["code"] for _,r in df_cat.iterrows()], index=0)
         if del_code != "—" and st.button("Xoá nhóm"):
             run_sql(conn, "DELETE FROM categories WHERE code=:c", {"c": del_code})
-            write_audit(conn, "CAT_DELETE", del_code); st.rerun()
+            catalog_changed(); write_audit(conn, "CAT_DELETE", del_code); st.rerun()
 
     # ---------------- TAB 2: SẢN PHẨM ----------------
     with tabs[1]:
@@ -39,7 +240,7 @@ def page_catalog(conn, user):
             c1, c2 = st.columns([1,3])
             with c1: code = st.text_input("Mã SP")
             with c2: name = st.text_input("Tên SP")
-            cat = st.selectbox("Nhóm", ["TRAI_CAY","COT","MUT","PHU_GIA","SINH_TO","TP_KHAC"])
+            cat = st.selectbox("Nhóm", CAT_TYPES)
             uom = st.text_input("ĐVT", value="kg")
 
             c3, c4 = st.columns(2)
@@ -63,10 +264,13 @@ def page_catalog(conn, user):
                           price_ref=EXCLUDED.price_ref
                     """, {"c": code.strip(), "n": name.strip(), "g": cat,
                           "u": uom.strip(), "k": cups_per_kg, "p": price_ref})
+                    catalog_changed()  # tên/nhóm SP nằm trong CT đã cache
                     write_audit(conn, "PROD_UPSERT", code); st.rerun()
-        del_prod = st.selectbox("Xoá SP", ["—"]+[r["code"] for _,r in df_prod.iterrows()], index=0, key="del_prod")
-        if del_prod != "—" and st.button("Xoá SP"):
+        del_row = product_picker(conn, "Xoá SP", "del_prod")
+        if del_row and st.button("Xoá SP"):
+            del_prod = del_row["code"]
             run_sql(conn, "DELETE FROM products WHERE code=:c", {"c": del_prod})
+            catalog_changed()
             write_audit(conn, "PROD_DELETE", del_prod); st.rerun()
 
     # ---------------- TAB 3: CÔNG THỨC ----------------
@@ -125,30 +329,20 @@ def page_catalog(conn, user):
                 if not code or not name or not output_pcode:
                     st.error("Thiếu thông tin bắt buộc.")
                 else:
-                    run_sql(conn, """
-                        INSERT INTO formulas(code,name,type,output_pcode,output_uom,recovery,cups_per_kg,note)
-                        VALUES (:c,:n,:t,:o,'kg',:r,:k,:x)
-                        ON CONFLICT (code) DO UPDATE SET
-                          name=EXCLUDED.name, type=EXCLUDED.type,
-                          output_pcode=EXCLUDED.output_pcode, recovery=EXCLUDED.recovery,
-                          cups_per_kg=EXCLUDED.cups_per_kg, note=EXCLUDED.note
-                    """, {"c": code.strip(), "n": name.strip(), "t": typ, "o": output_pcode,
-                          "r": recovery, "k": cups_per_kg, "x": note.strip()})
-                    run_sql(conn, "DELETE FROM formula_inputs WHERE formula_code=:c", {"c": code.strip()})
-                    for p in raw_inputs:
-                        run_sql(conn, """
-                            INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind)
-                            VALUES (:f,:p,0,:k)
-                        """, {"f": code.strip(), "p": p, "k": "SRC"})
-                    for p,q in add_inputs.items():
-                        run_sql(conn, """
-                            INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind)
-                            VALUES (:f,:p,:q,'OTHER')
-                        """, {"f": code.strip(), "p": p, "q": q})
+                    inputs = {p: (0.0, "SRC") for p in raw_inputs}
+                    inputs.update({p: (q, "OTHER") for p, q in add_inputs.items()})
+                    save_formula(conn, {"code": code.strip(), "name": name.strip(), "type": typ,
+                                        "output_pcode": output_pcode, "recovery": recovery,
+                                        "cups_per_kg": cups_per_kg, "note": note.strip()}, inputs)
                     write_audit(conn,"FORMULA_UPSERT",code); st.success("Đã lưu."); st.rerun()
 
         del_ct = st.selectbox("Xoá CT", ["—"]+df_ct["code"].tolist(), index=0)
         if del_ct!="—" and st.button("Xoá CT"):
             run_sql(conn, "DELETE FROM formula_inputs WHERE formula_code=:c", {"c": del_ct})
             run_sql(conn, "DELETE FROM formulas WHERE code=:c", {"c": del_ct})
+            catalog_changed(del_ct)
             write_audit(conn,"FORMULA_DELETE",del_ct); st.success("Đã xoá."); st.rerun()
+
+    # ---------------- TAB 4: NHẬP HÀNG LOẠT ----------------
+    with tabs[3]:
+        tab_import(conn, user)
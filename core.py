@@ -1,12 +1,31 @@
-import os, re, hashlib
+import os, re, time, socket, hashlib, functools, threading, logging
+from contextlib import contextmanager
 from datetime import datetime
 import pandas as pd
 import streamlit as st
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Connection
+from sqlalchemy import create_engine, text, bindparam
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.exc import OperationalError, InterfaceError, DBAPIError
+import cache
+
+log = logging.getLogger(__name__)
 
 # ---------- Kết nối Postgres ----------
 _ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+# Engine chỉ đọc (replica) cho báo cáo nặng — DATABASE_URL_RO, không có thì dùng primary
+_RO_ENGINE = None
+_RO_DOWN_UNTIL = 0.0
+_RO_RETRY_SEC = 30
+_RO_LOCK = threading.Lock()
+# Ngân sách query (ms, 0 = không giới hạn). QUERY_TIMEOUT_MS là statement_timeout mặc định của mọi
+# connection app lên Postgres (tra cứu, ghi); query báo cáo có ngân sách riêng (xem fetch_df).
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "15000"))
+REPORT_TIMEOUT_MS = int(os.getenv("REPORT_TIMEOUT_MS", "60000"))
+REPORT_MAX_ROWS = int(os.getenv("REPORT_MAX_ROWS", "200000"))
+
+def _timeout_args(ms):
+    return {"options": f"-c statement_timeout={int(ms)}"} if ms > 0 else {}
 
 def _normalize(url: str) -> str:
     """Chuẩn hoá URL Postgres để SQLAlchemy kết nối an toàn"""
@@ -14,20 +33,89 @@ def _normalize(url: str) -> str:
         url = url.replace("postgres://", "postgresql+psycopg2://", 1)
     elif url.startswith("postgresql://") and "+psycopg2" not in url:
         url = url.replace("postgresql://", "postgresql+psycopg2://", 1)
-    if "sslmode=" not in url:
+    # Postgres local (dev/test) thường không bật SSL
+    if "sslmode=" not in url and make_url(url).host not in ("localhost", "127.0.0.1", "::1"):
         url += ("&" if "?" in url else "?") + "sslmode=require"
     return url
 
-def get_conn() -> Connection:
-    """Trả về connection Postgres"""
+def is_local_mode() -> bool:
+    """LOCAL_DB_PATH có giá trị → chạy trên SQLite local, đồng bộ nền lên Postgres (localdb.py)"""
+    return bool(os.getenv("LOCAL_DB_PATH", "").strip())
+
+def _primary_engine():
+    """Engine Postgres chính (1 / process): mọi connection app có statement_timeout = QUERY_TIMEOUT_MS."""
     global _ENGINE
+    if _ENGINE is None:
+        with _ENGINE_LOCK:
+            if _ENGINE is None:
+                _ENGINE = create_engine(_normalize(os.getenv("DATABASE_URL", "").strip()), pool_pre_ping=True,
+                                        future=True, connect_args=_timeout_args(QUERY_TIMEOUT_MS))
+    return _ENGINE
+
+def get_conn() -> Connection:
+    """Trả về connection Postgres (hoặc SQLite local ở chế độ local-first)"""
+    if is_local_mode():
+        from localdb import get_local_conn
+        return get_local_conn()
     url = os.getenv("DATABASE_URL", "").strip()
     if not url:
         st.error("❌ Thiếu biến môi trường DATABASE_URL (Postgres)")
         st.stop()
-    if _ENGINE is None:
-        _ENGINE = create_engine(_normalize(url), pool_pre_ping=True, future=True)
-    return _ENGINE.connect()
+    return _primary_engine().connect()
+
+def _report_engine():
+    """
+    Engine replica (DATABASE_URL_RO), hoặc None nếu chưa cấu hình / đang tạm ngưng sau lỗi kết nối.
+    Chế độ local-first không có replica: báo cáo đọc SQLite local (thấy cả dữ liệu chưa đồng bộ, không chờ mạng).
+    """
+    global _RO_ENGINE
+    url = os.getenv("DATABASE_URL_RO", "").strip()
+    if not url or time.monotonic() < _RO_DOWN_UNTIL: return None
+    with _RO_LOCK:
+        if _RO_ENGINE is None:
+            _RO_ENGINE = create_engine(_normalize(url), pool_pre_ping=True, future=True,
+                                       connect_args={"connect_timeout": 3, **_timeout_args(REPORT_TIMEOUT_MS)})
+    return _RO_ENGINE
+
+def _mark_replica_down():
+    global _RO_DOWN_UNTIL
+    _RO_DOWN_UNTIL = time.monotonic() + _RO_RETRY_SEC
+
+# ---------- Kiểm tra kết nối (1 lần / process) ----------
+_HEALTH = {"ok": False, "checked": 0.0, "host": "", "port": None, "ip": "", "error": ""}
+_HEALTH_LOCK = threading.Lock()
+
+def db_health() -> dict:
+    """
+    Resolve DNS + mở thử 1 kết nối Postgres. Thành công thì nhớ cho cả process (các rerun
+    không kiểm lại, không chặn DNS); lỗi thì lần gọi sau (rerun sau) kiểm lại.
+    """
+    if _HEALTH["ok"]: return _HEALTH
+    with _HEALTH_LOCK:
+        if _HEALTH["ok"]: return _HEALTH
+        try:
+            u = make_url(_normalize(os.getenv("DATABASE_URL", "").strip()))
+            _HEALTH.update(host=u.host or "", port=u.port)
+            _HEALTH["ip"] = socket.gethostbyname(u.host)
+            with _primary_engine().connect() as c:
+                c.execute(text("SELECT 1"))
+            _HEALTH.update(ok=True, error="")
+        except Exception as e:
+            _HEALTH.update(ok=False, error=str(e))
+        _HEALTH["checked"] = time.time()
+    return _HEALTH
+
+def mark_db_unhealthy(err):
+    """Gọi khi kết nối lỗi giữa chừng → rerun sau sẽ kiểm tra lại."""
+    _HEALTH.update(ok=False, error=str(err))
+
+# Thời gian chạy script: lần đầu của process (cold) và rerun gần nhất, theo từng chặng (ms)
+RUN_STATS = {"runs": 0, "cold": None, "last": None}
+
+def record_run(stages: dict):
+    RUN_STATS["runs"] += 1
+    if RUN_STATS["cold"] is None: RUN_STATS["cold"] = stages
+    RUN_STATS["last"] = stages
 
 # ---------- SQL helpers ----------
 def _qmark_to_named(sql: str, params):
@@ -40,21 +128,235 @@ def _qmark_to_named(sql: str, params):
     sql = re.sub(r"\?", repl, sql)
     return sql, {f"p{k+1}": v for k, v in enumerate(params)}
 
+_ANY = re.compile(r"=\s*ANY\(\s*:(\w+)\s*\)", re.I)
+
+def _stmt(conn: Connection, sql: str):
+    """text() cho câu SQL; trên SQLite đổi `= ANY(:x)` → `IN :x` (expanding) và ILIKE → LIKE"""
+    if conn.dialect.name != "sqlite": return text(sql)
+    names = _ANY.findall(sql)
+    sql = re.sub(r"\bILIKE\b", "LIKE", _ANY.sub(r"IN :\1", sql), flags=re.I)
+    return text(sql).bindparams(*[bindparam(n, expanding=True) for n in names])
+
 def run_sql(conn: Connection, sql: str, params=None):
     sql, params = _qmark_to_named(sql, params)
-    res = conn.execute(text(sql), params or {})
+    res = conn.execute(_stmt(conn, sql), params or {})
     try: conn.commit()
     except Exception: pass
     return res
 
-def fetch_df(conn: Connection, sql: str, params=None) -> pd.DataFrame:
+def exec_sql(conn: Connection, sql: str, params=None):
+    """Như run_sql nhưng không commit — dùng bên trong tx()"""
     sql, params = _qmark_to_named(sql, params)
-    return pd.read_sql_query(text(sql), conn, params=params or {})
+    return conn.execute(_stmt(conn, sql), params or {})
+
+def upsert_many(conn: Connection, table: str, cols, rows, key, update_cols=None, batch: int = 500) -> int:
+    """
+    INSERT nhiều dòng/1 lệnh (VALUES (...),(...)) ... ON CONFLICT (key) DO UPDATE, chia lô `batch` dòng.
+    Không commit — gọi bên trong tx(). rows: list dict theo cols. Trả về số dòng đã gửi.
+    """
+    key = [key] if isinstance(key, str) else list(key)
+    upd = [c for c in (update_cols or cols) if c not in key]
+    conflict = ("DO UPDATE SET " + ", ".join(f"{c}=EXCLUDED.{c}" for c in upd)) if upd else "DO NOTHING"
+    for i in range(0, len(rows), batch):
+        chunk = rows[i:i+batch]
+        params, values = {}, []
+        for j, r in enumerate(chunk):
+            values.append("(" + ",".join(f":{c}_{j}" for c in cols) + ")")
+            params.update({f"{c}_{j}": r.get(c) for c in cols})
+        conn.execute(text(f"""
+            INSERT INTO {table}({",".join(cols)}) VALUES {",".join(values)}
+            ON CONFLICT ({",".join(key)}) {conflict}
+        """), params)
+    return len(rows)
+
+@contextmanager
+def tx(conn: Connection):
+    """Gom nhiều lệnh ghi thành 1 transaction: commit 1 lần, lỗi thì rollback"""
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback(); raise
+
+# ---------- Ngân sách query: timeout, giới hạn dòng, huỷ ----------
+# Watchdog (1 thread / process) huỷ query đang chạy (psycopg2 cancel / sqlite3 interrupt) khi quá hạn
+# (SQLite không có statement_timeout; Postgres thì server tự huỷ trước) hoặc khi phiên Streamlit
+# yêu cầu chạy lại cả trang / dừng (người dùng chuyển trang, đóng tab) — connection trả về pool ngay.
+SNAP_MIN_MS = 200           # báo cáo chạy lâu hơn → lưu snapshot để dùng khi lần sau quá hạn
+SNAP_MAX_ROWS = 50000
+_GRACE = 1.0                # Postgres: giây chờ server tự huỷ trước khi watchdog huỷ
+_WATCH = {}
+_WATCH_LOCK = threading.Lock()
+_WATCH_EV = threading.Event()
+_WATCH_THREAD = None
+
+class QueryTimeout(Exception):
+    """Query quá ngân sách thời gian hoặc bị huỷ (chuyển trang) và không có snapshot thay thế."""
+
+def timeout_notice(e: QueryTimeout):
+    """Cảnh báo thay cho traceback khi trang / fragment gặp QueryTimeout."""
+    st.warning(f"⏳ {e}. Thu hẹp khoảng ngày / bộ lọc rồi thử lại.")
+
+def _script_requests():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return getattr(ctx, "script_requests", None) if ctx else None
+    except Exception:
+        return None
+
+_LEFT = {"ok": True}
+
+def _left(req) -> bool:
+    """
+    Phiên đã yêu cầu dừng / chạy lại cả trang (không tính rerun riêng fragment).
+    Đọc thuộc tính riêng của Streamlit (ScriptRequests._state, _rerun_data.fragment_id_queue — 1.38):
+    khác dạng mong đợi → log 1 lần và tắt phát hiện rời trang, query vẫn bị huỷ theo hạn giờ.
+    """
+    if req is None or not _LEFT["ok"]: return False
+    try:
+        state = req._state.name
+        if state not in ("CONTINUE", "STOP", "RERUN"): raise ValueError(f"_state={state}")
+        return state == "STOP" or (state == "RERUN" and not list(req._rerun_data.fragment_id_queue))
+    except Exception as e:
+        _LEFT["ok"] = False
+        log.warning("Streamlit %s: không đọc được trạng thái phiên (%r) → chỉ huỷ query theo hạn giờ", st.__version__, e)
+        return False
+
+def _watchdog():
+    while True:
+        if not _WATCH:
+            _WATCH_EV.wait(); _WATCH_EV.clear(); continue
+        now = time.monotonic()
+        with _WATCH_LOCK:
+            ws = list(_WATCH.values())
+        for w in ws:
+            if w["why"]: continue
+            w["why"] = "timeout" if now > w["deadline"] else ("left" if _left(w["req"]) else None)
+            if w["why"] and w["cancel"]:
+                try: w["cancel"]()
+                except Exception: pass
+        time.sleep(0.1)
+
+def _watch(c: Connection, ms):
+    global _WATCH_THREAD
+    raw = c.connection.dbapi_connection
+    w = {"cancel": getattr(raw, "cancel", None) or getattr(raw, "interrupt", None), "why": None,
+         "req": _script_requests(),
+         "deadline": time.monotonic() + (ms / 1000 + (_GRACE if c.dialect.name == "postgresql" else 0) if ms > 0 else float("inf"))}
+    with _WATCH_LOCK:
+        _WATCH[id(w)] = w
+        if _WATCH_THREAD is None:
+            _WATCH_THREAD = threading.Thread(target=_watchdog, name="query-watchdog", daemon=True)
+            _WATCH_THREAD.start()
+    _WATCH_EV.set()
+    return w
+
+def _unwatch(w):
+    with _WATCH_LOCK:
+        _WATCH.pop(id(w), None)
+
+def _is_cancel(e: DBAPIError) -> bool:
+    """57014 = query_canceled (statement_timeout hoặc cancel); SQLite: interrupted."""
+    return getattr(e.orig, "pgcode", None) == "57014" or "interrupted" in str(e.orig)
+
+def _notice(msg):
+    try: st.toast(msg)
+    except Exception: pass
+
+_TAIL_LIMIT = re.compile(r"\blimit\s+(\d+|:\w+)(\s+offset\s+(\d+|:\w+))?\s*$", re.I)
+
+def _limited(sql: str, n: int) -> str:
+    """
+    Thêm LIMIT n+1 vào cuối chính query (sau ORDER BY của nó) để dòng giữ lại đúng thứ tự người gọi;
+    không bọc SELECT * FROM (...) vì Postgres không giữ ORDER BY của truy vấn con.
+    Query đã có LIMIT số ở cuối → lấy số nhỏ hơn; LIMIT tham số → giữ nguyên (fetch_df vẫn cắt còn n).
+    """
+    if not n or not re.match(r"\s*(select|with)\b", sql, re.I): return sql
+    sql = sql.strip().rstrip(";").rstrip()
+    m = _TAIL_LIMIT.search(sql)
+    if m is None: return f"{sql}\nLIMIT {int(n) + 1}"
+    if not m.group(1).isdigit(): return sql
+    return f"{sql[:m.start(1)]}{min(int(m.group(1)), int(n) + 1)}{sql[m.end(1):]}"
+
+def _read(c: Connection, sql, params, ms, set_timeout):
+    """
+    read_sql có watchdog. set_timeout: SET LOCAL statement_timeout cho riêng query này — chỉ sống trong
+    transaction hiện tại: xong thì trả về mặc định của connection; lỗi thì transaction bị rollback,
+    không để timeout riêng dính sang lệnh sau trên connection dùng chung của trang.
+    """
+    w = _watch(c, ms)
+    try:
+        if set_timeout: c.exec_driver_sql(f"SET LOCAL statement_timeout = {int(ms)}")
+        df = pd.read_sql_query(_stmt(c, sql), c, params=params or {})
+        if set_timeout: c.exec_driver_sql("SET LOCAL statement_timeout TO DEFAULT")
+        return df
+    except DBAPIError as e:
+        why = w["why"] or ("timeout" if _is_cancel(e) else None)
+        if why is None:
+            if set_timeout:
+                try: c.rollback()
+                except Exception: pass
+            raise
+        try: c.rollback()
+        except Exception: pass
+        if why == "left":
+            st.empty()      # điểm dừng của Streamlit: phiên đang chờ chạy lại → RerunException tại đây
+            raise QueryTimeout("Query đã huỷ (rời trang)") from e
+        raise QueryTimeout(f"Query quá {ms/1000:g}s") from e
+    finally:
+        _unwatch(w)
+
+def fetch_df(conn: Connection, sql: str, params=None, report: bool = False,
+             timeout_ms: int = None, max_rows: int = None) -> pd.DataFrame:
+    """
+    report=True: query báo cáo, chạy trên replica nếu có (chấp nhận trễ vài giây);
+    replica lỗi kết nối thì tạm bỏ qua _RO_RETRY_SEC giây và chạy trên primary.
+    Ghi và đọc cần thấy dữ liệu vừa ghi (kiểm tồn trước khi xuất) giữ report=False.
+    Ngân sách: tra cứu thường theo QUERY_TIMEOUT_MS của connection; báo cáo REPORT_TIMEOUT_MS và
+    REPORT_MAX_ROWS; timeout_ms / max_rows đặt riêng cho từng chỗ gọi. Query có ngân sách riêng bị
+    watchdog huỷ khi quá hạn hoặc khi người dùng rời trang. Vượt số dòng → cắt, attrs["truncated"].
+    Báo cáo quá hạn → trả snapshot lần chạy thành công gần nhất (attrs["stale"], attrs["as_of"]);
+    không có snapshot → QueryTimeout (fragment / router hiện cảnh báo thay vì lỗi).
+    """
+    sql, params = _qmark_to_named(sql, params)
+    if not (report or timeout_ms or max_rows):
+        return pd.read_sql_query(_stmt(conn, sql), conn, params=params or {})
+    ms = timeout_ms or (REPORT_TIMEOUT_MS if report else QUERY_TIMEOUT_MS)
+    n = max_rows if max_rows is not None else (REPORT_MAX_ROWS if report else 0)
+    q, t0, df = _limited(sql, n), time.monotonic(), None
+    key = hashlib.md5(f"{sql}|{sorted((params or {}).items(), key=str)}".encode()).hexdigest() if report else None
+    try:
+        eng = _report_engine() if report else None
+        if eng is not None:
+            try:
+                with eng.connect() as rc:
+                    df = _read(rc, q, params, ms, rc.dialect.name == "postgresql" and ms != REPORT_TIMEOUT_MS)
+            except (OperationalError, InterfaceError):
+                _mark_replica_down()
+        if df is None:
+            df = _read(conn, q, params, ms, conn.dialect.name == "postgresql" and ms != QUERY_TIMEOUT_MS)
+    except QueryTimeout as e:
+        snap = cache.snapshot(key) if key else None
+        if snap is None: raise
+        df, at = snap
+        df = df.copy(); df.attrs.update(stale=True, as_of=at)
+        _notice(f"⏳ {e} — hiển thị số liệu lưu lúc {at:%H:%M %d/%m}")
+        return df
+    if n and len(df) > n:
+        df = df.iloc[:n].copy(); df.attrs["truncated"] = True
+        _notice(f"✂️ Chỉ hiển thị {n:,} dòng đầu — thu hẹp điều kiện lọc để xem đủ")
+    elif key and (time.monotonic() - t0) * 1000 >= SNAP_MIN_MS and len(df) <= SNAP_MAX_ROWS:
+        cache.save_snapshot(key, df)
+    return df
 
 # ---------- Auth & Audit ----------
 def sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+def is_admin(user: dict) -> bool:
+    return (user.get("role") or "").lower() == "admin"
+
 def write_audit(conn: Connection, action: str, detail: str = ""):
     try:
         run_sql(conn, "INSERT INTO syslog(ts,actor,action,detail) VALUES (NOW(),:u,:a,:d)",
@@ -114,7 +416,13 @@ def header_top(conn: Connection, user: dict):
             if st.button("Đăng xuất", use_container_width=True): logout(conn)
 
 def store_selector(conn: Connection, user: dict):
-    st.sidebar.caption("Kết nối: Postgres (Supabase)")
+    if is_local_mode():
+        from localdb import sync_status
+        s = sync_status(conn)
+        st.sidebar.caption(f"Kết nối: SQLite local • chờ đồng bộ {s['pending']} • xung đột {s['conflicts']}"
+                           + (f" • ⚠️ {s['error']}" if s["error"] else ""))
+    else:
+        st.sidebar.caption("Kết nối: Postgres (Supabase)")
     df = fetch_df(conn, "SELECT code,name FROM stores ORDER BY name")
     labels = ["— Tất cả —"] + [f"{r['code']} — {r['name']}" for _, r in df.iterrows()]
     default_idx = 0
@@ -127,6 +435,23 @@ def store_selector(conn: Connection, user: dict):
     elif "store" in st.session_state:
         del st.session_state["store"]
 
+# ---------- Fragment (rerun từng phần) ----------
+def fragment(fn):
+    """
+    st.fragment cho hàm (conn, ...): đổi widget bên trong chỉ chạy lại hàm này (không login, header,
+    chọn cửa hàng, các tab khác). Rerun riêng fragment thì connection của lần chạy đầy đủ đã trả về
+    pool → mượn connection mới cho lần đó. st.rerun() bên trong vẫn chạy lại cả app (sau khi ghi).
+    """
+    @functools.wraps(fn)
+    def run(conn, *a, **k):
+        try:
+            if not conn.closed: return fn(conn, *a, **k)
+            with get_conn() as c:
+                return fn(c, *a, **k)
+        except QueryTimeout as e:
+            timeout_notice(e)
+    return st.fragment(run)
+
 # ---------- Router ----------
 def router(conn: Connection, user: dict):
     candidates = [
@@ -147,7 +472,8 @@ def router(conn: Connection, user: dict):
     for lbl, fn in visible:
         if lbl == choice:
             if fn in globals() and callable(globals()[fn]):
-                globals()[fn](conn, user)
+                try: globals()[fn](conn, user)
+                except QueryTimeout as e: timeout_notice(e)
             else:
                 st.warning("Module chưa nạp.")
             break
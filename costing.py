@@ -0,0 +1,116 @@
+# costing.py
+# Giá vốn / kg TP và / cốc của mọi CT (CỐT, MỨT) tính bằng ma trận NumPy, không cần ghi lô:
+#   A[f, p] = SL NVL p cho 1 kg TP của CT f (planner.load_dag: HSTH, hoặc hiệu suất thực tế nếu chọn)
+#   c[p]    = giá vốn bình quân hiện tại của NVL (1 query cho mọi NVL, finance.avg_cost_many)
+#   NVL là TP của CT khác (vd CỐT trong MỨT) lấy giá vốn của CT đó: x = A_mua·c + B·x → (I − B)·x = A_mua·c
+# What-if: ghi đè giá từng NVL và/hoặc nhân % theo nhóm (vd trái cây +10%), tính cùng lúc với giá hiện tại.
+import numpy as np
+import pandas as pd
+import streamlit as st
+from core import fetch_df, fragment
+from finance import avg_cost_many
+from planner import load_dag
+from search import products_df
+
+def cost_matrix(conn, actual=False) -> dict:
+    """{"codes": [CT], "pcodes": [NVL], "A": F×P, "make": P (chỉ số CT làm ra NVL, -1 = mua), "cups": F}."""
+    dag = load_dag(conn, actual)
+    codes = sorted(dag["per_kg"])
+    pcodes = sorted({p for need in dag["per_kg"].values() for p in need})
+    fi, pi = {c: i for i, c in enumerate(codes)}, {p: i for i, p in enumerate(pcodes)}
+    r, c, v = [], [], []
+    for ct, need in dag["per_kg"].items():
+        for p, q in need.items():
+            r.append(fi[ct]); c.append(pi[p]); v.append(q)
+    A = np.zeros((len(codes), len(pcodes)))
+    np.add.at(A, (np.array(r, dtype=int), np.array(c, dtype=int)), np.array(v, dtype=float))
+    make = np.array([fi.get(dag["maker"].get(p), -1) for p in pcodes], dtype=int)
+    cups = np.array([dag["cups"][ct] for ct in codes], dtype=float)
+    return {"codes": codes, "pcodes": pcodes, "A": A, "make": make, "cups": cups}
+
+def rollup(A, make, prices, fixed=None):
+    """
+    Giá vốn / kg TP của mọi CT. prices: P (1 kịch bản) hoặc P×K (K kịch bản cùng lúc).
+    fixed: P bool — NVL trung gian nhưng lấy theo giá cho sẵn (ghi đè) thay vì giá CT làm ra nó.
+    """
+    F = A.shape[0]
+    inter = make >= 0
+    if fixed is not None: inter &= ~fixed
+    idx = np.nonzero(inter)[0]
+    M = np.zeros((len(idx), F)); M[np.arange(len(idx)), make[idx]] = 1.0
+    B = A[:, idx] @ M                                   # B[f, g]: kg TP của CT g dùng cho 1 kg TP của f
+    rhs = A[:, ~inter] @ prices[~inter]
+    try:
+        return np.linalg.solve(np.eye(F) - B, rhs)
+    except np.linalg.LinAlgError:
+        raise ValueError("Công thức lặp vòng (CT dùng chính TP của nó qua CT khác)")
+
+def simulate(conn, store=None, overrides=None, cat_factor=None, actual=False):
+    """
+    DF theo CT: ct_code, name, type, output_pcode, cups_per_kg, cost_kg, cost_cup (giá hiện tại),
+    wi_cost_kg, wi_cost_cup, delta_pct (what-if), missing (số NVL chưa có giá).
+    overrides: {pcode: giá}; cat_factor: {cat_code: hệ số} (vd {"TRAI_CAY": 1.1}).
+    actual: định mức theo hiệu suất thực tế thay vì HSTH (planner.load_dag).
+    """
+    m = cost_matrix(conn, actual)
+    cols = ["ct_code","name","type","output_pcode","cups_per_kg","cost_kg","cost_cup",
+            "wi_cost_kg","wi_cost_cup","delta_pct","missing"]
+    if not m["codes"]: return pd.DataFrame(columns=cols)
+    A, make, pcodes = m["A"], m["make"], m["pcodes"]
+    base = np.array([v for v in avg_cost_many(conn, store, pcodes, report=True).values()], dtype=float)
+    wi = base.copy()
+    fixed = np.zeros(len(pcodes), dtype=bool)
+    if cat_factor:
+        cat = products_df(conn).set_index("code")["cat_code"].reindex(pcodes)
+        for k, f in cat_factor.items(): wi[(cat == k).to_numpy()] *= float(f)
+    for p, v in (overrides or {}).items():
+        if p in pcodes:
+            i = pcodes.index(p); wi[i] = float(v); fixed[i] = True
+    x = rollup(A, make, base)
+    xw = rollup(A, make, wi, fixed)
+    cups = m["cups"]
+    per_cup = lambda v: np.divide(v, cups, out=np.full_like(v, np.nan), where=cups > 0)
+    missing = ((A > 0) & (make < 0) & (base <= 0)).sum(axis=1)
+    info = fetch_df(conn, "SELECT code AS ct_code, name, type, output_pcode FROM formulas").set_index("ct_code")
+    df = pd.DataFrame({"ct_code": m["codes"], "cups_per_kg": cups, "cost_kg": x, "cost_cup": per_cup(x),
+                       "wi_cost_kg": xw, "wi_cost_cup": per_cup(xw), "missing": missing})
+    df["delta_pct"] = np.divide(xw - x, x, out=np.zeros_like(x), where=x > 0) * 100
+    df = df.join(info, on="ct_code")
+    return df[cols]
+
+# ===================== GIAO DIỆN =====================
+@fragment
+def tab_costing(conn, user):
+    st.markdown("### 💲 Giá vốn theo công thức (/kg TP, /cốc)")
+    store = None if st.checkbox("Giá bình quân mọi cửa hàng", key="cs_all") else user.get("store")
+    actual = st.checkbox("Theo hiệu suất thực tế (lô đã đóng)", value=False, key="cs_actual")
+    st.caption(f"Giá NVL: bình quân nhập của **{store or 'mọi cửa hàng'}**, chưa nhập có giá → giá tham chiếu. "
+               "NVL là TP của CT khác tính theo giá vốn CT đó. "
+               f"Định mức theo {'hiệu suất thực tế (CT chưa có lô → HSTH)' if actual else 'HSTH của CT'}; "
+               "nhiều nguồn SRC: giả định chia đều kg thô.")
+    c1, c2 = st.columns(2)
+    with c1: fruit = st.number_input("Giá trái cây thay đổi (%)", min_value=-90.0, max_value=500.0, value=0.0, step=5.0, key="cs_fruit")
+    with c2: other = st.number_input("Giá phụ gia thay đổi (%)", min_value=-90.0, max_value=500.0, value=0.0, step=5.0, key="cs_other")
+    overrides = {}
+    with st.expander("Ghi đè giá từng NVL"):
+        ed = st.data_editor(pd.DataFrame({"pcode": pd.Series(dtype=str), "price": pd.Series(dtype=float)}),
+                            num_rows="dynamic", use_container_width=True, key="cs_over",
+                            column_config={"pcode": st.column_config.SelectboxColumn("Mã NVL", options=products_df(conn)["code"].tolist()),
+                                           "price": st.column_config.NumberColumn("Giá giả định", min_value=0.0, step=1000.0)})
+        overrides = {r.pcode: float(r.price) for r in ed.dropna().itertuples()}
+    try:
+        df = simulate(conn, store, overrides, {"TRAI_CAY": 1 + fruit/100, "PHU_GIA": 1 + other/100}, actual)
+    except ValueError as e:
+        st.error(f"❌ {e}"); return
+    if df.empty:
+        st.info("Chưa có công thức."); return
+    types = st.multiselect("Loại CT", sorted(df["type"].dropna().unique()), key="cs_types")
+    if types: df = df[df["type"].isin(types)]
+    st.dataframe(df.sort_values(["type","cost_cup"]).rename(columns={
+        "ct_code": "CT", "name": "Tên CT", "type": "Loại", "output_pcode": "TP", "cups_per_kg": "Cốc/kg",
+        "cost_kg": "Giá vốn/kg", "cost_cup": "Giá vốn/cốc", "wi_cost_kg": "Giả định/kg", "wi_cost_cup": "Giả định/cốc",
+        "delta_pct": "Chênh lệch (%)", "missing": "NVL chưa có giá"}),
+        use_container_width=True, hide_index=True,
+        column_config={c: st.column_config.NumberColumn(format="%.0f") for c in
+                       ["Giá vốn/kg", "Giá vốn/cốc", "Giả định/kg", "Giả định/cốc"]} |
+                      {"Chênh lệch (%)": st.column_config.NumberColumn(format="%.1f")})
@@ -1,62 +1,175 @@
 # finance.py
-from datetime import datetime, date
-import math
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+import os, math
 import streamlit as st
 import pandas as pd
-from core import fetch_df, run_sql, write_audit
+from core import fetch_df, run_sql, exec_sql, write_audit, fragment
+from partitions import ensure_month_partitions, drop_old_partitions, month_add
+from live import watch
+import cache
+
+# Múi giờ chia ngày của báo cáo theo ngày — không phụ thuộc timezone của session / role Postgres
+REPORT_TZ = ZoneInfo(os.getenv("REPORT_TZ", "Asia/Ho_Chi_Minh"))
+
+# Sổ thu chi: tra cứu tương tác (đọc primary để thấy dòng vừa ghi) nhưng khoảng ngày có thể rất rộng
+REV_TIMEOUT_MS = 10000
+REV_MAX_ROWS = 5000
 
 # =========================
 # Helpers: tồn kho & giá trị
 # =========================
-def onhand_qty(conn, store, pcode, to_ts=None):
+def archived_until(conn, store=None, report=False):
+    """
+    Mốc lưu trữ: phát sinh trước thời điểm này đã gộp vào transactions_opening (as_of lớn nhất, theo
+    cửa hàng hoặc mọi cửa hàng); None = chưa lưu trữ. Cache chung, archive_transactions() làm mới.
+    """
+    def load():
+        df = fetch_df(conn, "SELECT MAX(as_of) AS a FROM transactions_opening" + (" WHERE store_code=:s" if store else ""),
+                      {"s": store} if store else None, report=report)
+        a = df.iloc[0]["a"] if not df.empty else None
+        return None if a is None or pd.isna(a) else pd.to_datetime(a, utc=True).tz_localize(None).to_pydatetime()
+    return cache.cached("archive", f"as_of:{store or '*'}", load)
+
+def check_history(conn, store, to_ts, report=False):
+    """to_ts trước mốc lưu trữ → ValueError: phát sinh chi tiết đã xoá, số dư chuyển kỳ chỉ đúng từ mốc đó."""
+    cut = archived_until(conn, store, report) if to_ts else None
+    if cut and to_ts < cut:
+        raise ValueError(f"Phát sinh trước {cut:%d/%m/%Y} đã lưu trữ (chuyển kỳ) — không tính được số liệu "
+                         f"đến {to_ts:%d/%m/%Y}. Chọn ngày từ {cut:%d/%m/%Y} trở đi.")
+
+def onhand_qty(conn, store, pcode, to_ts=None, report=False):
+    """Tồn = số dư chuyển kỳ (transactions_opening) + IN - OUT trên các phân vùng còn lại."""
     params = {"s": store, "p": pcode}
-    where_ts = ""
+    where_ts, where_o = "", ""
     if to_ts:
+        check_history(conn, store, to_ts, report)
         where_ts = " AND ts <= :t "
+        where_o = " AND as_of <= :t "
         params["t"] = to_ts
     df = fetch_df(conn, f"""
-        SELECT
-          COALESCE(SUM(CASE WHEN type='IN'  THEN qty ELSE 0 END),0) -
-          COALESCE(SUM(CASE WHEN type='OUT' THEN qty ELSE 0 END),0) AS onhand
-        FROM transactions
-        WHERE store_code=:s AND pcode=:p {where_ts}
-    """, params)
+        SELECT COALESCE(SUM(q),0) AS onhand FROM (
+          SELECT CASE WHEN type='IN' THEN qty WHEN type='OUT' THEN -qty ELSE 0 END AS q
+          FROM transactions
+          WHERE store_code=:s AND pcode=:p {where_ts}
+          UNION ALL
+          SELECT qty_in - qty_out
+          FROM transactions_opening
+          WHERE store_code=:s AND pcode=:p {where_o}
+        ) x
+    """, params, report=report)
     return 0.0 if df.empty else float(df.iloc[0]["onhand"] or 0.0)
 
-def avg_cost(conn, store, pcode, to_ts=None):
-    """Bình quân gia quyền theo các dòng IN đến thời điểm to_ts (nếu có)."""
+def onhand_many(conn, store, pcodes, to_ts=None, report=False) -> dict:
+    """Tồn của nhiều SP trong 1 query: {pcode: qty} (SP không phát sinh → 0)."""
+    pcodes = list(dict.fromkeys(pcodes))
+    if not pcodes: return {}
+    params = {"s": store, "codes": pcodes}
+    where_ts, where_o = "", ""
+    if to_ts:
+        check_history(conn, store, to_ts, report)
+        where_ts = " AND ts <= :t "
+        where_o = " AND as_of <= :t "
+        params["t"] = to_ts
+    df = fetch_df(conn, f"""
+        SELECT pcode, COALESCE(SUM(q),0) AS onhand FROM (
+          SELECT pcode, CASE WHEN type='IN' THEN qty WHEN type='OUT' THEN -qty ELSE 0 END AS q
+          FROM transactions
+          WHERE store_code=:s AND pcode = ANY(:codes) {where_ts}
+          UNION ALL
+          SELECT pcode, qty_in - qty_out
+          FROM transactions_opening
+          WHERE store_code=:s AND pcode = ANY(:codes) {where_o}
+        ) x
+        GROUP BY pcode
+    """, params, report=report)
+    out = dict.fromkeys(pcodes, 0.0)
+    out.update({r["pcode"]: float(r["onhand"] or 0.0) for _, r in df.iterrows()})
+    return out
+
+def avg_cost(conn, store, pcode, to_ts=None, report=False):
+    """Bình quân gia quyền theo các dòng IN (kể cả phần đã chuyển kỳ) đến thời điểm to_ts (nếu có)."""
     params = {"s": store, "p": pcode}
-    where_ts = ""
+    where_ts, where_o = "", ""
     if to_ts:
+        check_history(conn, store, to_ts, report)
         where_ts = " AND ts <= :t "
+        where_o = " AND as_of <= :t "
         params["t"] = to_ts
     df = fetch_df(conn, f"""
-        SELECT SUM(qty*price_in) AS cost, SUM(qty) AS qty
-        FROM transactions
-        WHERE store_code=:s AND pcode=:p AND type='IN'
-              AND price_in IS NOT NULL AND price_in>0 {where_ts}
-    """, params)
+        SELECT SUM(cost) AS cost, SUM(qty) AS qty FROM (
+          SELECT qty*price_in AS cost, qty
+          FROM transactions
+          WHERE store_code=:s AND pcode=:p AND type='IN'
+                AND price_in IS NOT NULL AND price_in>0 {where_ts}
+          UNION ALL
+          SELECT cost_in, qty_in_priced
+          FROM transactions_opening
+          WHERE store_code=:s AND pcode=:p {where_o}
+        ) x
+    """, params, report=report)
     if df.empty: 
-        pr = fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode})
+        pr = fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode}, report=report)
         return float(pr.iloc[0]["price_ref"] or 0.0) if not pr.empty else 0.0
     cost = float(df.iloc[0]["cost"] or 0.0); qty = float(df.iloc[0]["qty"] or 0.0)
     if qty > 0:
         return cost/qty
-    pr = fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode})
+    pr = fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode}, report=report)
     return float(pr.iloc[0]["price_ref"] or 0.0) if not pr.empty else 0.0
 
-def inv_valuation(conn, store, to_ts=None):
-    """Trả về DF: pcode, name, cat_code, onhand, avg_cost, value, cups (nếu có)."""
+def avg_cost_many(conn, store, pcodes, to_ts=None, report=False) -> dict:
+    """Như avg_cost cho nhiều SP trong 1 query: {pcode: giá}. store=None → bình quân mọi cửa hàng."""
+    pcodes = list(dict.fromkeys(pcodes))
+    if not pcodes: return {}
+    params = {"codes": pcodes}
+    where_s, where_ts, where_o = "", "", ""
+    if store:
+        where_s = " AND store_code=:s "; params["s"] = store
+    if to_ts:
+        check_history(conn, store, to_ts, report)
+        where_ts = " AND ts <= :t "
+        where_o = " AND as_of <= :t "
+        params["t"] = to_ts
+    df = fetch_df(conn, f"""
+        SELECT p.code AS pcode, p.price_ref, x.cost, x.qty
+        FROM products p
+        LEFT JOIN (
+          SELECT pcode, SUM(cost) AS cost, SUM(qty) AS qty FROM (
+            SELECT pcode, qty*price_in AS cost, qty
+            FROM transactions
+            WHERE pcode = ANY(:codes) AND type='IN' AND price_in IS NOT NULL AND price_in>0 {where_s} {where_ts}
+            UNION ALL
+            SELECT pcode, cost_in, qty_in_priced
+            FROM transactions_opening
+            WHERE pcode = ANY(:codes) {where_s} {where_o}
+          ) t GROUP BY pcode
+        ) x ON x.pcode=p.code
+        WHERE p.code = ANY(:codes)
+    """, params, report=report)
+    out = dict.fromkeys(pcodes, 0.0)
+    for r in df.itertuples():
+        qty = float(r.qty) if pd.notna(r.qty) else 0.0
+        out[r.pcode] = float(r.cost)/qty if qty > 0 else (float(r.price_ref) if pd.notna(r.price_ref) else 0.0)
+    return out
+
+def inv_valuation(conn, store, to_ts=None, report=True):
+    """Trả về DF: pcode, name, cat_code, onhand, avg_cost, value, cups (nếu có). Mặc định đọc replica."""
     # lấy danh sách sản phẩm có phát sinh hoặc có onhand > 0
     params = {"s": store}
     where_ts = "" if not to_ts else " AND ts <= :t "
+    where_o = "" if not to_ts else " AND as_of <= :t "
     if to_ts: params["t"] = to_ts
+    check_history(conn, store, to_ts, report)
 
     df_codes = fetch_df(conn, f"""
         SELECT DISTINCT pcode
         FROM transactions
         WHERE store_code=:s {where_ts}
-    """, params)
+        UNION
+        SELECT pcode
+        FROM transactions_opening
+        WHERE store_code=:s {where_o}
+    """, params, report=report)
 
     if df_codes.empty:
         return pd.DataFrame(columns=["code","name","cat_code","onhand","avg_cost","value","cups"])
@@ -67,14 +180,14 @@ def inv_valuation(conn, store, to_ts=None):
         FROM products
         WHERE code = ANY(:codes)
         ORDER BY name
-    """, {"codes": list(pcodes)})
+    """, {"codes": list(pcodes)}, report=report)
 
     rows = []
     for r in df_p.itertuples():
-        q = onhand_qty(conn, store, r.code, to_ts=to_ts)
+        q = onhand_qty(conn, store, r.code, to_ts=to_ts, report=report)
         if abs(q) < 1e-9:
             continue
-        c = avg_cost(conn, store, r.code, to_ts=to_ts)
+        c = avg_cost(conn, store, r.code, to_ts=to_ts, report=report)
         v = q * c
         cups = (q * float(r.cups_per_kg or 0.0)) if (r.cat_code in ["COT","MUT"]) else 0
         rows.append({"code": r.code, "name": r.name, "cat_code": r.cat_code,
@@ -85,18 +198,117 @@ def inv_valuation(conn, store, to_ts=None):
         df["avg_cost"] = df["avg_cost"].round(0)
     return df
 
+def inv_daily_series(conn, store, d_from, d_to, report=True):
+    """
+    Tồn & giá trị cuối mỗi ngày trong [d_from, d_to] theo (store_code, pcode); store=None → mọi cửa hàng.
+    1 query: phát sinh trước d_from dồn về 1 mốc đầu kỳ, gộp theo ngày rồi SUM() OVER cộng dồn;
+    pandas điền các ngày không phát sinh và tính giá vốn bình quân (như avg_cost, fallback price_ref).
+    Trả về DF: d, store_code, pcode, name, cat_code, onhand, avg_cost, value (bỏ dòng tồn = 0).
+    """
+    check_history(conn, store, datetime.combine(d_from, datetime.max.time()), report)
+    d0 = datetime.combine(d_from - timedelta(days=1), datetime.min.time())
+    # mốc ngày theo REPORT_TZ truyền kèm múi giờ; DATE_TRUNC 3 tham số chia ngày theo REPORT_TZ
+    params = {"d0": d0.replace(tzinfo=REPORT_TZ), "t": datetime.combine(d_to, datetime.max.time(), tzinfo=REPORT_TZ),
+              "tz": str(REPORT_TZ)}
+    ws = ""
+    if store:
+        ws = " AND store_code=:s "; params["s"] = store
+    df = fetch_df(conn, f"""
+        WITH src AS (
+          SELECT store_code, pcode, ts,
+                 CASE WHEN type='IN' THEN qty WHEN type='OUT' THEN -qty ELSE 0 END AS dq,
+                 CASE WHEN type='IN' AND price_in>0 THEN qty*price_in ELSE 0 END AS dc,
+                 CASE WHEN type='IN' AND price_in>0 THEN qty ELSE 0 END AS dpq
+          FROM transactions
+          WHERE ts <= :t {ws}
+          UNION ALL
+          SELECT store_code, pcode, as_of, qty_in - qty_out, cost_in, qty_in_priced
+          FROM transactions_opening
+          WHERE as_of <= :t {ws}
+        ), daily AS (
+          SELECT store_code, pcode, GREATEST(DATE_TRUNC('day', ts, :tz), :d0) AS d,
+                 SUM(dq) AS dq, SUM(dc) AS dc, SUM(dpq) AS dpq
+          FROM src
+          GROUP BY 1, 2, 3
+        )
+        SELECT store_code, pcode, d,
+               SUM(dq)  OVER w AS onhand,
+               SUM(dc)  OVER w AS cost_in,
+               SUM(dpq) OVER w AS qty_in_priced
+        FROM daily
+        WINDOW w AS (PARTITION BY store_code, pcode ORDER BY d)
+    """, params, report=report)
+    cols = ["d","store_code","pcode","name","cat_code","onhand","avg_cost","value"]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+
+    # Lưới đủ ngày × (store, pcode), điền tiếp số cộng dồn của ngày có phát sinh gần nhất
+    df["d"] = pd.to_datetime(df["d"], utc=True).dt.tz_convert(REPORT_TZ).dt.tz_localize(None).dt.normalize()
+    days = pd.date_range(d0, pd.Timestamp(d_to), freq="D")
+    keys = df[["store_code","pcode"]].drop_duplicates()
+    grid = pd.MultiIndex.from_frame(keys.merge(pd.DataFrame({"d": days}), how="cross")[["store_code","pcode","d"]])
+    df = (df.set_index(["store_code","pcode","d"])[["onhand","cost_in","qty_in_priced"]]
+            .astype(float).reindex(grid))
+    df = df.groupby(level=["store_code","pcode"]).ffill().fillna(0.0).reset_index()
+    df = df[(df["d"] > d0) & (df["onhand"].abs() >= 1e-9)]
+
+    df_p = fetch_df(conn, "SELECT code AS pcode,name,cat_code,price_ref FROM products WHERE code = ANY(:codes)",
+                    {"codes": keys["pcode"].unique().tolist()}, report=report)
+    df = df.merge(df_p, on="pcode", how="left")
+    price_ref = pd.to_numeric(df["price_ref"], errors="coerce").fillna(0.0)
+    df["avg_cost"] = (df["cost_in"] / df["qty_in_priced"].where(df["qty_in_priced"] > 0)).fillna(price_ref)
+    df["value"] = (df["onhand"] * df["avg_cost"]).round(0)
+    df["avg_cost"] = df["avg_cost"].round(0)
+    df["d"] = df["d"].dt.date
+    return df[cols].sort_values(["d","store_code","pcode"]).reset_index(drop=True)
+
+# =========================
+# Lưu trữ kỳ đã khoá (transactions)
+# =========================
+def _carry_forward(conn, name, month):
+    """Gộp 1 phân vùng tháng vào transactions_opening (chạy trong transaction DETACH/DROP)."""
+    exec_sql(conn, f"""
+        INSERT INTO transactions_opening(store_code,pcode,as_of,qty_in,qty_out,cost_in,qty_in_priced)
+        SELECT store_code, pcode, CAST(:b AS timestamptz),
+               COALESCE(SUM(CASE WHEN type='IN'  THEN qty ELSE 0 END),0),
+               COALESCE(SUM(CASE WHEN type='OUT' THEN qty ELSE 0 END),0),
+               COALESCE(SUM(CASE WHEN type='IN' AND price_in>0 THEN qty*price_in ELSE 0 END),0),
+               COALESCE(SUM(CASE WHEN type='IN' AND price_in>0 THEN qty ELSE 0 END),0)
+        FROM {name}
+        GROUP BY store_code, pcode
+        ON CONFLICT (store_code,pcode) DO UPDATE SET
+          as_of         = GREATEST(transactions_opening.as_of, EXCLUDED.as_of),
+          qty_in        = transactions_opening.qty_in        + EXCLUDED.qty_in,
+          qty_out       = transactions_opening.qty_out       + EXCLUDED.qty_out,
+          cost_in       = transactions_opening.cost_in       + EXCLUDED.cost_in,
+          qty_in_priced = transactions_opening.qty_in_priced + EXCLUDED.qty_in_priced
+    """, {"b": month_add(month, 1)})
+
+def archive_transactions(conn, keep_months: int = 12, archive_dir: str = None) -> list:
+    """
+    Lưu trữ các tháng cũ hơn keep_months: COPY ra .csv.gz, cộng dồn vào transactions_opening
+    rồi DETACH/DROP phân vùng. Tồn & giá vốn tính từ sau kỳ lưu trữ không đổi.
+    """
+    archive_dir = archive_dir or os.path.join(os.getenv("ARCHIVE_DIR", "archive"), "transactions")
+    ensure_month_partitions(conn, "transactions")
+    done = drop_old_partitions(conn, "transactions", keep_months, archive_dir=archive_dir,
+                               before_drop=_carry_forward)
+    cache.bump("archive")
+    return done
+
 # =========================
 # Doanh thu (Sổ quỹ)
 # =========================
+@fragment
 def tab_revenue(conn, user):
     st.markdown("### 💰 Doanh thu (Sổ quỹ)")
     st.caption("Chỉ thu **Tiền mặt** hoặc **Chuyển khoản**. Không gắn doanh số theo sản phẩm.")
 
     d1, d2 = st.columns(2)
     with d1:
-        dt_from = st.date_input("Từ ngày", value=date.today().replace(day=1))
+        dt_from = st.date_input("Từ ngày", value=date.today().replace(day=1), key="rev_from")
     with d2:
-        dt_to   = st.date_input("Đến ngày", value=date.today())
+        dt_to   = st.date_input("Đến ngày", value=date.today(), key="rev_to")
 
     method = st.radio("Kênh thu", ["Tất cả","Tiền mặt","Chuyển khoản"], horizontal=True)
     store = st.session_state.get("store", "")
@@ -122,14 +334,15 @@ def tab_revenue(conn, user):
         FROM cashbook
         {where}
         ORDER BY ts DESC
-    """, params)
+    """, params, timeout_ms=REV_TIMEOUT_MS, max_rows=REV_MAX_ROWS)
     st.dataframe(df, use_container_width=True, height=320)
+    if df.attrs.get("truncated"): st.caption(f"Hiển thị {REV_MAX_ROWS:,} dòng mới nhất — thu hẹp khoảng ngày để xem hết.")
 
     st.markdown("#### ➕ Thêm / sửa")
     with st.form("fm_rev", clear_on_submit=True):
         c1,c2,c3 = st.columns([1,1,2])
         with c1:
-            ts = st.date_input("Ngày", value=date.today())
+            ts = st.date_input("Ngày", value=date.today(), key="rev_ts")
             kieu = st.selectbox("Thu/Chi", ["Thu","Chi"])
         with c2:
             method2 = st.selectbox("Kênh", ["Tiền mặt","Chuyển khoản"])
@@ -170,109 +383,145 @@ def tab_revenue(conn, user):
 # =========================
 def tab_reports(conn, user):
     st.markdown("### 📈 Báo cáo")
-    sub = st.tabs(["Tồn kho (có giá trị)","Cân đối kế toán","Lưu chuyển tiền tệ"])
-
-    # ----- Tồn kho có giá trị -----
-    with sub[0]:
-        to_date = st.date_input("Tính đến ngày", value=date.today())
-        to_ts = datetime.combine(to_date, datetime.max.time())
-        store = st.session_state.get("store","")
-        st.caption(f"Cửa hàng: **{store or '— Tất cả —'}** (báo cáo theo cửa hàng hiện chọn)")
-        if not store:
-            st.warning("Chọn 1 cửa hàng ở sidebar để tính tồn giá trị."); return
-        df = inv_valuation(conn, store, to_ts=to_ts)
-        if df.empty:
-            st.info("Không có tồn."); 
-        else:
-            df_show = df.rename(columns={"code":"Mã","name":"Tên","cat_code":"Nhóm",
-                                         "onhand":"SL tồn","avg_cost":"Giá vốn","value":"Giá trị","cups":"Số cốc (ước)"})
-            st.dataframe(df_show, use_container_width=True)
-            st.success(f"**Tổng giá trị tồn**: {df['value'].sum():,.0f}")
-
-    # ----- Cân đối kế toán -----
-    with sub[1]:
-        to_date = st.date_input("Tính đến ngày (BS)", value=date.today(), key="bs_date")
-        to_ts = datetime.combine(to_date, datetime.max.time())
-        store = st.session_state.get("store","")
-
-        # Tiền (cashbook)
-        params = {"t": to_ts}
-        wh = " WHERE ts<=:t "
-        if store:
-            wh += " AND store_code=:s "; params["s"] = store
-        df_cash = fetch_df(conn, f"""
-            SELECT
-              COALESCE(SUM(CASE WHEN io='IN'  THEN amount ELSE 0 END),0) -
-              COALESCE(SUM(CASE WHEN io='OUT' THEN amount ELSE 0 END),0) AS bal
-            FROM cashbook
-            {wh}
-        """, params)
-        cash_bal = 0.0 if df_cash.empty else float(df_cash.iloc[0]["bal"] or 0.0)
-
-        # Hàng tồn kho
-        inv_val = 0.0
-        if store:
+    sub = st.tabs(["Tồn kho (có giá trị)","Giá trị tồn theo ngày","Cân đối kế toán","Lưu chuyển tiền tệ"])
+    with sub[0]: _rep_stock(conn)
+    with sub[1]: _rep_series(conn)
+    with sub[2]: _rep_balance(conn)
+    with sub[3]: _rep_cashflow(conn)
+
+# ----- Tồn kho có giá trị -----
+@fragment
+def _rep_stock(conn):
+    to_date = st.date_input("Tính đến ngày", value=date.today())
+    to_ts = datetime.combine(to_date, datetime.max.time())
+    store = st.session_state.get("store","")
+    st.caption(f"Cửa hàng: **{store or '— Tất cả —'}** (báo cáo theo cửa hàng hiện chọn)")
+    try:
+        df = inv_valuation(conn, store, to_ts=to_ts) if store else None
+    except ValueError as e:
+        st.error(f"❌ {e}"); return
+    if df is None:
+        st.warning("Chọn 1 cửa hàng ở sidebar để tính tồn giá trị.")
+    elif df.empty:
+        st.info("Không có tồn."); 
+    else:
+        df_show = df.rename(columns={"code":"Mã","name":"Tên","cat_code":"Nhóm",
+                                     "onhand":"SL tồn","avg_cost":"Giá vốn","value":"Giá trị","cups":"Số cốc (ước)"})
+        st.dataframe(df_show, use_container_width=True)
+        st.success(f"**Tổng giá trị tồn**: {df['value'].sum():,.0f}")
+
+# ----- Giá trị tồn theo ngày -----
+@fragment
+def _rep_series(conn):
+    d1, d2 = st.columns(2)
+    with d1: from_date = st.date_input("Từ ngày (tồn)", value=date.today() - timedelta(days=29), key="ser_from")
+    with d2: to_date   = st.date_input("Đến ngày (tồn)", value=date.today(), key="ser_to")
+    store = st.session_state.get("store","")
+    st.caption(f"Cửa hàng: **{store or '— Tất cả —'}**")
+    try:
+        df = inv_daily_series(conn, store or None, from_date, to_date)
+    except ValueError as e:
+        st.error(f"❌ {e}"); return
+    if df.empty:
+        st.info("Không có tồn.")
+    else:
+        tot = df.pivot_table(index="d", columns="store_code", values="value", aggfunc="sum").fillna(0)
+        st.line_chart(tot)
+        st.success(f"**Giá trị tồn ngày {to_date:%d/%m/%Y}**: {tot.iloc[-1].sum():,.0f}")
+        with st.expander("Chi tiết theo sản phẩm"):
+            st.dataframe(df.rename(columns={"d":"Ngày","store_code":"CH","pcode":"Mã","name":"Tên","cat_code":"Nhóm",
+                                            "onhand":"SL tồn","avg_cost":"Giá vốn","value":"Giá trị"}),
+                         use_container_width=True, hide_index=True)
+
+# ----- Cân đối kế toán -----
+@fragment
+def _rep_balance(conn):
+    to_date = st.date_input("Tính đến ngày (BS)", value=date.today(), key="bs_date")
+    to_ts = datetime.combine(to_date, datetime.max.time())
+    store = st.session_state.get("store","")
+
+    # Tiền (cashbook)
+    params = {"t": to_ts}
+    wh = " WHERE ts<=:t "
+    if store:
+        wh += " AND store_code=:s "; params["s"] = store
+    df_cash = fetch_df(conn, f"""
+        SELECT
+          COALESCE(SUM(CASE WHEN io='IN'  THEN amount ELSE 0 END),0) -
+          COALESCE(SUM(CASE WHEN io='OUT' THEN amount ELSE 0 END),0) AS bal
+        FROM cashbook
+        {wh}
+    """, params, report=True)
+    cash_bal = 0.0 if df_cash.empty else float(df_cash.iloc[0]["bal"] or 0.0)
+
+    # Hàng tồn kho
+    inv_val = 0.0
+    if store:
+        try:
             df_val = inv_valuation(conn, store, to_ts=to_ts)
-            inv_val = 0.0 if df_val.empty else float(df_val["value"].sum())
-
-        # TSCĐ (nguyên giá & KH lũy kế đến ngày)
-        df_assets = fetch_df(conn, """
-            SELECT id, name, cost, start_date, life_months, salvage, method
-            FROM assets
-            WHERE (:s IS NULL OR store_code=:s)
-        """, {"s": store if store else None})
-        gross = float(df_assets["cost"].sum() or 0.0) if not df_assets.empty else 0.0
-        dep = 0.0
-        if not df_assets.empty:
-            for _,a in df_assets.iterrows():
-                dep += _accum_dep_till(a, to_ts)
-
-        tscd_net = max(gross - dep, 0.0)
-
-        assets_total = cash_bal + inv_val + tscd_net
-        equity = assets_total  # chưa xét nợ phải trả → vốn CSH = tổng TS
-
-        st.subheader("Cân đối")
-        st.markdown(f"""
-        **Tài sản:**
-        - Tiền: **{cash_bal:,.0f}**
-        - Hàng tồn kho (giá vốn): **{inv_val:,.0f}**
-        - TSCĐ (nguyên giá): **{gross:,.0f}**
-        - Khấu hao lũy kế: **{dep:,.0f}**
-        - TSCĐ thuần: **{tscd_net:,.0f}**
-
-        **Tổng tài sản:** **{assets_total:,.0f}**
-
-        **Nguồn vốn:**
-        - Vốn CSH (tạm tính): **{equity:,.0f}**
-        """)
-
-    # ----- Lưu chuyển tiền tệ -----
-    with sub[2]:
-        d1, d2 = st.columns(2)
-        with d1: from_date = st.date_input("Từ ngày (CF)", value=date.today().replace(day=1))
-        with d2: to_date   = st.date_input("Đến ngày (CF)", value=date.today())
-        store = st.session_state.get("store","")
-        params = {"f": datetime.combine(from_date, datetime.min.time()),
-                  "t": datetime.combine(to_date, datetime.max.time())}
-        wh = " WHERE ts BETWEEN :f AND :t "
-        if store:
-            wh += " AND store_code=:s "; params["s"] = store
-        df = fetch_df(conn, f"""
-            SELECT DATE_TRUNC('day', ts) AS d, io, SUM(amount) AS amt
-            FROM cashbook
-            {wh}
-            GROUP BY 1,2
-            ORDER BY 1
-        """, params)
-        if df.empty:
-            st.info("Không có phát sinh."); return
-        pv = df.pivot_table(index="d", columns="io", values="amt", aggfunc="sum").fillna(0)
-        pv["NET"] = pv.get("IN",0) - pv.get("OUT",0)
-        st.dataframe(pv, use_container_width=True)
-        st.success(f"**Tổng Thu:** {pv.get('IN',pd.Series([0])).sum():,.0f} — "
-                   f"**Tổng Chi:** {pv.get('OUT',pd.Series([0])).sum():,.0f} — "
-                   f"**Dòng tiền thuần:** {pv['NET'].sum():,.0f}")
+        except ValueError as e:
+            st.error(f"❌ {e}"); return
+        inv_val = 0.0 if df_val.empty else float(df_val["value"].sum())
+
+    # TSCĐ (nguyên giá & KH lũy kế đến ngày)
+    df_assets = fetch_df(conn, """
+        SELECT id, name, cost, start_date, life_months, salvage, method
+        FROM assets
+        WHERE (:s IS NULL OR store_code=:s)
+    """, {"s": store if store else None}, report=True)
+    gross = float(df_assets["cost"].sum() or 0.0) if not df_assets.empty else 0.0
+    dep = 0.0
+    if not df_assets.empty:
+        for _,a in df_assets.iterrows():
+            dep += _accum_dep_till(a, to_ts)
+
+    tscd_net = max(gross - dep, 0.0)
+
+    assets_total = cash_bal + inv_val + tscd_net
+    equity = assets_total  # chưa xét nợ phải trả → vốn CSH = tổng TS
+
+    st.subheader("Cân đối")
+    st.markdown(f"""
+    **Tài sản:**
+    - Tiền: **{cash_bal:,.0f}**
+    - Hàng tồn kho (giá vốn): **{inv_val:,.0f}**
+    - TSCĐ (nguyên giá): **{gross:,.0f}**
+    - Khấu hao lũy kế: **{dep:,.0f}**
+    - TSCĐ thuần: **{tscd_net:,.0f}**
+
+    **Tổng tài sản:** **{assets_total:,.0f}**
+
+    **Nguồn vốn:**
+    - Vốn CSH (tạm tính): **{equity:,.0f}**
+    """)
+
+# ----- Lưu chuyển tiền tệ -----
+@fragment
+def _rep_cashflow(conn):
+    d1, d2 = st.columns(2)
+    with d1: from_date = st.date_input("Từ ngày (CF)", value=date.today().replace(day=1))
+    with d2: to_date   = st.date_input("Đến ngày (CF)", value=date.today())
+    store = st.session_state.get("store","")
+    params = {"f": datetime.combine(from_date, datetime.min.time()),
+              "t": datetime.combine(to_date, datetime.max.time())}
+    wh = " WHERE ts BETWEEN :f AND :t "
+    if store:
+        wh += " AND store_code=:s "; params["s"] = store
+    df = fetch_df(conn, f"""
+        SELECT DATE_TRUNC('day', ts) AS d, io, SUM(amount) AS amt
+        FROM cashbook
+        {wh}
+        GROUP BY 1,2
+        ORDER BY 1
+    """, params, report=True)
+    if df.empty:
+        st.info("Không có phát sinh."); return
+    pv = df.pivot_table(index="d", columns="io", values="amt", aggfunc="sum").fillna(0)
+    pv["NET"] = pv.get("IN",0) - pv.get("OUT",0)
+    st.dataframe(pv, use_container_width=True)
+    st.success(f"**Tổng Thu:** {pv.get('IN',pd.Series([0])).sum():,.0f} — "
+               f"**Tổng Chi:** {pv.get('OUT',pd.Series([0])).sum():,.0f} — "
+               f"**Dòng tiền thuần:** {pv['NET'].sum():,.0f}")
 
 # =========================
 # TSCD
@@ -356,11 +605,12 @@ def tab_assets(conn, user):
 # =========================
 # Lương (đơn giản, ghi vào quỹ)
 # =========================
+@fragment
 def tab_payroll(conn, user):
     st.markdown("### 👥 Lương nhân viên (đơn giản)")
     d1, d2 = st.columns(2)
-    with d1: dt_from = st.date_input("Từ ngày", value=date.today().replace(day=1))
-    with d2: dt_to   = st.date_input("Đến ngày", value=date.today())
+    with d1: dt_from = st.date_input("Từ ngày", value=date.today().replace(day=1), key="pay_from")
+    with d2: dt_to   = st.date_input("Đến ngày", value=date.today(), key="pay_to")
 
     store = st.session_state.get("store", "")
     params = {"f": datetime.combine(dt_from, datetime.min.time()),
@@ -379,7 +629,7 @@ def tab_payroll(conn, user):
     with st.form("fm_pay", clear_on_submit=True):
         c1,c2,c3 = st.columns([1,1,2])
         with c1:
-            ts = st.date_input("Ngày", value=date.today())
+            ts = st.date_input("Ngày", value=date.today(), key="pay_ts")
             staff = st.text_input("Nhân viên")
         with c2:
             amount = st.number_input("Số tiền", min_value=0.0, step=100_000.0)
@@ -418,6 +668,7 @@ def tab_payroll(conn, user):
 # =========================
 def page_finance(conn, user):
     st.markdown("## 💼 Tài chính")
+    watch(st.session_state.get("store"), ["cash", "stock"], "fin")
     tabs = st.tabs(["Doanh thu", "Báo cáo", "TSCD", "Lương"])
     with tabs[0]:
         tab_revenue(conn, user)
@@ -1,22 +1,27 @@
 # inventory.py
+import uuid
 from datetime import datetime, date
 import streamlit as st
 import pandas as pd
-from core import fetch_df, run_sql, write_audit
-from finance import avg_cost, inv_valuation, onhand_qty
+from core import fetch_df, run_sql, exec_sql, tx, write_audit, fragment
+from finance import avg_cost, inv_valuation, onhand_qty, onhand_many
+from replenish import HORIZON, reorder_table
+from live import watch, on_change
+from search import product_picker, products_df
+import cache
 
 # ===============================
 # Nhập kho
 # ===============================
+@fragment
 def tab_in(conn, user):
     st.subheader("📥 Nhập kho")
     store = st.session_state.get("store","")
-    dfp = fetch_df(conn, "SELECT code,name,cat_code,uom,cups_per_kg FROM products ORDER BY name")
-    opts = ["— Chọn —"] + [f"{r['code']} — {r['name']}" for _,r in dfp.iterrows()]
-    pick = st.selectbox("Sản phẩm nhập", opts, key="in_pick")
-    if pick=="— Chọn —": return
-    pcode = pick.split(" — ",1)[0]
-    row = dfp[dfp["code"]==pcode].iloc[0].to_dict()
+    if st.radio("Cách nhập", DOC_MODES, horizontal=True, key="in_mode") == DOC_MODES[1]:
+        _doc_form(conn, store, "IN"); return
+    row = product_picker(conn, "Sản phẩm nhập", "in_pick")
+    if not row: return
+    pcode = row["code"]
 
     qty  = st.number_input(f"Số lượng ({row['uom']})", min_value=0.0, step=0.1)
     price= st.number_input("Đơn giá nhập", min_value=0.0, step=1000.0)
@@ -28,20 +33,21 @@ def tab_in(conn, user):
             VALUES (:s,:p,:q,'IN',:pr,:n,NOW())
         """, {"s": store, "p": pcode, "q": qty, "pr": price, "n": note})
         write_audit(conn, "INVENTORY_IN", f"{pcode}-{qty}-{price}")
+        stock_changed(store)
         st.success("Đã nhập kho"); st.rerun()
 
 # ===============================
 # Xuất kho
 # ===============================
+@fragment
 def tab_out(conn, user):
     st.subheader("📤 Xuất kho")
     store = st.session_state.get("store","")
-    dfp = fetch_df(conn, "SELECT code,name,cat_code,uom FROM products ORDER BY name")
-    opts = ["— Chọn —"] + [f"{r['code']} — {r['name']}" for _,r in dfp.iterrows()]
-    pick = st.selectbox("Sản phẩm xuất", opts, key="out_pick")
-    if pick=="— Chọn —": return
-    pcode = pick.split(" — ",1)[0]
-    row = dfp[dfp["code"]==pcode].iloc[0].to_dict()
+    if st.radio("Cách xuất", DOC_MODES, horizontal=True, key="out_mode") == DOC_MODES[1]:
+        _doc_form(conn, store, "OUT"); return
+    row = product_picker(conn, "Sản phẩm xuất", "out_pick")
+    if not row: return
+    pcode = row["code"]
 
     qty  = st.number_input(f"Số lượng ({row['uom']})", min_value=0.0, step=0.1)
     note = st.text_input("Lý do xuất")
@@ -56,11 +62,84 @@ def tab_out(conn, user):
             VALUES (:s,:p,:q,'OUT',:n,NOW())
         """, {"s": store, "p": pcode, "q": qty, "n": note})
         write_audit(conn, "INVENTORY_OUT", f"{pcode}-{qty}")
+        stock_changed(store)
         st.success("Đã xuất kho"); st.rerun()
 
+# ===============================
+# Phiếu nhập / xuất nhiều dòng
+# ===============================
+DOC_MODES = ["Từng SP", "Phiếu nhiều dòng"]
+
+def post_document(conn, store, typ, lines, note="") -> str:
+    """
+    Ghi 1 phiếu IN/OUT nhiều dòng (list dict pcode, qty, price) trong 1 transaction: phiếu xuất kiểm tồn
+    cả phiếu bằng 1 query (onhand_many, cộng dồn SP lặp dòng), rồi 1 lệnh INSERT nhiều dòng chung doc_id
+    (sql/008_transactions_doc_id.sql). Thiếu tồn → ValueError, không ghi gì. Trả về doc_id.
+    """
+    lines = [l for l in lines if float(l.get("qty") or 0) > 0]
+    if not lines: raise ValueError("Phiếu không có dòng nào")
+    doc = f"{'PN' if typ == 'IN' else 'PX'}-{store}-{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:4]}"
+    ps = [l["pcode"] for l in lines]; qs = [float(l["qty"]) for l in lines]
+    prs = [(float(l["price"]) if pd.notna(l.get("price")) else 0.0) if typ == "IN" else None for l in lines]
+    with tx(conn):
+        if typ == "OUT":
+            need = {}
+            for p, q in zip(ps, qs): need[p] = need.get(p, 0.0) + q
+            have = onhand_many(conn, store, list(need))
+            short = [f"{p} (tồn {have[p]:g}, cần {q:g})" for p, q in need.items() if q > have[p] + 1e-9]
+            if short: raise ValueError("Không đủ tồn: " + ", ".join(short))
+        if conn.dialect.name == "sqlite":   # chế độ local: không có unnest
+            for p, q, pr in zip(ps, qs, prs):
+                exec_sql(conn, """
+                    INSERT INTO transactions(store_code,pcode,qty,type,price_in,note,ts,doc_id)
+                    VALUES (:s,:p,:q,:t,:pr,:n,NOW(),:d)
+                """, {"s": store, "p": p, "q": q, "t": typ, "pr": pr, "n": note, "d": doc})
+        else:
+            exec_sql(conn, """
+                INSERT INTO transactions(store_code,pcode,qty,type,price_in,note,ts,doc_id)
+                SELECT :s, u.p, u.q, :t, u.pr, :n, NOW(), :d
+                FROM unnest(CAST(:ps AS text[]), CAST(:qs AS numeric[]), CAST(:prs AS numeric[])) AS u(p, q, pr)
+            """, {"s": store, "t": typ, "n": note, "d": doc, "ps": ps, "qs": qs, "prs": prs})
+    stock_changed(store)
+    return doc
+
+def _doc_form(conn, store, typ):
+    """Lưới nhập dòng phiếu (sửa phía trình duyệt, không rerun server từng dòng) + xem trước + ghi 1 lần."""
+    if not store:
+        st.warning("Chọn cửa hàng ở sidebar trước"); return
+    prods = products_df(conn)
+    k = f"doc_{typ}_{st.session_state.get(f'doc_{typ}_n', 0)}"   # đổi key sau khi ghi → lưới trống
+    cols = {"pcode": pd.Series(dtype=str), "qty": pd.Series(dtype=float)}
+    cfg = {"pcode": st.column_config.SelectboxColumn("Mã SP", options=prods["code"].tolist(), required=True),
+           "qty": st.column_config.NumberColumn("Số lượng", min_value=0.0, step=0.1, required=True)}
+    if typ == "IN":
+        cols["price"] = pd.Series(dtype=float)
+        cfg["price"] = st.column_config.NumberColumn("Đơn giá nhập", min_value=0.0, step=1000.0)
+    ed = st.data_editor(pd.DataFrame(cols), num_rows="dynamic", use_container_width=True, key=k, column_config=cfg)
+    note = st.text_input("Ghi chú phiếu" if typ == "IN" else "Lý do xuất", key=f"{k}_note")
+    ed = ed[ed["pcode"].notna() & (ed["qty"].fillna(0).astype(float) > 0)]
+    if ed.empty: return
+    pv = ed.merge(prods[["code","name","uom"]], left_on="pcode", right_on="code", how="left")
+    show = {"pcode": "Mã SP", "name": "Tên SP", "uom": "ĐVT", "qty": "Số lượng"}
+    if typ == "IN":
+        pv["amount"] = pv["qty"].astype(float) * pv["price"].fillna(0).astype(float)
+        show.update(price="Đơn giá", amount="Thành tiền")
+    st.dataframe(pv[list(show)].rename(columns=show), use_container_width=True, hide_index=True)
+    if typ == "IN": st.caption(f"Tổng tiền phiếu: {pv['amount'].sum():,.0f}")
+
+    if st.button(f"💾 Ghi phiếu {'nhập' if typ == 'IN' else 'xuất'} ({len(ed)} dòng)", type="primary", key=f"btn_{k}"):
+        try:
+            doc = post_document(conn, store, typ, ed.to_dict("records"), note)
+        except ValueError as e:
+            st.error(f"❌ {e}"); return
+        write_audit(conn, f"INVENTORY_DOC_{typ}", f"{doc} {len(ed)} dòng")
+        st.session_state[f"doc_{typ}_n"] = st.session_state.get(f"doc_{typ}_n", 0) + 1
+        st.success(f"Đã ghi phiếu {doc}"); st.rerun()
+
 # ===============================
 # Tồn kho
 # ===============================
+@fragment
 def tab_stock(conn, user):
     st.subheader("📊 Báo cáo tồn kho")
     store = st.session_state.get("store","")
@@ -71,30 +150,58 @@ def tab_stock(conn, user):
         st.warning("Chọn cửa hàng ở sidebar trước khi xem tồn")
         return
 
-    df = inv_valuation(conn, store, to_ts=to_ts)
+    try:
+        df = cache.cached((f"stock:{store}", "catalog"), f"valuation:{to_date}",
+                          lambda: inv_valuation(conn, store, to_ts=to_ts), ttl=LEDGER_TTL)
+    except ValueError as e:
+        st.error(f"❌ {e}"); return
     if df.empty:
         st.info("Không có tồn")
-        return
+        df = pd.DataFrame(columns=["code","onhand"])
+    else:
+        # Hiển thị thêm số cốc nếu là CỐT hoặc MỨT
+        df_show = df.rename(columns={"code":"Mã SP","name":"Tên SP","cat_code":"Nhóm",
+                                     "onhand":"Số lượng","avg_cost":"Giá vốn",
+                                     "value":"Thành tiền","cups":"Số cốc"})
+        st.dataframe(df_show, use_container_width=True, height=400)
+        st.success(f"Tổng giá trị tồn: {df['value'].sum():,.0f}")
+    # Tiêu thụ luôn tính đến hôm nay (không theo "Tính đến ngày")
+    _reorder_section(conn, store, df.rename(columns={"code":"pcode"}))
 
-    # Hiển thị thêm số cốc nếu là CỐT hoặc MỨT
-    df_show = df.rename(columns={"code":"Mã SP","name":"Tên SP","cat_code":"Nhóm",
-                                 "onhand":"Số lượng","avg_cost":"Giá vốn",
-                                 "value":"Thành tiền","cups":"Số cốc"})
-    st.dataframe(df_show, use_container_width=True, height=400)
-    st.success(f"Tổng giá trị tồn: {df['value'].sum():,.0f}")
+def _reorder_section(conn, store, df_onhand):
+    st.markdown("#### 🛒 Tiêu thụ & điểm đặt hàng")
+    with st.expander("Thông số"):
+        c1, c2, c3, c4 = st.columns(4)
+        with c1: window = st.number_input("Cửa sổ (ngày)", min_value=7, max_value=HORIZON, value=28, step=1, key="rp_win")
+        with c2: lead = st.number_input("Thời gian giao hàng (ngày)", min_value=0.0, value=3.0, step=1.0, key="rp_lead")
+        with c3: z = st.number_input("Hệ số an toàn (z)", min_value=0.0, value=1.65, step=0.05, key="rp_z")
+        with c4: review = st.number_input("Chu kỳ đặt (ngày)", min_value=0.0, value=7.0, step=1.0, key="rp_review")
+    rp = reorder_table(conn, store, df_onhand, int(window), lead, z, review)
+    rp = rp[rp["avg_daily"] > 0]
+    if rp.empty:
+        st.info("Chưa có dữ liệu xuất kho trong cửa sổ."); return
+    dfp = products_df(conn)[["code","name","uom"]].rename(columns={"code": "pcode"})
+    rp = dfp.merge(rp, on="pcode", how="right").sort_values(["reorder","days_cover"], ascending=[False, True])
+    st.dataframe(rp.rename(columns={
+        "pcode":"Mã SP","name":"Tên SP","uom":"ĐVT","onhand":"Tồn","avg_daily":"Tiêu thụ/ngày",
+        "std_daily":"Độ lệch","avg_7d":"TB 7 ngày","days_cover":"Đủ dùng (ngày)","rop":"Điểm đặt hàng",
+        "suggest":"SL gợi ý đặt","reorder":"Cần đặt"}), use_container_width=True, hide_index=True)
 
 # ===============================
 # Kiểm kê
 # ===============================
+@fragment
 def tab_audit(conn, user):
     st.subheader("📋 Kiểm kê kho")
     store = st.session_state.get("store","")
-    dfp = fetch_df(conn, "SELECT code,name,uom FROM products ORDER BY name")
-    opts = ["— Chọn —"] + [f"{r['code']} — {r['name']}" for _,r in dfp.iterrows()]
-    pick = st.selectbox("Chọn sản phẩm kiểm kê", opts, key="kk_pick")
-    if pick=="— Chọn —": return
-    pcode = pick.split(" — ",1)[0]
-    row = dfp[dfp["code"]==pcode].iloc[0].to_dict()
+    mode = st.radio("Cách kiểm", ["Từng SP", "Cả kho (phiếu kiểm kê)"], horizontal=True, key="kk_mode")
+    if mode == "Từng SP": _audit_one(conn, store)
+    else: _audit_sheet(conn, store)
+
+def _audit_one(conn, store):
+    row = product_picker(conn, "Chọn sản phẩm kiểm kê", "kk_pick")
+    if not row: return
+    pcode = row["code"]
     system = onhand_qty(conn, store, pcode)
 
     st.info(f"Tồn hệ thống hiện tại: **{system} {row['uom']}**")
@@ -115,14 +222,219 @@ def tab_audit(conn, user):
                 VALUES (:s,:p,:q,'OUT','Điều chỉnh kiểm kê',NOW())
             """, {"s": store, "p": pcode, "q": -diff})
         write_audit(conn, "STOCK_AUDIT", f"{pcode} {diff}")
+        stock_changed(store)
         st.success("Đã điều chỉnh."); st.rerun()
 
+def count_sheet(conn, store, cats=None) -> pd.DataFrame:
+    """Phiếu kiểm kê: mọi SP (lọc theo nhóm) kèm tồn hệ thống — 1 query gộp theo pcode."""
+    params, where = {"s": store}, ""
+    if cats: where = " WHERE p.cat_code = ANY(:cats) "; params["cats"] = list(cats)
+    return fetch_df(conn, f"""
+        SELECT p.code AS pcode, p.name, p.cat_code, p.uom, COALESCE(x.onhand,0) AS system
+        FROM products p
+        LEFT JOIN (
+          SELECT pcode, SUM(q) AS onhand FROM (
+            SELECT pcode, CASE WHEN type='IN' THEN qty WHEN type='OUT' THEN -qty ELSE 0 END AS q
+            FROM transactions WHERE store_code=:s
+            UNION ALL
+            SELECT pcode, qty_in - qty_out FROM transactions_opening WHERE store_code=:s
+          ) t GROUP BY pcode
+        ) x ON x.pcode=p.code
+        {where}
+        ORDER BY p.cat_code, p.name
+    """, params)
+
+def post_stock_count(conn, store, counted: dict) -> list:
+    """
+    Ghi kiểm kê nhiều SP {pcode: SL thực tế} trong 1 transaction. Chênh lệch tính lại theo tồn lúc ghi
+    (1 query onhand_many) → phát sinh sau khi mở phiếu không bị tính 2 lần. Trả về [(pcode, chênh lệch)].
+    """
+    if not counted: return []
+    with tx(conn):
+        cur = onhand_many(conn, store, list(counted))
+        diffs = [(p, float(a) - cur[p]) for p, a in counted.items() if abs(float(a) - cur[p]) >= 1e-9]
+        if not diffs: return []
+        if conn.dialect.name == "sqlite":   # chế độ local: không có unnest
+            for p, d in diffs:
+                exec_sql(conn, """
+                    INSERT INTO transactions(store_code,pcode,qty,type,note,ts)
+                    VALUES (:s,:p,:q,:t,'Điều chỉnh kiểm kê',NOW())
+                """, {"s": store, "p": p, "q": abs(d), "t": "IN" if d > 0 else "OUT"})
+        else:
+            exec_sql(conn, """
+                INSERT INTO transactions(store_code,pcode,qty,type,note,ts)
+                SELECT :s, u.p, ABS(u.d), CASE WHEN u.d>0 THEN 'IN' ELSE 'OUT' END, 'Điều chỉnh kiểm kê', NOW()
+                FROM unnest(CAST(:ps AS text[]), CAST(:ds AS numeric[])) AS u(p, d)
+            """, {"s": store, "ps": [p for p, _ in diffs], "ds": [d for _, d in diffs]})
+    stock_changed(store)
+    return diffs
+
+def _audit_sheet(conn, store):
+    if not store:
+        st.warning("Chọn cửa hàng ở sidebar trước khi kiểm kê"); return
+    cats = st.multiselect("Nhóm SP", fetch_df(conn, "SELECT code FROM categories ORDER BY code")["code"].tolist(), key="kk_cats")
+    df = count_sheet(conn, store, cats)
+    if df.empty:
+        st.info("Không có sản phẩm."); return
+    df["actual"] = float("nan")
+    st.caption("Nhập SL đếm được; để trống = chưa đếm, không điều chỉnh.")
+    ed = st.data_editor(df, key="kk_sheet", use_container_width=True, hide_index=True, height=420,
+        disabled=[c for c in df.columns if c != "actual"],
+        column_config={"pcode": "Mã SP", "name": "Tên SP", "cat_code": "Nhóm", "uom": "ĐVT", "system": "Tồn hệ thống",
+                       "actual": st.column_config.NumberColumn("Thực tế", min_value=0.0, step=0.1)})
+    ed = ed[ed["actual"].notna()].copy()
+    ed["diff"] = ed["actual"].astype(float) - ed["system"].astype(float)
+    ed = ed[ed["diff"].abs() >= 1e-9]
+    if ed.empty: return
+    st.dataframe(ed[["pcode","name","uom","system","actual","diff"]].rename(columns={
+        "pcode": "Mã SP", "name": "Tên SP", "uom": "ĐVT", "system": "Tồn hệ thống", "actual": "Thực tế",
+        "diff": "Chênh lệch"}), use_container_width=True, hide_index=True)
+    if st.button(f"⚖️ Ghi chênh lệch {len(ed)} SP", type="primary", key="btn_kk_sheet"):
+        diffs = post_stock_count(conn, store, dict(zip(ed["pcode"], ed["actual"].astype(float))))
+        write_audit(conn, "STOCK_COUNT", f"{len(diffs)} SP: " + ", ".join(f"{p} {d:+g}" for p, d in diffs))
+        st.success(f"Đã điều chỉnh {len(diffs)} SP."); st.rerun()
+
+# ===============================
+# Thẻ kho
+# ===============================
+LEDGER_PAGE = 100
+LEDGER_TTL = 60   # giây; ghi kho (mọi worker) và thay đổi qua live.py xoá sớm hơn
+
+def stock_changed(store):
+    """Kho cửa hàng vừa đổi: bỏ số dư / giá trị tồn đã cache ở mọi worker (cache.py)."""
+    cache.bump(f"stock:{store}")
+
+on_change("stock", stock_changed, per_host=True)
+
+_DELTA = """
+    CASE WHEN type='IN' THEN qty WHEN type='OUT' THEN -qty ELSE 0 END AS dq,
+    CASE WHEN type='IN' AND price_in>0 THEN qty*price_in ELSE 0 END AS dc,
+    CASE WHEN type='IN' AND price_in>0 THEN qty ELSE 0 END AS dpq
+"""
+
+def ledger_page(conn, store, pcode, cursor=None, limit=LEDGER_PAGE):
+    """
+    1 trang thẻ kho mới → cũ. cursor = (ts, id, q, c, pq): dòng cuối trang trước và số dư TRƯỚC dòng đó;
+    None = trang đầu: số dư cuối (attrs["totals"] = (tồn, tiền nhập có giá, SL nhập có giá)) tính trong
+    cùng query với các dòng (cùng snapshot, đọc primary) → cache chung theo phiên bản kho. Số dư sau từng
+    dòng = số dư đầu trang − cộng dồn các dòng mới hơn trong trang (window function trên ≤ limit dòng)
+    → không quét lịch sử cũ hơn. Trả về (DF, cursor trang sau hoặc None khi hết).
+    """
+    if cursor is None:
+        return cache.cached(f"stock:{store}", f"ledger:{pcode}:{limit}",
+                            lambda: _ledger_page(conn, store, pcode, None, limit), ttl=LEDGER_TTL)
+    return _ledger_page(conn, store, pcode, cursor, limit)
+
+def _ledger_page(conn, store, pcode, cursor, limit):
+    # trang sau: dòng cũ hơn cursor đã có từ trước → đọc replica được
+    report = cursor is not None
+    params, where = {"s": store, "p": pcode, "n": limit}, ""
+    if cursor:
+        where = " AND (ts, id) < (:cts, :cid) "; params["cts"], params["cid"] = cursor[0], cursor[1]
+    page = f"""
+        SELECT id, ts, type, qty, price_in, note, dq, dc, dpq,
+               COALESCE(SUM(dq)  OVER w, 0) AS dq_newer,
+               COALESCE(SUM(dc)  OVER w, 0) AS dc_newer,
+               COALESCE(SUM(dpq) OVER w, 0) AS dpq_newer
+        FROM (
+          SELECT id, ts, type, qty, price_in, note, {_DELTA}
+          FROM transactions
+          WHERE store_code=:s AND pcode=:p {where}
+          ORDER BY ts DESC, id DESC
+          LIMIT :n
+        ) x
+        WINDOW w AS (ORDER BY ts DESC, id DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+    """
+    if cursor:
+        df = fetch_df(conn, page + " ORDER BY ts DESC, id DESC", params, report=True)
+        q0, c0, pq0 = cursor[2:]
+    else:
+        df = fetch_df(conn, f"""
+            WITH tot AS (
+              SELECT COALESCE(SUM(dq),0) AS q0, COALESCE(SUM(dc),0) AS c0, COALESCE(SUM(dpq),0) AS pq0 FROM (
+                SELECT {_DELTA} FROM transactions WHERE store_code=:s AND pcode=:p
+                UNION ALL
+                SELECT qty_in - qty_out, cost_in, qty_in_priced
+                FROM transactions_opening WHERE store_code=:s AND pcode=:p
+              ) t
+            )
+            SELECT pg.*, tot.q0, tot.c0, tot.pq0
+            FROM tot LEFT JOIN ({page}) pg ON 1=1
+            ORDER BY pg.ts DESC, pg.id DESC
+        """, params)
+        q0, c0, pq0 = (float(df.iloc[0][c] or 0.0) for c in ("q0", "c0", "pq0"))
+        df = df[df["id"].notna()].drop(columns=["q0", "c0", "pq0"]).reset_index(drop=True)
+    for c in ["qty","price_in","dq","dc","dpq","dq_newer","dc_newer","dpq_newer"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype(float)
+    df["bal_qty"] = q0 - df["dq_newer"]
+    cost, pq = c0 - df["dc_newer"], pq0 - df["dpq_newer"]
+    df["bal_avg"] = (cost / pq.where(pq > 1e-9)).round(0)
+    nxt = None
+    if len(df) == limit:
+        last = df.iloc[-1]
+        nxt = (last["ts"], int(last["id"]), last["bal_qty"] - last["dq"], float(cost.iloc[-1] - last["dc"]),
+               float(pq.iloc[-1] - last["dpq"]))
+    else:
+        # hết giao dịch: thêm dòng số dư chuyển kỳ (nếu đã lưu trữ)
+        op = fetch_df(conn, """
+            SELECT as_of, qty_in - qty_out AS q, cost_in, qty_in_priced FROM transactions_opening
+            WHERE store_code=:s AND pcode=:p
+        """, {"s": store, "p": pcode}, report=report)
+        if not op.empty:
+            o = op.iloc[0]
+            df = pd.concat([df, pd.DataFrame([{
+                "ts": o["as_of"], "type": "OPEN", "qty": float(o["q"] or 0), "note": "Số dư chuyển kỳ",
+                "bal_qty": float(o["q"] or 0),
+                "bal_avg": round(float(o["cost_in"] or 0)/float(o["qty_in_priced"]), 0) if float(o["qty_in_priced"] or 0) > 0 else None,
+            }])], ignore_index=True)
+    if cursor is None: df.attrs["totals"] = (q0, c0, pq0)
+    return df, nxt
+
+@fragment
+def tab_ledger(conn, user):
+    st.subheader("🗂️ Thẻ kho")
+    store = st.session_state.get("store","")
+    if not store:
+        st.warning("Chọn cửa hàng ở sidebar trước khi xem thẻ kho"); return
+    row = product_picker(conn, "Sản phẩm", "lg_pick")
+    if not row: return
+    pcode = row["code"]
+
+    # đổi SP/cửa hàng → về trang đầu
+    if st.session_state.get("lg_filter") != (store, pcode):
+        st.session_state["lg_filter"] = (store, pcode)
+        st.session_state["lg_cursors"] = [None]
+    cursors = st.session_state["lg_cursors"]
+    df, nxt = ledger_page(conn, store, pcode, cursors[-1])
+    if cursors[-1] is None:
+        q, c, pq = df.attrs["totals"]
+        st.info(f"Tồn hiện tại: **{q:,.3f}** • Giá BQ: **{(c/pq if pq > 0 else 0):,.0f}**")
+    if df.empty:
+        st.info("Chưa có phát sinh."); return
+    show = pd.DataFrame({
+        "Thời gian": df["ts"], "Loại": df["type"],
+        "Nhập": df["qty"].where(df["type"]=="IN"), "Xuất": df["qty"].where(df["type"]=="OUT"),
+        "Đơn giá nhập": df["price_in"],
+        "Tồn sau": df["bal_qty"].round(3), "Giá BQ sau": df["bal_avg"], "Diễn giải": df["note"]})
+    st.dataframe(show, use_container_width=True, hide_index=True, height=420)
+
+    b1, b2, b3 = st.columns([1, 1, 4])
+    with b1:
+        if st.button("◀ Mới hơn", disabled=len(cursors) <= 1, key="lg_prev"):
+            cursors.pop(); st.rerun()
+    with b2:
+        if st.button("Cũ hơn ▶", disabled=nxt is None, key="lg_next"):
+            cursors.append(nxt); st.rerun()
+    with b3:
+        st.caption(f"Trang {len(cursors)} • {len(df)} dòng")
+
 # ===============================
 # ENTRY PAGE KHO
 # ===============================
 def page_inventory(conn, user):
     st.markdown("## 🏪 Kho")
-    tabs = st.tabs(["Nhập kho","Xuất kho","Tồn kho","Kiểm kê"])
+    watch(st.session_state.get("store"), ["stock"], "inv")
+    tabs = st.tabs(["Nhập kho","Xuất kho","Tồn kho","Kiểm kê","Thẻ kho"])
     with tabs[0]:
         tab_in(conn, user)
     with tabs[1]:
@@ -131,3 +443,5 @@ def page_inventory(conn, user):
         tab_stock(conn, user)
     with tabs[3]:
         tab_audit(conn, user)
+    with tabs[4]:
+        tab_ledger(conn, user)
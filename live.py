@@ -0,0 +1,100 @@
+# live.py
+# Làm mới theo sự kiện: trigger Postgres NOTIFY 'erp_live' '<bảng>:<store>' (sql/005_live_notify.sql, 011),
+# 1 thread LISTEN / process tăng số phiên bản theo (cửa hàng, chủ đề) trong bộ nhớ.
+# Trang gọi watch(store, topics): 1 fragment nhỏ chạy định kỳ chỉ so số phiên bản (không query),
+# đổi thì rerun trang → không có tải polling lên DB. Chế độ local-first / thiếu DATABASE_URL: tắt.
+import os, re, time, select, threading, logging
+import streamlit as st
+from sqlalchemy.engine import make_url
+import cache
+from core import _normalize, is_local_mode
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "erp_live"
+LIVE_INTERVAL = float(os.getenv("LIVE_INTERVAL", "2"))   # giây giữa 2 lần fragment so phiên bản
+TOPICS = {"transactions": "stock", "production": "production", "cashbook": "cash"}
+_PART = re.compile(r"_(y\d{4}m\d{2}|default)$")   # DB chưa chạy 011: payload mang tên phân vùng
+
+_LOCK = threading.Lock()
+_VER = {}          # (store, topic) → số phiên bản
+_HOOKS = []        # (topic, fn(store), per_host) — xoá cache khi có thay đổi
+_THREAD = None
+
+def bump(store, topic):
+    with _LOCK:
+        _VER[(store, topic)] = _VER.get((store, topic), 0) + 1
+        hooks = [(fn, host) for t, fn, host in _HOOKS if t == topic]
+    # mọi worker cùng nhận 1 NOTIFY: hook ghi cache dùng chung (per_host) chỉ chạy ở 1 process / máy
+    lead = any(host for _, host in hooks) and cache.leader()
+    for fn, host in hooks:
+        if host and not lead: continue
+        try: fn(store)
+        except Exception as e: log.warning("live hook %s: %s", topic, e)
+
+def version(store, topic) -> int:
+    with _LOCK:
+        return _VER.get((store, topic), 0)
+
+def on_change(topic, fn, per_host=False):
+    """
+    Đăng ký fn(store) chạy trong thread listener khi `topic` của 1 cửa hàng thay đổi.
+    per_host=True: fn chỉ ghi cache dùng chung (cache.py) → chạy ở 1 process / máy, không lặp theo số worker.
+    """
+    with _LOCK:
+        _HOOKS.append((topic, fn, per_host))
+
+def _dsn() -> str:
+    url = os.getenv("DATABASE_URL", "").strip()
+    return make_url(_normalize(url)).set(drivername="postgresql").render_as_string(hide_password=False) if url else ""
+
+def _listen(dsn):
+    import psycopg2
+    backoff = 1.0
+    while True:
+        try:
+            pg = psycopg2.connect(dsn, connect_timeout=5)
+            pg.autocommit = True
+            with pg.cursor() as cur: cur.execute(f"LISTEN {CHANNEL}")
+            backoff = 1.0
+            # sau khi kết nối lại có thể đã lỡ sự kiện → coi mọi thứ đã đổi
+            with _LOCK: keys = list(_VER)
+            for s, t in keys: bump(s, t)
+            while True:
+                if select.select([pg], [], [], 30)[0]:
+                    pg.poll()
+                    seen = set()
+                    while pg.notifies:
+                        n = pg.notifies.pop(0)
+                        tbl, _, store = n.payload.partition(":")
+                        tbl = _PART.sub("", tbl)
+                        if tbl in TOPICS and (store, tbl) not in seen:
+                            seen.add((store, tbl)); bump(store, TOPICS[tbl])
+        except Exception as e:
+            log.warning("live listener: %s (thử lại sau %.0fs)", e, backoff)
+            time.sleep(backoff); backoff = min(backoff * 2, 60)
+
+def start_listener() -> bool:
+    """Khởi động thread LISTEN (1 lần / process). False nếu không dùng được live refresh."""
+    global _THREAD
+    if is_local_mode() or os.getenv("LIVE_REFRESH", "1") == "0": return False
+    dsn = _dsn()
+    if not dsn: return False
+    with _LOCK:
+        if _THREAD is None:
+            _THREAD = threading.Thread(target=_listen, args=(dsn,), name="live-listener", daemon=True)
+            _THREAD.start()
+    return True
+
+@st.fragment(run_every=LIVE_INTERVAL)
+def _watcher(store, topics, key):
+    cur = tuple(version(store, t) for t in topics)
+    k = f"live_{key}"
+    seen = st.session_state.get(k)
+    st.session_state[k] = cur
+    if seen is not None and seen != cur: st.rerun()
+
+def watch(store, topics, key):
+    """Đặt trong trang: rerun trang khi 1 trong `topics` của `store` thay đổi ở session khác."""
+    if store and start_listener():
+        _watcher(store, tuple(topics), key)
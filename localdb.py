@@ -0,0 +1,368 @@
+# localdb.py
+# Chế độ local-first: SQLite nhúng cho nhập/xuất/tra cứu tại quầy (không chờ mạng),
+# mọi thay đổi được trigger ghi vào outbox bền vững (_outbox) và worker nền đẩy lên
+# Postgres theo lô (upsert idempotent), đồng thời kéo danh mục + số dư về.
+# Bật bằng LOCAL_DB_PATH=/đường/dẫn/erp.db; DATABASE_URL là đích đồng bộ (có thể vắng khi offline).
+import os, json, uuid, time, sqlite3, threading, logging
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, InterfaceError
+
+log = logging.getLogger(__name__)
+
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "2"))         # giây giữa 2 lần đẩy
+PULL_INTERVAL = float(os.getenv("SYNC_PULL_INTERVAL", "300"))  # giây giữa 2 lần kéo
+BATCH = 500
+
+# bảng: (DDL cột, khoá tự nhiên ở Postgres). Khoá None = bảng phát sinh có id local,
+# đẩy lên kèm (origin, origin_id) để Postgres chống ghi trùng (sql/003_sync_origin.sql).
+TABLES = {
+    "stores":         ("code TEXT PRIMARY KEY, name TEXT", ["code"]),
+    "users":          ("email TEXT PRIMARY KEY, display TEXT, password TEXT, role TEXT, store_code TEXT", ["email"]),
+    "categories":     ("code TEXT PRIMARY KEY, name TEXT", ["code"]),
+    "products":       ("code TEXT PRIMARY KEY, name TEXT, cat_code TEXT, uom TEXT, cups_per_kg REAL, price_ref REAL", ["code"]),
+    "formulas":       ("code TEXT PRIMARY KEY, name TEXT, type TEXT, output_pcode TEXT, output_uom TEXT, "
+                       "recovery REAL, cups_per_kg REAL, note TEXT", ["code"]),
+    "formula_inputs": ("formula_code TEXT, pcode TEXT, qty_per_kg REAL, kind TEXT, "
+                       "PRIMARY KEY (formula_code, pcode)", ["formula_code", "pcode"]),
+    "production":     ("batch_id TEXT PRIMARY KEY, ct_code TEXT, store_code TEXT, kind TEXT, status TEXT, "
+                       "kg_tho REAL, kg_soche REAL, kg_tp REAL, out_pcode TEXT, actor TEXT, ts_create TEXT, ts_done TEXT",
+                       ["batch_id"]),
+    "wip_cost":       ("batch_id TEXT PRIMARY KEY, cost_total REAL, qty_tp REAL", ["batch_id"]),
+    "transactions":   ("id INTEGER PRIMARY KEY AUTOINCREMENT, store_code TEXT, pcode TEXT, qty REAL, type TEXT, "
+                       "price_in REAL, note TEXT, ts TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f','now')), doc_id TEXT, idem_key TEXT", None),
+    "cashbook":       ("id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, store_code TEXT, method TEXT, io TEXT, "
+                       "amount REAL, note TEXT, actor TEXT", None),
+    "payroll":        ("id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, store_code TEXT, staff TEXT, amount REAL, "
+                       "note TEXT, actor TEXT", None),
+    "assets":         ("id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT, name TEXT, cost REAL, start_date TEXT, "
+                       "life_months INTEGER, salvage REAL, method TEXT, store_code TEXT, note TEXT", None),
+    "syslog":         ("id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, actor TEXT, action TEXT, detail TEXT", None),
+}
+# Bảng kéo nguyên bảng từ Postgres về (danh mục)
+REF_TABLES = ["stores", "users", "categories", "products", "formulas", "formula_inputs"]
+# Chỉ cập nhật lô khi ở Postgres lô chưa DONE — lô đã đóng nơi khác là xung đột
+GUARDS = {"production": "production.status <> 'DONE'"}
+
+_LOCAL_DDL = """
+CREATE TABLE IF NOT EXISTS transactions_opening (
+  store_code TEXT, pcode TEXT, as_of TEXT, qty_in REAL DEFAULT 0, qty_out REAL DEFAULT 0,
+  cost_in REAL DEFAULT 0, qty_in_priced REAL DEFAULT 0, PRIMARY KEY (store_code, pcode));
+CREATE TABLE IF NOT EXISTS production_yield_agg (
+  ct_code TEXT, store_code TEXT, week TEXT, batches INTEGER DEFAULT 0, kg_tho REAL DEFAULT 0,
+  kg_soche REAL DEFAULT 0, kg_tp REAL DEFAULT 0, cost_total REAL DEFAULT 0, cups REAL DEFAULT 0,
+  PRIMARY KEY (ct_code, store_code, week));
+CREATE TABLE IF NOT EXISTS _outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, op TEXT NOT NULL, row TEXT NOT NULL,
+  ts TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f','now')));
+CREATE TABLE IF NOT EXISTS _sync_conflicts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT, outbox_id INTEGER, tbl TEXT, op TEXT, row TEXT, error TEXT,
+  ts TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f','now')));
+CREATE TABLE IF NOT EXISTS _sync_state (k TEXT PRIMARY KEY, v TEXT);
+CREATE TABLE IF NOT EXISTS pos_ingest_offsets (
+  source TEXT PRIMARY KEY, pos INTEGER NOT NULL, events INTEGER NOT NULL DEFAULT 0,
+  ts TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f','now')));
+CREATE TABLE IF NOT EXISTS pos_ingest_windows (k TEXT PRIMARY KEY, pos INTEGER NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_idem_uq ON transactions (idem_key, ts);
+CREATE INDEX IF NOT EXISTS transactions_store_pcode_ts_id_idx ON transactions (store_code, pcode, ts, id);
+DROP INDEX IF EXISTS transactions_store_pcode_ts_idx;
+"""
+
+_ENGINE = None
+_LOCK = threading.Lock()
+_MUTE = threading.local()   # worker bật khi ghi dữ liệu kéo về → trigger không ghi outbox
+_WORKER = None
+_STATUS = {"last_push": None, "last_pull": None, "error": None}
+
+class SyncConflict(Exception):
+    pass
+
+# ===============================
+# Kết nối SQLite
+# ===============================
+def _col_defs(tbl):
+    """Định nghĩa từng cột theo DDL trong TABLES (bỏ qua ràng buộc PRIMARY KEY (...))."""
+    out, depth, cur = [], 0, ""
+    for ch in TABLES[tbl][0] + ",":
+        depth += (ch == "(") - (ch == ")")
+        if ch == "," and depth == 0:
+            if cur.split()[0] != "PRIMARY": out.append(cur.strip())
+            cur = ""
+        else:
+            cur += ch
+    return out
+
+def _cols(tbl):
+    return [d.split()[0] for d in _col_defs(tbl)]
+
+def _now():
+    # Như NOW() của app trên Postgres (session UTC): chuỗi UTC không kèm múi giờ
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def _date_trunc(unit, ts):
+    if ts is None: return None
+    d = datetime.fromisoformat(str(ts))
+    if unit == "month": d = d.replace(day=1)
+    elif unit == "week": d = datetime.fromordinal(d.toordinal() - d.weekday())
+    return d.strftime("%Y-%m-%d 00:00:00")
+
+def _date_trunc_tz(unit, ts, tz):
+    # như date_trunc(unit, timestamptz, zone) của Postgres: cắt theo giờ địa phương của tz, trả về mốc UTC
+    if ts is None: return None
+    z = ZoneInfo(tz)
+    d = datetime.fromisoformat(str(ts))
+    d = (d if d.tzinfo else d.replace(tzinfo=timezone.utc)).astimezone(z).replace(tzinfo=None)
+    d = datetime.fromisoformat(_date_trunc(unit, d)).replace(tzinfo=z)
+    return d.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _adapt_dt(d):
+    # tham số có múi giờ → chuỗi UTC không múi giờ như cột ts local (so sánh chuỗi mới đúng)
+    return (d.astimezone(timezone.utc).replace(tzinfo=None) if d.tzinfo else d).isoformat(" ")
+
+sqlite3.register_adapter(datetime, _adapt_dt)
+
+def _register(dbapi_conn):
+    dbapi_conn.create_function("NOW", 0, _now)
+    dbapi_conn.create_function("DATE_TRUNC", 2, _date_trunc)
+    dbapi_conn.create_function("DATE_TRUNC", 3, _date_trunc_tz)
+    dbapi_conn.create_function("GREATEST", -1, lambda *a: max(x for x in a if x is not None))
+    dbapi_conn.create_function("LEAST", -1, lambda *a: min(x for x in a if x is not None))
+    dbapi_conn.create_function("sync_muted", 0, lambda: int(getattr(_MUTE, "on", 0)))
+    dbapi_conn.execute("PRAGMA journal_mode=WAL")
+    dbapi_conn.execute("PRAGMA synchronous=FULL")   # outbox phải sống qua mất điện
+    dbapi_conn.execute("PRAGMA busy_timeout=30000")
+
+def _raw():
+    """Kết nối sqlite3 thuần cho worker (tự quản transaction: BEGIN IMMEDIATE)."""
+    c = sqlite3.connect(os.environ["LOCAL_DB_PATH"], isolation_level=None, check_same_thread=False, timeout=30)
+    c.row_factory = sqlite3.Row
+    _register(c)
+    return c
+
+def _triggers(tbl):
+    cols = _cols(tbl)
+    def obj(ref): return "json_object(" + ",".join(f"'{c}',{ref}.{c}" for c in cols) + ")"
+    out = []
+    for op, ev, ref in (("I", "INSERT", "NEW"), ("U", "UPDATE", "NEW"), ("D", "DELETE", "OLD")):
+        out.append(f"""CREATE TRIGGER IF NOT EXISTS _ob_{tbl}_{op} AFTER {ev} ON {tbl}
+            WHEN sync_muted()=0
+            BEGIN INSERT INTO _outbox(tbl,op,row) VALUES ('{tbl}','{op}',{obj(ref)}); END;""")
+    return out
+
+def init_schema(c):
+    for tbl, (ddl, _key) in TABLES.items():
+        c.execute(f"CREATE TABLE IF NOT EXISTS {tbl} ({ddl})")
+        # cột mới thêm vào TABLES (vd transactions.doc_id) → ALTER file cũ, tạo lại trigger outbox đủ cột
+        have = {r[1] for r in c.execute(f"PRAGMA table_info({tbl})")}
+        new = [d for d in _col_defs(tbl) if d.split()[0] not in have]
+        for d in new: c.execute(f"ALTER TABLE {tbl} ADD COLUMN {d}")
+        if new:
+            for op in ("I", "U", "D"): c.execute(f"DROP TRIGGER IF EXISTS _ob_{tbl}_{op}")
+        for t in _triggers(tbl): c.execute(t)
+    c.executescript(_LOCAL_DDL)
+    if not c.execute("SELECT v FROM _sync_state WHERE k='origin'").fetchone():
+        c.execute("INSERT INTO _sync_state(k,v) VALUES ('origin',?)", (os.getenv("LOCAL_DEVICE_ID") or uuid.uuid4().hex,))
+
+def get_local_conn():
+    """Connection SQLAlchemy tới SQLite local (tạo schema + khởi động worker đồng bộ lần đầu)."""
+    global _ENGINE
+    with _LOCK:
+        if _ENGINE is None:
+            c = _raw(); init_schema(c); c.close()
+            eng = create_engine(f"sqlite:///{os.environ['LOCAL_DB_PATH']}", future=True,
+                                connect_args={"check_same_thread": False, "timeout": 30})
+            event.listen(eng, "connect", lambda dbapi_conn, _rec: _register(dbapi_conn))
+            _ENGINE = eng
+            start_sync_worker()
+    return _ENGINE.connect()
+
+# ===============================
+# Đẩy outbox lên Postgres
+# ===============================
+def _pg_engine():
+    from core import _normalize
+    url = os.getenv("DATABASE_URL", "").strip()
+    return create_engine(_normalize(url), pool_pre_ping=True, future=True) if url else None
+
+def _state(c, k, default=None):
+    r = c.execute("SELECT v FROM _sync_state WHERE k=?", (k,)).fetchone()
+    return r["v"] if r else default
+
+def _apply(pc, tbl, op, rows, origin):
+    """Áp 1 nhóm thay đổi cùng (bảng, op) lên Postgres. rows: list dict."""
+    key = TABLES[tbl][1]
+    cols = _cols(tbl)
+    if key is None:   # bảng phát sinh: khoá (origin, origin_id)
+        data = [{**{c: r.get(c) for c in cols if c != "id"}, "origin": origin, "origin_id": r["id"]} for r in rows]
+        dcols = [c for c in cols if c != "id"] + ["origin", "origin_id"]
+        if op == "I":
+            params, values = {}, []
+            for j, r in enumerate(data):
+                values.append("(" + ",".join(f":{c}_{j}" for c in dcols) + ")")
+                params.update({f"{c}_{j}": r[c] for c in dcols})
+            pc.execute(text(f"INSERT INTO {tbl}({','.join(dcols)}) VALUES {','.join(values)} ON CONFLICT DO NOTHING"), params)
+        elif op == "U":
+            for r in data:
+                res = pc.execute(text(f"UPDATE {tbl} SET " + ", ".join(f"{c}=:{c}" for c in dcols if c not in ("origin", "origin_id"))
+                                      + " WHERE origin=:origin AND origin_id=:origin_id"), r)
+                if res.rowcount == 0: raise SyncConflict(f"{tbl} origin_id={r['origin_id']} không còn trên Postgres")
+        else:
+            pc.execute(text(f"DELETE FROM {tbl} WHERE origin=:o AND origin_id = ANY(:ids)"),
+                       {"o": origin, "ids": [r["id"] for r in rows]})
+        return
+    if op == "D" or tbl == "formula_inputs":   # formula_inputs không có unique ở Postgres → xoá rồi chèn
+        conds = " AND ".join(f"{k}=:{k}" for k in key)
+        for r in rows: pc.execute(text(f"DELETE FROM {tbl} WHERE {conds}"), {k: r[k] for k in key})
+        if op == "D": return
+        for r in rows: pc.execute(text(f"INSERT INTO {tbl}({','.join(cols)}) VALUES ({','.join(':'+c for c in cols)})"), r)
+        return
+    upd = [c for c in cols if c not in key]
+    guard = f" WHERE {GUARDS[tbl]}" if tbl in GUARDS else ""
+    for r in rows:
+        res = pc.execute(text(f"""
+            INSERT INTO {tbl}({','.join(cols)}) VALUES ({','.join(':'+c for c in cols)})
+            ON CONFLICT ({','.join(key)}) DO UPDATE SET {', '.join(f'{c}=EXCLUDED.{c}' for c in upd)}{guard}
+        """), r)
+        if res.rowcount == 0: raise SyncConflict(f"{tbl} {[r[k] for k in key]} đã bị thay đổi trên Postgres")
+
+def _runs(ops):
+    """Gom các thay đổi liên tiếp cùng (bảng, op) — giữ đúng thứ tự outbox."""
+    run = []
+    for o in ops:
+        if run and (run[-1][1], run[-1][2]) != (o[1], o[2]):
+            yield run; run = []
+        run.append(o)
+    if run: yield run
+
+def push_once(pg, c) -> int:
+    """Đẩy 1 lô outbox. Lỗi kết nối → ném ra (giữ nguyên outbox); lỗi dữ liệu → ghi _sync_conflicts."""
+    origin = _state(c, "origin")
+    rows = c.execute("SELECT id,tbl,op,row FROM _outbox ORDER BY id LIMIT ?", (BATCH,)).fetchall()
+    if not rows: return 0
+    ops = [(r["id"], r["tbl"], r["op"], json.loads(r["row"])) for r in rows]
+    done, conflicts = [], []
+    try:
+        with pg.begin() as pc:
+            for run in _runs(ops): _apply(pc, run[0][1], run[0][2], [o[3] for o in run], origin)
+        done = [o[0] for o in ops]
+    except (OperationalError, InterfaceError):
+        raise
+    except Exception:
+        # Cô lập từng thay đổi để chỉ loại đúng dòng xung đột (các lệnh đều idempotent)
+        for o in ops:
+            try:
+                with pg.begin() as pc: _apply(pc, o[1], o[2], [o[3]], origin)
+                done.append(o[0])
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as e:
+                conflicts.append((o, str(e)[:1000]))
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.executemany("INSERT INTO _sync_conflicts(outbox_id,tbl,op,row,error) VALUES (?,?,?,?,?)",
+                      [(o[0], o[1], o[2], json.dumps(o[3]), err) for o, err in conflicts])
+        c.executemany("DELETE FROM _outbox WHERE id=?", [(i,) for i in done] + [(o[0],) for o, _ in conflicts])
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK"); raise
+    return len(ops)
+
+# ===============================
+# Kéo danh mục + số dư về
+# ===============================
+_OPENING_SQL = """
+    SELECT store_code, pcode,
+           SUM(qty_in) AS qty_in, SUM(qty_out) AS qty_out, SUM(cost_in) AS cost_in, SUM(qty_in_priced) AS qty_in_priced
+    FROM (
+      SELECT store_code, pcode,
+             CASE WHEN type='IN'  THEN qty ELSE 0 END AS qty_in,
+             CASE WHEN type='OUT' THEN qty ELSE 0 END AS qty_out,
+             CASE WHEN type='IN' AND price_in>0 THEN qty*price_in ELSE 0 END AS cost_in,
+             CASE WHEN type='IN' AND price_in>0 THEN qty ELSE 0 END AS qty_in_priced
+      FROM transactions
+      UNION ALL
+      SELECT store_code, pcode, qty_in, qty_out, cost_in, qty_in_priced FROM transactions_opening
+    ) x
+    GROUP BY store_code, pcode
+"""
+
+def pull_once(pg, c) -> bool:
+    """
+    Thay danh mục local bằng bản Postgres, số dư tồn thành transactions_opening local
+    (giao dịch local đã đẩy hết thì xoá), lô WIP lấy từ Postgres.
+    Chỉ áp khi outbox rỗng (kiểm lại trong khoá ghi) để không đè thay đổi chưa đẩy.
+    """
+    with pg.connect() as pc:
+        ref = {t: [dict(r) for r in pc.execute(text(f"SELECT {','.join(_cols(t))} FROM {t}")).mappings()]
+               for t in REF_TABLES}
+        opening = [dict(r) for r in pc.execute(text(_OPENING_SQL)).mappings()]
+        wip = [dict(r) for r in pc.execute(text(
+            f"SELECT {','.join(_cols('production'))} FROM production WHERE status='WIP'")).mappings()]
+        wipc = [dict(r) for r in pc.execute(text(
+            "SELECT w.batch_id,w.cost_total,w.qty_tp FROM wip_cost w JOIN production p ON p.batch_id=w.batch_id "
+            "WHERE p.status='WIP'")).mappings()]
+
+    def plain(v):
+        return v if v is None or isinstance(v, (int, float, str)) else (str(v) if isinstance(v, datetime) else float(v))
+    _MUTE.on = 1
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        if c.execute("SELECT COUNT(*) FROM _outbox").fetchone()[0]:
+            c.execute("ROLLBACK"); return False
+        for t, rows in ref.items():
+            cols = _cols(t)
+            c.execute(f"DELETE FROM {t}")
+            c.executemany(f"INSERT INTO {t}({','.join(cols)}) VALUES ({','.join('?'*len(cols))})",
+                          [tuple(plain(r[k]) for k in cols) for r in rows])
+        c.execute("DELETE FROM transactions")
+        c.execute("DELETE FROM transactions_opening")
+        c.executemany("INSERT INTO transactions_opening(store_code,pcode,as_of,qty_in,qty_out,cost_in,qty_in_priced) "
+                      "VALUES (?,?,'1970-01-01 00:00:00',?,?,?,?)",
+                      [(r["store_code"], r["pcode"], plain(r["qty_in"]), plain(r["qty_out"]),
+                        plain(r["cost_in"]), plain(r["qty_in_priced"])) for r in opening])
+        pcols = _cols("production")
+        c.execute("DELETE FROM production"); c.execute("DELETE FROM wip_cost")
+        c.executemany(f"INSERT INTO production({','.join(pcols)}) VALUES ({','.join('?'*len(pcols))})",
+                      [tuple(plain(r[k]) for k in pcols) for r in wip])
+        c.executemany("INSERT INTO wip_cost(batch_id,cost_total,qty_tp) VALUES (?,?,?)",
+                      [(r["batch_id"], plain(r["cost_total"]), plain(r["qty_tp"])) for r in wipc])
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK"); raise
+    finally:
+        _MUTE.on = 0
+    return True
+
+# ===============================
+# Worker nền
+# ===============================
+def _worker():
+    c, pg, last_pull, backoff = _raw(), None, 0.0, SYNC_INTERVAL
+    while True:
+        try:
+            pg = pg or _pg_engine()
+            if pg is None:
+                time.sleep(30); continue
+            while push_once(pg, c) == BATCH: pass
+            _STATUS["last_push"] = time.time()
+            if time.time() - last_pull >= PULL_INTERVAL and pull_once(pg, c):
+                last_pull = _STATUS["last_pull"] = time.time()
+            _STATUS["error"], backoff = None, SYNC_INTERVAL
+        except Exception as e:   # mất mạng / Postgres lỗi: giữ outbox, thử lại chậm dần
+            _STATUS["error"] = str(e)[:300]
+            backoff = min(backoff * 2, 60)
+            log.warning("sync lỗi, thử lại sau %.0fs: %s", backoff, e)
+        time.sleep(backoff)
+
+def start_sync_worker():
+    global _WORKER
+    if _WORKER is None or not _WORKER.is_alive():
+        _WORKER = threading.Thread(target=_worker, name="localdb-sync", daemon=True)
+        _WORKER.start()
+
+def sync_status(conn) -> dict:
+    """Số thay đổi chờ đẩy, số xung đột và lỗi gần nhất — hiển thị ở sidebar."""
+    pending = conn.execute(text("SELECT COUNT(*) FROM _outbox")).scalar()
+    conflicts = conn.execute(text("SELECT COUNT(*) FROM _sync_conflicts")).scalar()
+    return {"pending": pending, "conflicts": conflicts, **_STATUS}
@@ -0,0 +1,80 @@
+# partitions.py
+# Quản lý bảng phân vùng theo tháng (RANGE ts): tạo tháng mới, lưu trữ & xoá tháng cũ.
+# Quy ước tên: <bảng>_yYYYYmMM, phân vùng mặc định <bảng>_default.
+import os, re, gzip
+from datetime import date
+from core import fetch_df, exec_sql, tx
+
+def month_add(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+def part_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+def list_partitions(conn, table: str):
+    """Danh sách (name, month) các phân vùng tháng của bảng, tăng dần theo tháng."""
+    df = fetch_df(conn, """
+        SELECT c.relname AS name
+        FROM pg_inherits i JOIN pg_class c ON c.oid=i.inhrelid
+        WHERE i.inhparent = CAST(:t AS regclass)
+    """, {"t": table})
+    pat = re.compile(rf"^{re.escape(table)}_y(\d{{4}})m(\d{{2}})$")
+    out = []
+    for name in df["name"]:
+        m = pat.match(name)
+        if m: out.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(out, key=lambda x: x[1])
+
+def ensure_month_partitions(conn, table: str, months_ahead: int = 2) -> list:
+    """
+    Tạo phân vùng cho tháng hiện tại và `months_ahead` tháng tới nếu chưa có.
+    Dòng đã lỡ rơi vào <bảng>_default trong khoảng đó được chuyển sang phân vùng mới.
+    """
+    have = {m for _, m in list_partitions(conn, table)}
+    this_month = date.today().replace(day=1)
+    created = []
+    for i in range(months_ahead + 1):
+        m = month_add(this_month, i)
+        if m in have: continue
+        name, a, b = part_name(table, m), m.isoformat(), month_add(m, 1).isoformat()
+        with tx(conn):
+            exec_sql(conn, f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            exec_sql(conn, f"""
+                WITH mv AS (DELETE FROM {table}_default WHERE ts >= :a AND ts < :b RETURNING *)
+                INSERT INTO {name} SELECT * FROM mv
+            """, {"a": a, "b": b})
+            exec_sql(conn, f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{a}') TO ('{b}')")
+        created.append(name)
+    return created
+
+def archive_partition(conn, name: str, archive_dir: str) -> str:
+    """COPY 1 phân vùng ra file CSV nén gzip trong archive_dir, trả về đường dẫn file."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    cur = conn.connection.cursor()
+    try:
+        with gzip.open(path, "wb") as f:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+    finally:
+        cur.close()
+    return path
+
+def drop_old_partitions(conn, table: str, keep_months: int, archive_dir: str = None, before_drop=None) -> list:
+    """
+    Xoá các phân vùng cũ hơn `keep_months` tháng (tính cả tháng hiện tại).
+    Có archive_dir thì lưu file .csv.gz trước khi xoá. before_drop(conn, name, month)
+    chạy trong cùng transaction với DETACH/DROP (vd: ghi số dư chuyển kỳ).
+    Trả về list dict {partition, month, file}.
+    """
+    cutoff = month_add(date.today().replace(day=1), -(keep_months - 1))
+    done = []
+    for name, month in list_partitions(conn, table):
+        if month >= cutoff: break
+        path = archive_partition(conn, name, archive_dir) if archive_dir else None
+        with tx(conn):
+            if before_drop: before_drop(conn, name, month)
+            exec_sql(conn, f"ALTER TABLE {table} DETACH PARTITION {name}")
+            exec_sql(conn, f"DROP TABLE {name}")
+        done.append({"partition": name, "month": month, "file": path})
+    return done
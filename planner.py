@@ -0,0 +1,123 @@
+# planner.py
+# Kế hoạch NVL nhiều cấp: N cốc / kg thành phẩm → cần sản xuất bao nhiêu CỐT, bao nhiêu trái cây & phụ gia,
+# thiếu gì so với tồn. Đồ thị công thức (formulas/formula_inputs) nạp 1 lần, cache trong process;
+# production.invalidate_formula() xoá cache này cùng cache công thức, worker khác nạp lại khi
+# phiên bản cache "catalog" / "production" (cache.py) đổi.
+import threading
+from sqlalchemy.exc import DBAPIError
+from core import fetch_df
+from finance import onhand_many
+import cache
+
+_LOCK = threading.Lock()
+_DAG = {}   # actual (bool) → {"per_kg": {ct: {pcode: SL / 1kg TP}}, "out": {ct: pcode}, "cups": {ct: cốc/kg}, "maker": {pcode: ct}, "ver"}
+
+def invalidate_dag():
+    with _LOCK:
+        _DAG.clear()
+
+def _ratios(conn):
+    """kg_tp/kg_soche và kg_tho/kg_soche thực tế theo CT từ production_yield_agg (sql/004); chưa có → {}."""
+    try:
+        df = fetch_df(conn, """
+            SELECT ct_code, SUM(kg_tho) AS tho, SUM(kg_soche) AS soche, SUM(kg_tp) AS tp
+            FROM production_yield_agg GROUP BY ct_code
+        """, report=True)
+    except DBAPIError:
+        conn.rollback()   # Postgres: lệnh lỗi làm hỏng transaction của connection trang
+        return {}
+    out = {}
+    for _, r in df.iterrows():
+        soche = float(r["soche"] or 0)
+        if soche > 0: out[r["ct_code"]] = (float(r["tp"] or 0)/soche, float(r["tho"] or 0)/soche)
+    return out
+
+def load_dag(conn, actual=False) -> dict:
+    """
+    Mở rộng 1 cấp của mỗi CT, quy về 1 kg TP:
+      kg sơ chế / kg TP = 1 / HSTH của CT (actual=True: kg_tp/kg_soche thực tế của các lô đã đóng, nếu có)
+      SRC: tổng kg thô = kg sơ chế (actual=True: × kg_tho/kg_soche thực tế). CT không ghi tỷ lệ giữa các
+           nguồn (lô nhập kg thô từng nguồn) → giả định chia đều các nguồn SRC
+      OTHER: qty_per_kg × kg sơ chế
+    """
+    ver = (cache.version("catalog"), cache.version("production"))
+    with _LOCK:
+        cur = _DAG.get(bool(actual))
+    if cur and cur["ver"] == ver: return cur
+    df = fetch_df(conn, """
+        SELECT f.code, f.type, f.output_pcode, f.recovery, COALESCE(f.cups_per_kg, p.cups_per_kg) AS cups_per_kg,
+               fi.pcode, fi.kind, fi.qty_per_kg
+        FROM formulas f
+        LEFT JOIN products p ON p.code=f.output_pcode
+        LEFT JOIN formula_inputs fi ON fi.formula_code=f.code
+        ORDER BY f.code
+    """)
+    ratios = _ratios(conn) if actual else {}
+    dag, types = {"per_kg": {}, "out": {}, "cups": {}, "maker": {}, "ver": ver}, {}
+    for code, g in df.groupby("code", sort=True):
+        h = g.iloc[0]
+        tp, tho = ratios.get(code, (float(h["recovery"] or 1.0), 1.0))
+        soche = 1.0 / tp if tp > 0 else 1.0
+        inp = g[g["pcode"].notna()]
+        src, other = inp[inp["kind"] == "SRC"], inp[inp["kind"] == "OTHER"]
+        need = {}
+        for p in src["pcode"]:
+            need[p] = need.get(p, 0.0) + soche * tho / len(src)
+        for _, r in other.iterrows():
+            need[r["pcode"]] = need.get(r["pcode"], 0.0) + float(r["qty_per_kg"] or 0) * soche
+        dag["per_kg"][code], dag["out"][code] = need, h["output_pcode"]
+        dag["cups"][code], types[code] = float(h["cups_per_kg"] or 0.0), h["type"]
+    # SP trung gian (vd CỐT) làm từ CT đầu tiên (theo mã) xuất ra nó, ưu tiên CT loại COT
+    for code in sorted(types, key=lambda c: (types[c] != "COT", c)):
+        dag["maker"].setdefault(dag["out"][code], code)
+    with _LOCK:
+        _DAG[bool(actual)] = dag
+    return dag
+
+def explode(conn, store, targets, net_stock=True, actual=False):
+    """
+    targets: list dict {ct_code, qty, unit: 'cốc'|'kg'}. Nổ nhu cầu qua các cấp CT theo mã cấp thấp
+    (low-level code): mỗi SP chỉ được xét khi mọi nhu cầu từ cấp trên đã dồn về; lấy tồn 1 query cho
+    toàn bộ SP liên quan, trừ tồn từng cấp (net_stock) trước khi nổ tiếp xuống cấp dưới.
+    actual: định mức theo hiệu suất thực tế thay vì HSTH (xem load_dag).
+    Trả về list dict: pcode, level, make_ct, gross, onhand, net (SL cần SX/mua), short (thiếu NVL).
+    """
+    dag = load_dag(conn, actual)
+    chosen, gross = {}, {}
+    for t in targets:
+        ct = t["ct_code"]
+        if ct not in dag["out"]: raise ValueError(f"Không có công thức {ct}")
+        p = dag["out"][ct]
+        if chosen.setdefault(p, ct) != ct:
+            raise ValueError(f"{p} đang được lập kế hoạch bằng 2 công thức ({chosen[p]}, {ct})")
+        qty = float(t["qty"] or 0)
+        if t.get("unit", "kg") != "kg":
+            cpk = dag["cups"][ct]
+            if cpk <= 0: raise ValueError(f"CT {ct} chưa có số cốc/kg")
+            qty = qty / cpk
+        gross[p] = gross.get(p, 0.0) + qty
+    maker = {**dag["maker"], **chosen}
+
+    # mã cấp thấp: cấp sâu nhất mà SP xuất hiện trong cây
+    llc, stack, limit = {}, [(p, 0) for p in gross], len(dag["per_kg"]) + 1
+    while stack:
+        p, lv = stack.pop()
+        if lv <= llc.get(p, -1): continue
+        if lv > limit: raise ValueError(f"Công thức lặp vòng tại {p}")
+        llc[p] = lv
+        if p in maker:
+            stack.extend((c, lv + 1) for c in dag["per_kg"][maker[p]])
+
+    onhand = onhand_many(conn, store, list(llc)) if net_stock else {}
+    rows = []
+    for p in sorted(llc, key=lambda x: (llc[x], x)):
+        g = gross.get(p, 0.0)
+        on = max(onhand.get(p, 0.0), 0.0)
+        net = max(g - on, 0.0)
+        ct = maker.get(p)
+        if ct and net > 0:
+            for c, q in dag["per_kg"][ct].items():
+                gross[c] = gross.get(c, 0.0) + q * net
+        rows.append({"pcode": p, "level": llc[p], "make_ct": ct, "gross": g, "onhand": on,
+                     "net": net, "short": (0.0 if ct else net)})
+    return rows
@@ -0,0 +1,203 @@
+# pos_ingest.py
+# Nhập bán hàng từ POS: sự kiện (store, pcode, cups, ts) trong file CSV / JSON lines hoặc stdin → trừ kho CỐT/MỨT.
+# - Gom lô BATCH sự kiện. Ranh giới lô là bội số của BATCH theo số thứ tự sự kiện, nên phát lại cùng 1 file
+#   cho ra đúng các lô cũ. Ở chế độ --follow, lô còn dở được ghi khi nguồn đứng yên FLUSH_SEC giây.
+# - Đổi cốc → kg theo cups_per_kg của SP (không có thì lấy của CT xuất ra SP), rồi cộng dồn theo
+#   (cửa hàng, SP, khung WINDOW giây).
+# - Mỗi khung (nguồn, cửa hàng, SP, khung giờ) nhớ vị trí sự kiện đã cộng tới (pos_ingest_windows,
+#   sql/010_pos_ingest_windows.sql). Mỗi lô chỉ cộng các sự kiện từ vị trí đó trở đi, ghi thành 1 dòng OUT
+#   ts = đầu khung, idem_key = khung + vị trí đầu phần mới. Cách chia lô (--batch, ghi lô dở, chạy tiếp
+#   từ checkpoint) không ảnh hưởng: phát lại (--replay) chỉ ghi sự kiện chưa từng được cộng.
+#   Vị trí đã xử lý của nguồn (pos_ingest_offsets) được lưu trong cùng transaction: dừng giữa chừng
+#   thì chạy lại tiếp từ checkpoint.
+# - Bộ nhớ giới hạn theo BATCH. Không chặn khi tồn âm, vì hàng đã bán thật.
+# Chạy: python pos_ingest.py sales.csv [--source quay1] [--follow] [--replay] [--batch 5000] [--window 300]
+import os, sys, csv, json, time, argparse
+from datetime import datetime, timedelta, timezone
+from core import get_conn, fetch_df, exec_sql, tx
+import cache
+
+BATCH = 5000
+WINDOW = 300        # giây / khung gộp
+FLUSH_SEC = 2.0     # --follow: nguồn đứng yên chừng này giây → ghi lô dở
+RELOAD_SEC = 60     # nạp lại bảng cốc/kg
+_EPOCH = datetime(1970, 1, 1)
+
+# ===== Đọc sự kiện =====
+def _lines(f, follow):
+    """Từng dòng; --follow: hết file thì chờ thêm, trả None mỗi lần đứng yên (để ghi lô dở)."""
+    idle = None
+    while True:
+        line = f.readline()
+        if line:
+            idle = None
+            if line.strip(): yield line
+            continue
+        if not follow: return
+        if idle is None: idle = time.monotonic()
+        elif time.monotonic() - idle >= FLUSH_SEC:
+            yield None; idle = time.monotonic()
+        time.sleep(0.2)
+
+def read_events(f, follow=False):
+    """(số thứ tự, dict sự kiện | None nếu dòng hỏng) — CSV có dòng tiêu đề hoặc JSON lines; (None, None) = đứng yên."""
+    parse, n = None, 0
+    for line in _lines(f, follow):
+        if line is None:
+            yield None, None; continue
+        if parse is None:
+            if not line.lstrip().startswith("{"):
+                cols = [c.strip() for c in next(csv.reader([line]))]
+                parse = lambda l: dict(zip(cols, next(csv.reader([l]))))
+                continue
+            parse = json.loads
+        try: ev = parse(line)
+        except (ValueError, StopIteration): ev = None
+        yield n, ev; n += 1
+
+def _ts(v):
+    if not v: return datetime.now(timezone.utc).replace(tzinfo=None)
+    d = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    return d.astimezone(timezone.utc).replace(tzinfo=None) if d.tzinfo else d   # không múi giờ = UTC
+
+# ===== Quy đổi & gộp =====
+def load_cups(conn) -> dict:
+    """{pcode: cốc/kg} của SP nhóm COT/MUT (SP chưa khai → cups_per_kg của CT xuất ra SP)."""
+    df = fetch_df(conn, """
+        SELECT p.code, COALESCE(NULLIF(p.cups_per_kg,0), MAX(f.cups_per_kg)) AS cpk
+        FROM products p LEFT JOIN formulas f ON f.output_pcode=p.code
+        WHERE p.cat_code IN ('COT','MUT')
+        GROUP BY p.code, p.cups_per_kg
+    """)
+    return {r.code: float(r.cpk) for r in df.itertuples() if r.cpk is not None and float(r.cpk) > 0}
+
+def aggregate(events, cups, window=WINDOW):
+    """events: list (số thứ tự, dict) → ({(store, pcode, đầu khung): [(số thứ tự, kg), ...]}, số sự kiện bị loại)."""
+    agg, bad = {}, 0
+    for n, ev in events:
+        try:
+            s, p, c = ev["store"], ev["pcode"], float(ev["cups"])
+            cpk, t = cups.get(p), _ts(ev.get("ts"))
+        except (KeyError, TypeError, ValueError):
+            bad += 1; continue
+        if not s or not cpk or c <= 0:
+            bad += 1; continue
+        w = _EPOCH + timedelta(seconds=int((t - _EPOCH).total_seconds()) // window * window)
+        agg.setdefault((s, p, w), []).append((n, c / cpk))
+    return agg, bad
+
+# ===== Ghi =====
+def checkpoint(conn, source) -> int:
+    df = fetch_df(conn, "SELECT pos FROM pos_ingest_offsets WHERE source=:s", {"s": source})
+    return int(df.iloc[0]["pos"]) if not df.empty else 0
+
+def post_batch(conn, source, start, end, agg) -> int:
+    """
+    1 transaction: đọc vị trí đã cộng của các khung, INSERT 1 dòng OUT / khung cho phần sự kiện mới,
+    cập nhật vị trí khung + checkpoint = end. Trả về số dòng mới.
+    """
+    keys = {(s, p, w): f"pos:{source}:{s}:{p}:{w:%Y%m%d%H%M%S}" for (s, p, w) in agg}
+    with tx(conn):
+        done = {}
+        if keys:
+            df = fetch_df(conn, "SELECT k, pos FROM pos_ingest_windows WHERE k = ANY(:ks)", {"ks": list(keys.values())})
+            done = dict(zip(df["k"], df["pos"].astype(int)))
+        rows = []
+        for (s, p, w), evs in agg.items():
+            k, seen = keys[(s, p, w)], done.get(keys[(s, p, w)], 0)
+            new = [(n, kg) for n, kg in evs if n >= seen]
+            if not new: continue
+            rows.append({"s": s, "p": p, "q": round(sum(kg for _, kg in new), 6), "t": w, "n": f"POS {len(new)} sự kiện",
+                         "k": f"{k}:{new[0][0]}", "w": k, "e": new[-1][0] + 1})
+        if not rows:
+            added = 0
+        elif conn.dialect.name == "sqlite":   # chế độ local: không có unnest
+            added = 0
+            for r in rows:
+                added += exec_sql(conn, """
+                    INSERT INTO transactions(store_code,pcode,qty,type,note,ts,idem_key)
+                    VALUES (:s,:p,:q,'OUT',:n,:t,:k) ON CONFLICT (idem_key, ts) DO NOTHING
+                """, {**r, "t": f"{r['t']:%Y-%m-%d %H:%M:%S.%f}"}).rowcount
+                exec_sql(conn, """
+                    INSERT INTO pos_ingest_windows(k,pos) VALUES (:w,:e)
+                    ON CONFLICT (k) DO UPDATE SET pos=GREATEST(pos_ingest_windows.pos, excluded.pos)
+                """, r)
+        else:
+            cols = {f"{c}s": [r[c] for r in rows] for c in "spqntkwe"}
+            added = exec_sql(conn, """
+                INSERT INTO transactions(store_code,pcode,qty,type,note,ts,idem_key)
+                SELECT u.s, u.p, u.q, 'OUT', u.n, u.t, u.k
+                FROM unnest(CAST(:ss AS text[]), CAST(:ps AS text[]), CAST(:qs AS numeric[]),
+                            CAST(:ns AS text[]), CAST(:ts AS timestamp[]), CAST(:ks AS text[])) AS u(s, p, q, n, t, k)
+                ON CONFLICT (idem_key, ts) DO NOTHING
+            """, cols).rowcount
+            exec_sql(conn, """
+                INSERT INTO pos_ingest_windows(k,pos)
+                SELECT * FROM unnest(CAST(:ws AS text[]), CAST(:es AS bigint[]))
+                ON CONFLICT (k) DO UPDATE SET pos=GREATEST(pos_ingest_windows.pos, EXCLUDED.pos)
+            """, cols)
+        exec_sql(conn, """
+            INSERT INTO pos_ingest_offsets(source,pos,events,ts) VALUES (:s,:e,:n,NOW())
+            ON CONFLICT (source) DO UPDATE SET pos=GREATEST(pos_ingest_offsets.pos, EXCLUDED.pos),
+              events=pos_ingest_offsets.events + EXCLUDED.events, ts=EXCLUDED.ts
+        """, {"s": source, "e": end, "n": end - start})
+    if rows: cache.bump(*{f"stock:{r['s']}" for r in rows})
+    return added
+
+def ingest(conn, f, source, batch=BATCH, window=WINDOW, follow=False, replay=False, log=print):
+    """Đọc hết nguồn (hoặc chạy mãi với follow). Trả về dict events, skipped, rejected, rows, batches, sec."""
+    start_at = 0 if replay else checkpoint(conn, source)
+    cups, loaded = load_cups(conn), time.monotonic()
+    stats = {"events": 0, "skipped": 0, "rejected": 0, "rows": 0, "batches": 0}
+    t0 = last_log = time.monotonic()
+    pend, first, last = [], None, None
+
+    def flush():
+        nonlocal pend, first, cups, loaded
+        if time.monotonic() - loaded > RELOAD_SEC: cups, loaded = load_cups(conn), time.monotonic()
+        agg, bad = aggregate(pend, cups, window)
+        stats["rows"] += post_batch(conn, source, first, last + 1, agg)
+        stats["rejected"] += bad; stats["batches"] += 1
+        pend, first = [], None
+
+    for n, ev in read_events(f, follow):
+        if n is None:                                  # --follow: nguồn đứng yên → ghi lô dở
+            if first is not None: flush()
+            continue
+        if n < start_at:
+            stats["skipped"] += 1; continue
+        if first is None: first = n
+        last = n
+        if ev is None: stats["rejected"] += 1
+        else: pend.append((n, ev))
+        stats["events"] += 1
+        if (n + 1) % batch == 0: flush()
+        if time.monotonic() - last_log > 5:
+            last_log = time.monotonic()
+            log(f"{stats['events']} sự kiện • {stats['events']/(last_log - t0):,.0f}/s • {stats['rows']} dòng OUT")
+    if first is not None: flush()
+    stats["sec"] = time.monotonic() - t0
+    return stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Nhập bán hàng POS → xuất kho CỐT/MỨT theo số cốc")
+    ap.add_argument("file", help="CSV (store,pcode,cups,ts) hoặc JSON lines; '-' = stdin")
+    ap.add_argument("--source", help="tên nguồn cho checkpoint / idem_key (mặc định: tên file)")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    ap.add_argument("--window", type=int, default=WINDOW, help="giây / khung gộp")
+    ap.add_argument("--follow", action="store_true", help="đọc tiếp khi file được ghi thêm (như tail -f)")
+    ap.add_argument("--replay", action="store_true", help="đọc lại từ đầu, bỏ qua checkpoint (không ghi trùng)")
+    a = ap.parse_args(argv)
+    source = a.source or ("stdin" if a.file == "-" else os.path.basename(a.file))
+    conn = get_conn()
+    f = sys.stdin if a.file == "-" else open(a.file, encoding="utf-8", newline="")
+    try:
+        s = ingest(conn, f, source, a.batch, a.window, a.follow, a.replay, log=lambda m: print(m, file=sys.stderr))
+    finally:
+        if f is not sys.stdin: f.close()
+        conn.close()
+    print(f"{source}: {s['events']} sự kiện ({s['skipped']} đã ghi trước, {s['rejected']} bị loại) → "
+          f"{s['rows']} dòng OUT / {s['batches']} lô trong {s['sec']:.2f}s • {s['events']/max(s['sec'],1e-9):,.0f} sự kiện/s")
+
+if __name__ == "__main__":
+    main()
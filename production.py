@@ -1,30 +1,22 @@
 # production.py
-import time, json
-from datetime import datetime
+import time, json, threading
+from datetime import datetime, date, timedelta
 import streamlit as st
-from core import fetch_df, run_sql, write_audit
+import pandas as pd
+from sqlalchemy.exc import DBAPIError
+from core import fetch_df, run_sql, exec_sql, tx, write_audit, fragment
+from finance import onhand_qty, avg_cost
+from planner import explode, invalidate_dag
+from costing import tab_costing
+from live import watch, on_change
+import cache
 
 # ===================== TỒN & GIÁ VỐN =====================
 def stock_of(conn, store, pcode) -> float:
-    df = fetch_df(conn, """
-        SELECT COALESCE(SUM(CASE WHEN type='IN'  THEN qty ELSE 0 END),0) -
-               COALESCE(SUM(CASE WHEN type='OUT' THEN qty ELSE 0 END),0) AS onhand
-        FROM transactions
-        WHERE store_code=:s AND pcode=:p
-    """, {"s": store, "p": pcode})
-    return 0.0 if df.empty else float(df.iloc[0]["onhand"] or 0.0)
+    return onhand_qty(conn, store, pcode)
 
 def avg_cost_of(conn, store, pcode) -> float:
-    df = fetch_df(conn, """
-        SELECT SUM(qty*price_in) AS cost, SUM(qty) AS qty
-        FROM transactions
-        WHERE store_code=:s AND pcode=:p AND type='IN' AND price_in IS NOT NULL AND price_in>0
-    """, {"s": store, "p": pcode})
-    if df.empty:  # fallback price_ref
-        pr = fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode})
-        return float(pr.iloc[0]["price_ref"] or 0.0) if not pr.empty else 0.0
-    cost = float(df.iloc[0]["cost"] or 0.0); qty = float(df.iloc[0]["qty"] or 0.0)
-    return (cost/qty) if qty>0 else (fetch_df(conn, "SELECT price_ref FROM products WHERE code=:p", {"p": pcode}).iloc[0]["price_ref"] or 0.0)
+    return avg_cost(conn, store, pcode)
 
 def must_have_stock(conn, store, items):
     lacks = []
@@ -47,35 +39,55 @@ def batch_id_from(ct_code: str) -> str:
     return f"{ct_code}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
 
 # ===================== ĐỌC CÔNG THỨC =====================
-def _load_header(conn, ct_code):
-    df = fetch_df(conn, """
-        SELECT code,name,type,output_pcode,output_uom,recovery,cups_per_kg,COALESCE(note,'') AS note
-        FROM formulas WHERE code=:c
-    """, {"c": ct_code})
-    return None if df.empty else df.iloc[0].to_dict()
+# Cache công thức đã "biên dịch" dùng chung cho cả process (mọi session).
+# Catalog gọi invalidate_formula() khi lưu/xoá CT hoặc sửa SP; worker khác thấy qua cache.version("catalog").
+_CT_CACHE = {}   # ct_code → (phiên bản catalog, CT)
+_CT_LOCK = threading.Lock()
 
-def _load_sources_and_other(conn, ct_code):
+def load_formula(conn, ct_code):
     """
-    Catalog đang lưu NVL chính với kind='SRC' (không định lượng), phụ gia/khác với kind='OTHER' (có qty_per_kg).
-    Ở đây tách SRC thành 2 nhóm dựa theo category của product: TRAI_CAY vs COT.
+    Trả về dict công thức: header, src_fruits, src_cots (SRC tách theo nhóm TRAI_CAY/COT)
+    và other (kind='OTHER', có qty_per_kg) — nạp bằng 1 query, cache theo mã CT.
     """
-    df_src = fetch_df(conn, """
-        SELECT fi.pcode, p.name, p.cat_code
-        FROM formula_inputs fi
-        JOIN products p ON p.code=fi.pcode
-        WHERE fi.formula_code=:c AND fi.kind='SRC'
-        ORDER BY p.name
-    """, {"c": ct_code})
-    df_other = fetch_df(conn, """
-        SELECT fi.pcode, p.name, p.uom, fi.qty_per_kg
-        FROM formula_inputs fi
-        JOIN products p ON p.code=fi.pcode
-        WHERE fi.formula_code=:c AND fi.kind='OTHER'
+    ver = cache.version("catalog")
+    with _CT_LOCK:
+        hit = _CT_CACHE.get(ct_code)
+    if hit is not None and hit[0] == ver: return hit[1]
+
+    df = fetch_df(conn, """
+        SELECT f.code, f.name, f.type, f.output_pcode, f.output_uom, f.recovery, f.cups_per_kg,
+               COALESCE(f.note,'') AS note,
+               fi.pcode, fi.kind, fi.qty_per_kg, p.name AS p_name, p.cat_code, p.uom
+        FROM formulas f
+        LEFT JOIN formula_inputs fi ON fi.formula_code=f.code
+        LEFT JOIN products p ON p.code=fi.pcode
+        WHERE f.code=:c
         ORDER BY p.name
     """, {"c": ct_code})
-    src_fruits = df_src[df_src["cat_code"]=="TRAI_CAY"].copy()
-    src_cots   = df_src[df_src["cat_code"]=="COT"].copy()
-    return src_fruits, src_cots, df_other
+    if df.empty: return None
+
+    hdr = df.iloc[0][["code","name","type","output_pcode","output_uom","recovery","cups_per_kg","note"]].to_dict()
+    inp = df[df["p_name"].notna()][["pcode","kind","qty_per_kg","p_name","cat_code","uom"]].rename(columns={"p_name": "name"})
+    src = inp[inp["kind"]=="SRC"]
+    ct = {
+        "header": hdr,
+        "src_fruits": src[src["cat_code"]=="TRAI_CAY"][["pcode","name","cat_code"]].reset_index(drop=True),
+        "src_cots":   src[src["cat_code"]=="COT"][["pcode","name","cat_code"]].reset_index(drop=True),
+        "other":      inp[inp["kind"]=="OTHER"][["pcode","name","uom","qty_per_kg"]].reset_index(drop=True),
+    }
+    with _CT_LOCK:
+        _CT_CACHE[ct_code] = (ver, ct)
+    return ct
+
+# lô đóng ở session/máy khác → tỷ lệ hiệu suất của planner đổi
+on_change("production", lambda store: invalidate_dag())
+
+def invalidate_formula(ct_code=None):
+    """Xoá cache 1 CT (hoặc toàn bộ khi ct_code=None)."""
+    with _CT_LOCK:
+        if ct_code is None: _CT_CACHE.clear()
+        else: _CT_CACHE.pop(ct_code, None)
+    invalidate_dag()
 
 def show_preview(out_rows, in_rows, total_cost=None, price_tp=None):
     st.markdown("#### 👀 Preview")
@@ -92,6 +104,7 @@ def show_preview(out_rows, in_rows, total_cost=None, price_tp=None):
         if price_tp is not None:  st.info(f"**Giá nhập TP dự kiến:** {price_tp:,.0f} / {in_rows[0]['ĐVT']}")
 
 # ===================== CỐT (1 bước) =====================
+@fragment
 def tab_cot(conn, user):
     st.markdown("### 🏭 Sản xuất CỐT (1 bước)")
     df_ct = fetch_df(conn, "SELECT code,name FROM formulas WHERE type='COT' ORDER BY name")
@@ -99,9 +112,9 @@ def tab_cot(conn, user):
     if pick == "— Chọn —": return
 
     ct_code = pick.split(" — ",1)[0]
-    hdr = _load_header(conn, ct_code)
-    if not hdr: st.error("Không thấy công thức."); return
-    src_fruits, _src_cots, df_other = _load_sources_and_other(conn, ct_code)
+    ct = load_formula(conn, ct_code)
+    if not ct: st.error("Không thấy công thức."); return
+    hdr, src_fruits, df_other = ct["header"], ct["src_fruits"], ct["other"]
 
     st.caption(f"SP đầu ra: `{hdr['output_pcode']}` • HSTH: {float(hdr['recovery'] or 1.0)} • Cốc/kg TP: {float(hdr['cups_per_kg'] or 0.0)}")
 
@@ -158,6 +171,9 @@ def tab_cot(conn, user):
             INSERT INTO transactions(store_code,pcode,qty,type,price_in,note)
             VALUES (:s,:p,:q,'IN',:pr,:n)
         """, {"s": user["store"], "p": hdr["output_pcode"], "q": kg_tp, "pr": price_in, "n": f"COT {ct_code} {bid} TP"})
+        # chi phí lô → wip_cost (trigger tổng hợp hiệu suất đọc khi lô DONE, sql/004)
+        run_sql(conn, "INSERT INTO wip_cost(batch_id,cost_total,qty_tp) VALUES (:b,:c,:q)",
+                {"b": bid, "c": total_cost or 0.0, "q": kg_tp})
 
         run_sql(conn, """
             INSERT INTO production(batch_id,ct_code,store_code,kind,status,kg_tho,kg_soche,kg_tp,out_pcode,actor,ts_create,ts_done)
@@ -165,14 +181,15 @@ def tab_cot(conn, user):
         """, {"b": bid, "c": ct_code, "s": user["store"], "a": sum([r["kg_tho"] for r in fruit_rows]),
               "k": kg_soche, "t": kg_tp, "o": hdr["output_pcode"], "u": user["email"]})
         write_audit(conn, "PROD_COT_DONE", bid)
+        cache.bump("production", f"stock:{user['store']}")
         st.success(f"Đã ghi lô {bid}."); time.sleep(0.6); st.rerun()
 
 # ===================== MỨT – DÙNG CHUNG =====================
 def _mut_step1(conn, user, ct_code, src_label):
-    hdr = _load_header(conn, ct_code)
-    if not hdr: st.error("Không thấy công thức."); return
+    ct = load_formula(conn, ct_code)
+    if not ct: st.error("Không thấy công thức."); return
 
-    src_fruits, src_cots, df_other = _load_sources_and_other(conn, ct_code)
+    hdr, src_fruits, src_cots, df_other = ct["header"], ct["src_fruits"], ct["src_cots"], ct["other"]
     st.caption(f"SP đầu ra: `{hdr['output_pcode']}` • (MỨT không dùng HSTH) • Cốc/kg TP: {float(hdr['cups_per_kg'] or 0.0)}")
 
     st.markdown(f"**1) Nguồn {src_label} — nhập kg thô:**")
@@ -237,46 +254,95 @@ def _mut_step1(conn, user, ct_code, src_label):
         """, {"b": bid, "cost": total_cost})
 
         write_audit(conn, "PROD_MUT_WIP", bid)
+        cache.bump(f"stock:{user['store']}")
         st.success(f"Đã tạo lô {bid}. Vào tab 'Hoàn thành lô' để nhập TP khi xong.")
         time.sleep(0.6); st.rerun()
 
+def load_wip(conn, store):
+    """Mọi lô WIP của cửa hàng kèm chi phí (wip_cost) và cốc/kg của CT — 1 query."""
+    return fetch_df(conn, """
+        SELECT p.batch_id, p.ct_code, f.name AS ct_name, p.kind, p.kg_tho, p.kg_soche, p.out_pcode, p.ts_create,
+               COALESCE(w.cost_total,0) AS cost_total, COALESCE(f.cups_per_kg,0) AS cups_per_kg
+        FROM production p
+        LEFT JOIN wip_cost w ON w.batch_id=p.batch_id
+        LEFT JOIN formulas f ON f.code=p.ct_code
+        WHERE p.store_code=:s AND p.status='WIP'
+        ORDER BY p.ts_create
+    """, {"s": store})
+
+def finish_batches(conn, store, kg_tp: dict) -> list:
+    """
+    Đóng nhiều lô WIP: {batch_id: kg TP}. 1 transaction: production → DONE, nhập TP (IN, giá = chi phí lô / kg TP),
+    wip_cost.qty_tp. Lô đã bị đóng ở phiên khác được bỏ qua. Trả về list batch_id đã đóng.
+    """
+    bs = list(kg_tp); qs = [float(kg_tp[b]) for b in bs]
+    if not bs: return []
+    with tx(conn):
+        if conn.dialect.name == "sqlite":   # chế độ local: không có unnest / CTE ghi dữ liệu
+            done = []
+            for b, q in zip(bs, qs):
+                r = exec_sql(conn, """
+                    UPDATE production SET status='DONE', kg_tp=:q, ts_done=NOW()
+                    WHERE batch_id=:b AND status='WIP' AND store_code=:s
+                """, {"b": b, "q": q, "s": store})
+                if not r.rowcount: continue
+                exec_sql(conn, """
+                    INSERT INTO transactions(store_code,pcode,qty,type,price_in,note)
+                    SELECT p.store_code, p.out_pcode, :q, 'IN',
+                           CASE WHEN :q>0 THEN COALESCE(w.cost_total,0)/:q ELSE 0 END, p.batch_id || ' TP MUT'
+                    FROM production p LEFT JOIN wip_cost w ON w.batch_id=p.batch_id WHERE p.batch_id=:b
+                """, {"b": b, "q": q})
+                exec_sql(conn, "UPDATE wip_cost SET qty_tp=:q WHERE batch_id=:b", {"q": q, "b": b})
+                done.append(b)
+        else:
+            done = exec_sql(conn, """
+                WITH u AS (
+                  SELECT b, q FROM unnest(CAST(:bs AS text[]), CAST(:qs AS numeric[])) AS u(b, q)
+                ), done AS (
+                  UPDATE production p SET status='DONE', kg_tp=u.q, ts_done=NOW()
+                  FROM u WHERE p.batch_id=u.b AND p.status='WIP' AND p.store_code=:s
+                  RETURNING p.batch_id, p.store_code, p.out_pcode, u.q
+                ), tin AS (
+                  INSERT INTO transactions(store_code,pcode,qty,type,price_in,note)
+                  SELECT d.store_code, d.out_pcode, d.q, 'IN',
+                         CASE WHEN d.q>0 THEN COALESCE(w.cost_total,0)/d.q ELSE 0 END, d.batch_id || ' TP MUT'
+                  FROM done d LEFT JOIN wip_cost w ON w.batch_id=d.batch_id
+                ), wc AS (
+                  UPDATE wip_cost w SET qty_tp=d.q FROM done d WHERE w.batch_id=d.batch_id
+                )
+                SELECT batch_id FROM done
+            """, {"bs": bs, "qs": qs, "s": store}).scalars().all()
+    if done: cache.bump("production", f"stock:{store}")
+    return done
+
+@fragment
 def _mut_step2_finish(conn, user):
     st.markdown("### ✅ Hoàn thành lô MỨT (Bước 2)")
-    df_wip = fetch_df(conn, """
-        SELECT batch_id,ct_code,kind,store_code,kg_soche,out_pcode,ts_create
-        FROM production
-        WHERE status='WIP' AND store_code=:s
-        ORDER BY ts_create DESC
-    """, {"s": user["store"]})
-    if df_wip.empty:
+    df = load_wip(conn, user["store"])
+    if df.empty:
         st.info("Chưa có lô WIP tại cửa hàng."); return
-
-    opts = [f"{r['batch_id']} — {r['ct_code']} — {r['kind']} — {r['ts_create']}" for _,r in df_wip.iterrows()]
-    pick = st.selectbox("Chọn lô WIP", opts)
-    if not pick: return
-    bid = pick.split(" — ",1)[0]
-    row = df_wip[df_wip["batch_id"]==bid].iloc[0].to_dict()
-
-    df_cost = fetch_df(conn, "SELECT cost_total FROM wip_cost WHERE batch_id=:b", {"b": bid})
-    cost_total = float(df_cost.iloc[0]["cost_total"] or 0.0) if not df_cost.empty else 0.0
-
-    kg_tp  = st.number_input("Kg thành phẩm MỨT (nhập tay)", min_value=0.0, step=0.1, value=0.0)
-    cups_pk = fetch_df(conn, "SELECT cups_per_kg FROM formulas WHERE code=:c", {"c": row["ct_code"]})
-    cups = kg_tp * float(cups_pk.iloc[0]["cups_per_kg"] or 0.0) if not cups_pk.empty else 0.0
-
-    price_in = (cost_total/kg_tp) if kg_tp>0 else 0.0
-    show_preview([], [{"pcode": row["out_pcode"], "diễn giải":"TP MỨT", "SL nhập": kg_tp, "ĐVT":"kg", "≈ cốc": int(round(cups))}],
-                 cost_total, price_in)
-
-    if st.button("✔️ Nhập TP & đóng lô", type="primary"):
-        run_sql(conn, """
-            INSERT INTO transactions(store_code,pcode,qty,type,price_in,note)
-            VALUES (:s,:p,:q,'IN',:pr,:n)
-        """, {"s": row["store_code"], "p": row["out_pcode"], "q": kg_tp, "pr": price_in, "n": f"{bid} TP MUT"})
-        run_sql(conn, "UPDATE production SET status='DONE', kg_tp=:q, ts_done=NOW() WHERE batch_id=:b", {"q": kg_tp, "b": bid})
-        run_sql(conn, "UPDATE wip_cost SET qty_tp=:q WHERE batch_id=:b", {"q": kg_tp, "b": bid})
-        write_audit(conn, "PROD_MUT_DONE", bid)
-        st.success(f"Đã nhập TP & đóng lô {bid}."); time.sleep(0.6); st.rerun()
+    df["kg_tp"] = 0.0
+    st.caption("Nhập kg thành phẩm cho các lô đã xong (để 0 = chưa đóng), rồi đóng tất cả 1 lần.")
+    ed = st.data_editor(df, key="wip_finish", use_container_width=True, hide_index=True,
+        disabled=[c for c in df.columns if c != "kg_tp"],
+        column_order=["batch_id","ct_code","ct_name","kind","kg_tho","kg_soche","cost_total","ts_create","kg_tp"],
+        column_config={"batch_id": "Lô", "ct_code": "CT", "ct_name": "Tên CT", "kind": "Loại",
+                       "kg_tho": "Kg thô", "kg_soche": "Kg sơ chế", "cost_total": "Chi phí lô", "ts_create": "Tạo lúc",
+                       "kg_tp": st.column_config.NumberColumn("Kg TP", min_value=0.0, step=0.1)})
+    ed = ed[ed["kg_tp"].astype(float) > 0].copy()
+    if ed.empty: return
+    ed["price_in"] = ed["cost_total"].astype(float) / ed["kg_tp"].astype(float)
+    ed["cups"] = (ed["kg_tp"].astype(float) * ed["cups_per_kg"].astype(float)).round(0)
+    st.dataframe(ed[["batch_id","out_pcode","kg_tp","cups","cost_total","price_in"]].rename(columns={
+        "batch_id": "Lô", "out_pcode": "SP nhập", "kg_tp": "Kg TP", "cups": "≈ cốc",
+        "cost_total": "Chi phí", "price_in": "Giá nhập TP"}), use_container_width=True, hide_index=True)
+
+    if st.button(f"✔️ Nhập TP & đóng {len(ed)} lô", type="primary", key="btn_finish_bulk"):
+        done = finish_batches(conn, user["store"], dict(zip(ed["batch_id"], ed["kg_tp"].astype(float))))
+        write_audit(conn, "PROD_MUT_DONE", ",".join(done))
+        skipped = len(ed) - len(done)
+        st.success(f"Đã đóng {len(done)} lô." + (f" Bỏ qua {skipped} lô đã đóng ở phiên khác." if skipped else ""))
+        time.sleep(0.6); st.rerun()
 
 # ===================== LỊCH SỬ LÔ =====================
 def tab_history(conn, user):
@@ -287,30 +353,140 @@ def tab_history(conn, user):
         WHERE store_code=:s
         ORDER BY ts_create DESC
         LIMIT 200
-    """, {"s": user["store"]})
+    """, {"s": user["store"]}, report=True)
     st.dataframe(df, use_container_width=True)
 
+# ===================== HIỆU SUẤT =====================
+YIELD_DIMS = {"Công thức": "ct_code", "Cửa hàng": "store_code", "Tuần": "week"}
+
+def yield_summary(conn, d_from, d_to, store=None, by=("ct_code",)):
+    """
+    Hiệu suất theo nhóm `by` từ bảng tổng hợp production_yield_agg (sql/004), không đọc production.
+    HSTH thực = kg_tp/kg_soche; HSTH CT lấy bình quân theo kg sơ chế; chi phí / kg TP và / cốc.
+    """
+    params = {"f": d_from, "t": d_to}
+    where = " WHERE a.week >= :f AND a.week <= :t "
+    if store: where += " AND a.store_code=:s "; params["s"] = store
+    df = fetch_df(conn, f"""
+        SELECT a.ct_code, f.name, a.store_code, a.week, COALESCE(f.recovery,1) AS recovery,
+               a.batches, a.kg_tho, a.kg_soche, a.kg_tp, a.cost_total, a.cups
+        FROM production_yield_agg a LEFT JOIN formulas f ON f.code=a.ct_code
+        {where}
+    """, params, report=True)
+    if df.empty: return df
+    num = ["batches","kg_tho","kg_soche","kg_tp","cost_total","cups"]
+    df[num+["recovery"]] = df[num+["recovery"]].astype(float)
+    df["rec_w"] = df["recovery"] * df["kg_soche"]
+    by = list(by)
+    g = df.groupby(by, as_index=False).agg({**{c: "sum" for c in num+["rec_w"]},
+                                           **({"name": "first"} if "ct_code" in by else {})})
+    ks = g["kg_soche"].where(g["kg_soche"] > 0)
+    g["hsth_ct"]  = g["rec_w"] / ks
+    g["hsth_thuc"] = g["kg_tp"] / ks
+    g["chenh_lech"] = g["hsth_thuc"] - g["hsth_ct"]
+    g["cost_per_kg"]  = g["cost_total"] / g["kg_tp"].where(g["kg_tp"] > 0)
+    g["cost_per_cup"] = g["cost_total"] / g["cups"].where(g["cups"] > 0)
+    g["batches"] = g["batches"].astype(int)
+    return g.drop(columns="rec_w").sort_values(by).reset_index(drop=True)
+
+@fragment
+def tab_yield(conn, user):
+    st.markdown("### 📈 Hiệu suất sản xuất")
+    c1, c2, c3 = st.columns([1, 1, 2])
+    with c1: d_from = st.date_input("Từ tuần", value=date.today() - timedelta(weeks=12), key="yld_from")
+    with c2: d_to = st.date_input("Đến tuần", value=date.today(), key="yld_to")
+    with c3: dims = st.multiselect("Nhóm theo", list(YIELD_DIMS), default=["Công thức"], key="yld_by")
+    all_st = st.checkbox("Tất cả cửa hàng", value=False, key="yld_all")
+    by = [YIELD_DIMS[d] for d in dims] or ["ct_code"]
+    try:
+        df = yield_summary(conn, d_from - timedelta(days=d_from.weekday()), d_to,
+                           None if all_st else user["store"], by)
+    except DBAPIError as e:
+        conn.rollback()
+        st.error(f"Chưa có bảng tổng hợp (xem sql/004_production_yield_agg.sql). Chi tiết: {e}"); return
+    if df.empty:
+        st.info("Chưa có lô hoàn thành trong khoảng này."); return
+    st.dataframe(df.rename(columns={
+        "ct_code": "CT", "name": "Tên CT", "store_code": "Cửa hàng", "week": "Tuần", "batches": "Số lô",
+        "kg_tho": "Kg thô", "kg_soche": "Kg sơ chế", "kg_tp": "Kg TP", "cost_total": "Chi phí",
+        "cups": "Cốc", "hsth_ct": "HSTH CT", "hsth_thuc": "HSTH thực", "chenh_lech": "Chênh lệch",
+        "cost_per_kg": "Chi phí/kg TP", "cost_per_cup": "Chi phí/cốc"}),
+        use_container_width=True, hide_index=True)
+
+# ===================== KẾ HOẠCH NVL =====================
+@fragment
+def tab_plan(conn, user):
+    st.markdown("### 🧮 Kế hoạch NVL (nổ công thức nhiều cấp)")
+    df_ct = fetch_df(conn, "SELECT code,name FROM formulas ORDER BY code")
+    if df_ct.empty:
+        st.info("Chưa có công thức."); return
+    seed = pd.DataFrame({"ct_code": pd.Series(dtype=str), "qty": pd.Series(dtype=float), "unit": pd.Series(dtype=str)})
+    targets = st.data_editor(seed, num_rows="dynamic", use_container_width=True, key="plan_targets",
+        column_config={
+            "ct_code": st.column_config.SelectboxColumn("Công thức", options=df_ct["code"].tolist(), required=True),
+            "qty": st.column_config.NumberColumn("Số lượng", min_value=0.0, step=1.0, required=True),
+            "unit": st.column_config.SelectboxColumn("ĐVT", options=["cốc","kg"], default="cốc", required=True)})
+    c1, c2 = st.columns(2)
+    with c1: net_stock = st.checkbox("Trừ tồn hiện có ở mọi cấp", value=True, key="plan_net")
+    with c2: actual = st.checkbox("Theo hiệu suất thực tế (lô đã đóng)", value=False, key="plan_actual")
+    st.caption(("Định mức theo hiệu suất thực tế các lô đã đóng (CT chưa có lô → HSTH)" if actual else "Định mức theo HSTH của CT")
+               + " • Nhiều nguồn SRC: giả định chia đều kg thô cho các nguồn.")
+    targets = targets.dropna(subset=["ct_code","qty"])
+    if targets.empty:
+        st.caption("Thêm dòng: công thức + số cốc/kg cần phục vụ."); return
+    t0 = time.perf_counter()
+    try:
+        rows = explode(conn, user["store"], targets.fillna({"unit": "cốc"}).to_dict("records"), net_stock, actual)
+    except ValueError as e:
+        st.error(str(e)); return
+    df = pd.DataFrame(rows)
+    dfp = fetch_df(conn, "SELECT code AS pcode, name, uom FROM products")
+    df = dfp.merge(df, on="pcode", how="right")
+    for c in ["gross","onhand","net","short"]: df[c] = df[c].round(3)
+    names = {"pcode":"Mã SP","name":"Tên SP","uom":"ĐVT","level":"Cấp","make_ct":"CT sản xuất",
+             "gross":"Nhu cầu","onhand":"Tồn","net":"Cần SX/mua","short":"Thiếu"}
+    st.markdown("**Cần sản xuất:**")
+    st.dataframe(df[df["make_ct"].notna()].drop(columns="short").rename(columns=names), use_container_width=True, hide_index=True)
+    st.markdown("**NVL:**")
+    st.dataframe(df[df["make_ct"].isna()].drop(columns=["make_ct","net"]).rename(columns=names), use_container_width=True, hide_index=True)
+    short = df[df["short"] > 1e-9]
+    if short.empty: st.success("Đủ NVL cho kế hoạch.")
+    else: st.error("Thiếu: " + ", ".join(f"{r['name'] or r['pcode']} {r['short']:g} {r['uom'] or ''}" for _, r in short.iterrows()))
+    st.caption(f"Tính trong {(time.perf_counter()-t0)*1000:.0f} ms")
+
 # ===================== ENTRY PAGE =====================
 def page_production(conn, user):
     st.markdown("## 🧯 Sản xuất")
-    tabs = st.tabs(["CỐT (1 bước)", "MỨT từ TRÁI CÂY", "MỨT từ CỐT", "Lịch sử lô"])
+    watch(st.session_state.get("store"), ["production", "stock"], "prod")
+    tabs = st.tabs(["CỐT (1 bước)", "MỨT từ TRÁI CÂY", "MỨT từ CỐT", "Hoàn thành lô", "Lịch sử lô", "Hiệu suất", "Kế hoạch NVL", "Giá vốn CT"])
     with tabs[0]: tab_cot(conn, user)
-    with tabs[1]: _mut_step1(conn, user, _pick_ct(conn, 'MUT', want='TC'), "TRÁI CÂY") if True else None
-    with tabs[2]: _mut_step1(conn, user, _pick_ct(conn, 'MUT', want='CT'), "CỐT")    if True else None
-    with tabs[3]: tab_history(conn, user)
-
-# Helper chọn CT cho 2 tab mứt (lọc theo SRC trong inputs)
+    with tabs[1]: _tab_mut(conn, user, 'TC', "TRÁI CÂY")
+    with tabs[2]: _tab_mut(conn, user, 'CT', "CỐT")
+    with tabs[3]: _mut_step2_finish(conn, user)
+    with tabs[4]: tab_history(conn, user)
+    with tabs[5]: tab_yield(conn, user)
+    with tabs[6]: tab_plan(conn, user)
+    with tabs[7]: tab_costing(conn, user)
+
+@fragment
+def _tab_mut(conn, user, want, src_label):
+    ct_code = _pick_ct(conn, 'MUT', want=want)
+    if ct_code: _mut_step1(conn, user, ct_code, src_label)
+
+# Helper chọn CT cho 2 tab mứt (lọc theo SRC trong inputs). Chưa chọn/không hợp lệ → None
+# (không st.stop() để các tab sau vẫn được vẽ)
 def _pick_ct(conn, ct_type, want='TC'):
     df = fetch_df(conn, "SELECT code,name FROM formulas WHERE type=:t ORDER BY name", {"t": ct_type})
     opts = ["— Chọn —"]+[f"{r['code']} — {r['name']}" for _,r in df.iterrows()]
     pick = st.selectbox("Công thức", opts, key=f"ct_{ct_type}_{want}")
-    if pick=="— Chọn —": st.stop()
+    if pick=="— Chọn —": return None
     ct_code = pick.split(" — ",1)[0]
 
     # xác nhận đúng loại nguồn mong muốn
-    src_fruits, src_cots, _ = _load_sources_and_other(conn, ct_code)
-    if want=='TC' and (src_fruits is None or src_fruits.empty):
-        st.error("CT này không có nguồn TRÁI CÂY. Chọn CT khác."); st.stop()
-    if want=='CT' and (src_cots is None or src_cots.empty):
-        st.error("CT này không có nguồn CỐT. Chọn CT khác."); st.stop()
+    ct = load_formula(conn, ct_code)
+    if not ct: st.error("Không thấy công thức."); return None
+    if want=='TC' and ct["src_fruits"].empty:
+        st.error("CT này không có nguồn TRÁI CÂY. Chọn CT khác."); return None
+    if want=='CT' and ct["src_cots"].empty:
+        st.error("CT này không có nguồn CỐT. Chọn CT khác."); return None
     return ct_code
@@ -0,0 +1,114 @@
+# profiling.py
+# Đo thời gian theo trang/tab cho từng lần rerun (opt-in): PROFILE=1 hoặc Admin bật ở sidebar.
+# Bật → thay các hàm page_*/tab_* của module trang (và st.dataframe / st.data_editor) bằng wrapper đo giờ;
+# tắt → trả lại hàm gốc, không còn lớp bọc nào (không tốn chi phí).
+# PROFILE_MODE=cprofile: lưu thêm file .prof mỗi lần rerun (mở bằng snakeviz / pstats);
+# PROFILE_MODE=sample: lấy mẫu stack bằng pyinstrument (nếu đã cài) → .speedscope.json (speedscope.app).
+import os, sys, time, cProfile, inspect, functools, threading
+from datetime import datetime
+import streamlit as st
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+MODES = ["timing", "cprofile", "sample"]
+_ST_FUNCS = ["dataframe", "data_editor"]
+
+_LOCK = threading.Lock()
+_STATE = {"on": False, "mode": "timing", "modules": set()}
+_ORIG = {}                  # (đối tượng chứa, tên) → hàm gốc
+_RUN = threading.local()    # mỗi rerun chạy trên thread riêng của session
+
+def enabled() -> bool:
+    return _STATE["on"]
+
+def mode() -> str:
+    return _STATE["mode"]
+
+def _wrap(qual, fn):
+    @functools.wraps(fn)
+    def w(*a, **k):
+        rec = getattr(_RUN, "rec", None)
+        if rec is None: return fn(*a, **k)
+        i, depth = len(rec), _RUN.depth
+        rec.append([depth, qual, None]); _RUN.depth = depth + 1
+        t = time.perf_counter()
+        try:
+            return fn(*a, **k)
+        finally:
+            rec[i][2] = (time.perf_counter() - t) * 1000; _RUN.depth = depth
+    w._prof_orig = fn
+    return w
+
+def _patch(owner, name, qual):
+    fn = getattr(owner, name, None)
+    if fn is None or hasattr(fn, "_prof_orig"): return
+    _ORIG[(owner, name)] = fn
+    setattr(owner, name, _wrap(qual, fn))
+
+def instrument(module):
+    """Bọc page_*/tab_* định nghĩa trong module (gọi sau khi import lười trang). Tắt → không làm gì."""
+    if not _STATE["on"]: return
+    with _LOCK:
+        _STATE["modules"].add(module.__name__)
+        for name, obj in list(vars(module).items()):
+            if (name.startswith("page_") or name.startswith("tab_")) and inspect.isfunction(obj) \
+                    and obj.__module__ == module.__name__:
+                _patch(module, name, f"{module.__name__}.{name}")
+
+def set_enabled(on: bool, how: str = None, modules=()):
+    """Bật/tắt cho cả process. Bật: bọc các module trang đã nạp + st.dataframe/st.data_editor."""
+    if how: _STATE["mode"] = how if how in MODES else "timing"
+    if on == _STATE["on"]: return
+    with _LOCK:
+        _STATE["on"] = on
+        if not on:
+            for (owner, name), fn in _ORIG.items(): setattr(owner, name, fn)
+            _ORIG.clear(); _STATE["modules"].clear()
+            return
+        for name in _ST_FUNCS: _patch(st, name, f"st.{name}")
+    for m in modules:
+        if m in sys.modules: instrument(sys.modules[m])
+
+def profile_run(label, fn, *a, **k):
+    """Chạy fn (router) với đo giờ của 1 lần rerun; kết quả lấy bằng last_run(). Tắt → gọi thẳng."""
+    _RUN.last = None
+    if not _STATE["on"]: return fn(*a, **k)
+    _RUN.rec, _RUN.depth = [], 0
+    how, prof, sampler, t = _STATE["mode"], None, None, time.perf_counter()
+    if how == "cprofile":
+        prof = cProfile.Profile(); prof.enable()
+    elif how == "sample":
+        try:
+            from pyinstrument import Profiler
+            sampler = Profiler(); sampler.start()
+        except ImportError:
+            how = "timing (chưa cài pyinstrument)"
+    try:
+        return fn(*a, **k)
+    finally:
+        total = (time.perf_counter() - t) * 1000
+        if prof: prof.disable()
+        if sampler: sampler.stop()
+        rec = [[0, label, total]] + [[d + 1, q, ms] for d, q, ms in _RUN.rec]
+        _RUN.rec = None
+        page = next((q.split(".")[-1] for _, q, _ in rec if ".page_" in q), label)
+        path = None
+        try:
+            if prof or sampler:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                base = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{page}")
+                if prof:
+                    path = base + ".prof"; prof.dump_stats(path)
+                else:
+                    from pyinstrument.renderers import SpeedscopeRenderer
+                    path = base + ".speedscope.json"
+                    with open(path, "w") as f: f.write(sampler.output(SpeedscopeRenderer()))
+        except Exception as e:
+            path = f"(không ghi được file: {e})"
+        _RUN.last = {"mode": how, "rows": rec, "file": path}
+
+def last_run():
+    """{mode, rows: [[cấp, hàm, ms]], file} của lần rerun vừa chạy trên thread này, hoặc None."""
+    return getattr(_RUN, "last", None)
+
+if os.getenv("PROFILE", "") not in ("", "0"):
+    set_enabled(True, os.getenv("PROFILE_MODE", "timing"))
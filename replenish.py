@@ -0,0 +1,110 @@
+# replenish.py
+# Tốc độ tiêu thụ, số ngày đủ dùng và điểm đặt hàng cho mọi (cửa hàng, SP) từ các dòng OUT.
+# Lượng xuất theo ngày được cache trong process và chỉ đọc thêm phần mới: dòng có id > id đã xử lý, cộng
+# quét lại từng dòng trong OVERLAP gần nhất (lọc trùng theo id) — id cấp theo sequence nhưng commit không
+# theo thứ tự, replica có thể trễ → dòng id nhỏ hiện ra muộn vẫn được tính. Sang ngày mới thì dựng lại
+# (bỏ ngày quá HORIZON, nhận cả dòng đã bị lưu trữ/xoá). Ngày chia theo REPORT_TZ như finance.inv_daily_series.
+import threading
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from core import fetch_df
+from finance import REPORT_TZ
+
+HORIZON = 120   # số ngày lịch sử giữ trong cache (cửa sổ tối đa)
+OVERLAP = timedelta(minutes=10)   # > thời gian 1 transaction ghi kho + độ trễ replica
+_LOCK = threading.Lock()
+_STATE = {"day": None, "ver": 0, "last_id": 0, "lo": None, "seen": {}, "daily": None, "stats": {}}
+
+def _empty_daily():
+    return pd.Series(dtype=float, index=pd.MultiIndex.from_arrays([[], [], []], names=["store_code","pcode","d"]))
+
+def _day(col):
+    # mốc 0h theo REPORT_TZ (Postgres: timestamptz, SQLite: chuỗi UTC) → ngày không kèm múi giờ
+    return pd.to_datetime(col, utc=True).dt.tz_convert(REPORT_TZ).dt.tz_localize(None).dt.normalize()
+
+def _today():
+    return datetime.now(REPORT_TZ).date()
+
+def refresh(conn) -> int:
+    """
+    Cộng thêm lượng OUT mới vào cache theo ngày. Trả về số phiên bản (tăng khi có dòng mới).
+    - ts < lo: gộp sẵn trong SQL, chỉ dòng id > last_id (chưa từng đọc).
+    - ts >= lo (lo = giờ hiện tại − OVERLAP, không lùi): đọc từng dòng, bỏ id đã cộng (seen).
+    """
+    today = _today()
+    with _LOCK:
+        if _STATE["day"] != today:
+            _STATE.update(day=today, ver=_STATE["ver"] + 1, last_id=0, lo=None, seen={}, daily=_empty_daily(), stats={})
+        since = datetime.combine(today - timedelta(days=HORIZON - 1), datetime.min.time(), tzinfo=REPORT_TZ)
+        lo = max(_STATE["lo"] or since, datetime.now(timezone.utc).replace(microsecond=0) - OVERLAP)
+        params = {"last": int(_STATE["last_id"]), "since": since, "lo": lo, "tz": str(REPORT_TZ)}
+        old = fetch_df(conn, """
+            SELECT store_code, pcode, DATE_TRUNC('day', ts, :tz) AS d, SUM(qty) AS qty, MAX(id) AS max_id
+            FROM transactions
+            WHERE type='OUT' AND id > :last AND ts >= :since AND ts < :lo
+            GROUP BY 1, 2, 3
+        """, params, report=True)
+        new = fetch_df(conn, """
+            SELECT id, store_code, pcode, DATE_TRUNC('day', ts, :tz) AS d, qty, ts
+            FROM transactions
+            WHERE type='OUT' AND ts >= :since AND ts >= :lo
+        """, params, report=True)
+        seen = {i: t for i, t in _STATE["seen"].items() if t >= lo}
+        new = new[~new["id"].isin(seen)].copy()
+        parts = [_STATE["daily"]]
+        for df in (old, new):
+            if df.empty: continue
+            df["d"] = _day(df["d"])
+            parts.append(df.groupby(["store_code","pcode","d"])["qty"].sum().astype(float))
+        if not new.empty:
+            seen.update(zip(new["id"].astype(int), pd.to_datetime(new["ts"], utc=True)))
+        _STATE.update(lo=lo, seen=seen)
+        if len(parts) > 1:
+            _STATE["daily"] = pd.concat(parts).groupby(level=[0, 1, 2]).sum()
+            ids = [int(_STATE["last_id"])] + [int(df[c].max()) for df, c in ((old, "max_id"), (new, "id")) if not df.empty]
+            _STATE.update(last_id=max(ids), ver=_STATE["ver"] + 1)
+        return _STATE["ver"]
+
+def consumption_stats(conn, window: int = 28) -> pd.DataFrame:
+    """
+    Tiêu thụ bình quân/ngày (cửa sổ trượt `window` ngày, tính cả ngày không xuất = 0), độ lệch chuẩn
+    và bình quân 7 ngày gần nhất cho mọi (store_code, pcode) — 1 lượt rolling trên bảng ngày × SP.
+    """
+    window = max(1, min(int(window), HORIZON))
+    ver = refresh(conn)
+    with _LOCK:
+        hit = _STATE["stats"].get(window)
+        if hit and hit[0] == ver: return hit[1]
+        daily = _STATE["daily"]
+    cols = ["store_code","pcode","avg_daily","std_daily","avg_7d"]
+    if daily.empty:
+        out = pd.DataFrame(columns=cols)
+    else:
+        days = pd.date_range(pd.Timestamp(_today()) - pd.Timedelta(days=HORIZON - 1), periods=HORIZON, freq="D")
+        wide = daily.unstack(["store_code","pcode"]).reindex(days).fillna(0.0)
+        roll = wide.rolling(window, min_periods=1)
+        out = pd.DataFrame({"avg_daily": roll.mean().iloc[-1], "std_daily": roll.std().iloc[-1].fillna(0.0),
+                            "avg_7d": wide.tail(7).mean()}).reset_index()[cols]
+    with _LOCK:
+        _STATE["stats"][window] = (ver, out)
+    return out
+
+def reorder_table(conn, store, onhand: pd.DataFrame, window: int = 28, lead_days: float = 3,
+                  z: float = 1.65, review_days: float = 7) -> pd.DataFrame:
+    """
+    Ghép tồn hiện tại (DF có cột pcode, onhand) với tốc độ tiêu thụ của cửa hàng:
+      days_cover = onhand / avg_daily
+      rop        = avg_daily * lead_days + z * std_daily * sqrt(lead_days)   (điểm đặt hàng)
+      suggest    = max(rop + avg_daily * review_days - onhand, 0)            (SL gợi ý đặt)
+    """
+    st_ = consumption_stats(conn, window)
+    st_ = st_[st_["store_code"] == store].drop(columns="store_code")
+    df = onhand[["pcode","onhand"]].merge(st_, on="pcode", how="outer")
+    df[["onhand","avg_daily","std_daily","avg_7d"]] = df[["onhand","avg_daily","std_daily","avg_7d"]].astype(float).fillna(0.0)
+    use = df["avg_daily"].where(df["avg_daily"] > 0)
+    df["days_cover"] = (df["onhand"] / use).round(1)
+    df["rop"] = df["avg_daily"] * lead_days + z * df["std_daily"] * (lead_days ** 0.5)
+    df["suggest"] = (df["rop"] + df["avg_daily"] * review_days - df["onhand"]).clip(lower=0.0)
+    df["reorder"] = (df["avg_daily"] > 0) & (df["onhand"] <= df["rop"])
+    for c in ["avg_daily","std_daily","avg_7d","rop","suggest"]: df[c] = df[c].round(2)
+    return df
@@ -0,0 +1,93 @@
+# search.py
+# Tìm sản phẩm cho ô chọn SP: chỉ nạp vài dòng khớp nhất vào widget thay vì cả danh mục.
+# - Chỉ mục tiền tố trong process (mã, tên, từng từ của tên — list đã sắp xếp + bisect), dùng chung
+#   mọi session, nạp lại sau PRODUCT_TTL giây, khi catalog gọi invalidate_products() hoặc khi phiên bản
+#   cache "catalog" đổi (worker khác sửa SP). Danh mục đọc qua cache chung (cache.py): 1 worker query DB.
+# - Thiếu kết quả → tìm chứa chuỗi trên Postgres (ILIKE, dùng index pg_trgm ở sql/007_products_trgm.sql).
+import time, bisect, threading
+import streamlit as st
+from core import fetch_df
+import cache
+
+PRODUCT_TTL = 300
+TOP_N = 20
+_LOCK = threading.Lock()
+_IDX = {"t": 0.0, "ver": None, "keys": [], "rank": [], "rows": {}, "by_name": []}   # keys/rank: 3 list theo hạng
+
+def invalidate_products():
+    with _LOCK:
+        _IDX["t"] = 0.0
+
+def products_df(conn):
+    """Cả danh mục SP (code, name, cat_code, uom, cups_per_kg, price_ref) — cache chung các worker."""
+    return cache.cached("catalog", "products", ttl=PRODUCT_TTL,
+                        fn=lambda: fetch_df(conn, "SELECT code,name,cat_code,uom,cups_per_kg,price_ref FROM products"))
+
+def _index(conn):
+    ver = cache.version("catalog")
+    with _LOCK:
+        if _IDX["ver"] == ver and time.monotonic() - _IDX["t"] < PRODUCT_TTL: return _IDX
+    df = products_df(conn)
+    rows, ent = {}, ([], [], [])
+    for r in df.to_dict("records"):
+        code, name = str(r["code"]), str(r["name"] or "")
+        rows[code] = r
+        # hạng: 0 = mã, 1 = đầu tên, 2 = đầu 1 từ trong tên
+        ent[0].append((code.lower(), code))
+        ent[1].append((name.lower(), code))
+        ent[2].extend((w, code) for w in name.lower().split()[1:])
+    for e in ent: e.sort()
+    with _LOCK:
+        _IDX.update(t=time.monotonic(), ver=ver, keys=[[k for k, _ in e] for e in ent], rank=ent, rows=rows,
+                    by_name=sorted(rows.values(), key=lambda r: str(r["name"] or "")))
+    return _IDX
+
+def search_products(conn, q: str, limit: int = TOP_N, cats=None) -> list:
+    """Tối đa `limit` SP (dict) khớp q: tiền tố mã/tên/từ trước, rồi chứa chuỗi (server). q rỗng → theo tên."""
+    idx = _index(conn)
+    q = (q or "").strip().lower()
+    ok = (lambda r: r["cat_code"] in cats) if cats else (lambda r: True)
+    if not q:
+        out = []
+        for r in idx["by_name"]:
+            if ok(r): out.append(r)
+            if len(out) >= limit: break
+        return out
+    # quét lần lượt từng hạng từ vị trí bisect, dừng khi đủ limit → không phụ thuộc số dòng khớp
+    out, seen = [], set()
+    for keys, ent in zip(idx["keys"], idx["rank"]):
+        i = bisect.bisect_left(keys, q)
+        while i < len(keys) and len(out) < limit and keys[i].startswith(q):
+            code = ent[i][1]; i += 1
+            if code in seen or not ok(idx["rows"][code]): continue
+            seen.add(code); out.append(idx["rows"][code])
+    if len(out) < limit and len(q) >= 2:
+        params = {"pat": f"%{q}%", "n": limit}
+        where = ""
+        if cats: where = " AND cat_code = ANY(:cats) "; params["cats"] = list(cats)
+        df = fetch_df(conn, f"""
+            SELECT code,name,cat_code,uom,cups_per_kg,price_ref FROM products
+            WHERE (name ILIKE :pat OR code ILIKE :pat) {where}
+            ORDER BY name LIMIT :n
+        """, params)
+        out += [r for r in df.to_dict("records") if r["code"] not in seen][:limit - len(out)]
+    return out
+
+def product_label(r) -> str:
+    return f"{r['code']} — {r['name']}"
+
+def product_picker(conn, label, key, cats=None, limit=TOP_N):
+    """
+    Ô tìm + selectbox chỉ chứa top kết quả. Nhãn "mã — tên", chưa chọn = "— Chọn —".
+    Trả về dict SP (code, name, cat_code, uom, cups_per_kg, price_ref) hoặc None.
+    """
+    q = st.text_input(f"🔎 {label}", key=f"{key}_q", placeholder="Gõ mã hoặc tên…")
+    rows = search_products(conn, q, limit, cats)
+    by_label = {product_label(r): r for r in rows}
+    # giữ lựa chọn đang có dù không còn trong kết quả mới
+    cur = st.session_state.get(key)
+    if cur and cur != "— Chọn —" and cur not in by_label:
+        r = _index(conn)["rows"].get(cur.split(" — ", 1)[0])
+        if r: by_label = {product_label(r): r, **by_label}
+    pick = st.selectbox(label, ["— Chọn —"] + list(by_label), key=key)
+    return by_label.get(pick)
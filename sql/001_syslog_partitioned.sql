@@ -0,0 +1,45 @@
+-- 001: syslog phân vùng theo tháng (RANGE ts) + index cho màn hình Nhật ký.
+-- Chạy 1 lần trên Postgres (Supabase SQL editor hoặc psql). Các tháng mới do
+-- partitions.ensure_month_partitions tạo; tháng cũ do audit.syslog_retention xoá/lưu trữ.
+BEGIN;
+
+ALTER TABLE syslog RENAME TO syslog_old;
+ALTER SEQUENCE IF EXISTS syslog_id_seq RENAME TO syslog_old_id_seq;
+
+CREATE TABLE syslog (
+  id     bigserial,
+  ts     timestamptz NOT NULL DEFAULT now(),
+  actor  text,
+  action text,
+  detail text,
+  PRIMARY KEY (ts, id)
+) PARTITION BY RANGE (ts);
+
+-- Dòng ngoài mọi khoảng tháng rơi vào đây (không làm mất nhật ký)
+CREATE TABLE syslog_default PARTITION OF syslog DEFAULT;
+
+DO $$
+DECLARE m date;
+BEGIN
+  FOR m IN
+    SELECT generate_series(date_trunc('month', COALESCE((SELECT min(ts) FROM syslog_old), now())),
+                           date_trunc('month', now()) + interval '2 months',
+                           interval '1 month')::date
+  LOOP
+    EXECUTE format('CREATE TABLE %I PARTITION OF syslog FOR VALUES FROM (%L) TO (%L)',
+                   'syslog_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'),
+                   m, (m + interval '1 month')::date);
+  END LOOP;
+END $$;
+
+INSERT INTO syslog(id, ts, actor, action, detail)
+SELECT id, COALESCE(ts, now()), actor, action, detail FROM syslog_old;
+SELECT setval(pg_get_serial_sequence('syslog', 'id'), GREATEST((SELECT max(id) FROM syslog), 1));
+
+-- Lọc theo người / hành động + phân trang keyset (ts, id); PK (ts, id) phục vụ trường hợp không lọc
+CREATE INDEX syslog_actor_ts_idx  ON syslog (actor,  ts DESC, id DESC);
+CREATE INDEX syslog_action_ts_idx ON syslog (action, ts DESC, id DESC);
+
+DROP TABLE syslog_old;
+
+COMMIT;
@@ -0,0 +1,58 @@
+-- 002: transactions phân vùng theo tháng (RANGE ts) + bảng số dư chuyển kỳ.
+-- Chạy 1 lần trên Postgres trước khi deploy code đọc transactions_opening.
+-- Tháng đã khoá được lưu ra .csv.gz và gộp vào transactions_opening (finance.archive_transactions),
+-- nên onhand_qty / avg_cost / inv_valuation chỉ còn đọc phân vùng "nóng".
+BEGIN;
+
+ALTER TABLE transactions RENAME TO transactions_old;
+ALTER SEQUENCE IF EXISTS transactions_id_seq RENAME TO transactions_old_id_seq;
+
+CREATE TABLE transactions (
+  id         bigserial,
+  store_code text,
+  pcode      text,
+  qty        numeric,
+  type       text,
+  price_in   numeric,
+  note       text,
+  ts         timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (id, ts)
+) PARTITION BY RANGE (ts);
+
+CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+
+DO $$
+DECLARE m date;
+BEGIN
+  FOR m IN
+    SELECT generate_series(date_trunc('month', COALESCE((SELECT min(ts) FROM transactions_old), now())),
+                           date_trunc('month', now()) + interval '2 months',
+                           interval '1 month')::date
+  LOOP
+    EXECUTE format('CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                   'transactions_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'),
+                   m, (m + interval '1 month')::date);
+  END LOOP;
+END $$;
+
+INSERT INTO transactions(id, store_code, pcode, qty, type, price_in, note, ts)
+SELECT id, store_code, pcode, qty, type, price_in, note, COALESCE(ts, now()) FROM transactions_old;
+SELECT setval(pg_get_serial_sequence('transactions', 'id'), GREATEST((SELECT max(id) FROM transactions), 1));
+
+CREATE INDEX transactions_store_pcode_ts_idx ON transactions (store_code, pcode, ts);
+
+DROP TABLE transactions_old;
+
+-- Số dư chuyển kỳ: cộng dồn mọi giao dịch có ts < as_of đã lưu trữ, 1 dòng / (store, pcode)
+CREATE TABLE transactions_opening (
+  store_code    text        NOT NULL,
+  pcode         text        NOT NULL,
+  as_of         timestamptz NOT NULL,
+  qty_in        numeric     NOT NULL DEFAULT 0,
+  qty_out       numeric     NOT NULL DEFAULT 0,
+  cost_in       numeric     NOT NULL DEFAULT 0,  -- SUM(qty*price_in) của dòng IN có giá
+  qty_in_priced numeric     NOT NULL DEFAULT 0,  -- SUM(qty) của dòng IN có giá
+  PRIMARY KEY (store_code, pcode)
+);
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- 003: nguồn gốc dòng ghi từ máy chạy chế độ local-first (localdb.py).
+-- origin = mã máy, origin_id = id local → đẩy lại cùng 1 dòng không bị ghi trùng.
+-- Bảng phân vùng (transactions, syslog) phải kèm cột phân vùng ts trong unique index.
+BEGIN;
+
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS origin text;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS origin_id bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_origin_uq ON transactions (origin, origin_id, ts);
+
+ALTER TABLE syslog ADD COLUMN IF NOT EXISTS origin text;
+ALTER TABLE syslog ADD COLUMN IF NOT EXISTS origin_id bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS syslog_origin_uq ON syslog (origin, origin_id, ts);
+
+ALTER TABLE cashbook ADD COLUMN IF NOT EXISTS origin text;
+ALTER TABLE cashbook ADD COLUMN IF NOT EXISTS origin_id bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS cashbook_origin_uq ON cashbook (origin, origin_id);
+
+ALTER TABLE payroll ADD COLUMN IF NOT EXISTS origin text;
+ALTER TABLE payroll ADD COLUMN IF NOT EXISTS origin_id bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS payroll_origin_uq ON payroll (origin, origin_id);
+
+ALTER TABLE assets ADD COLUMN IF NOT EXISTS origin text;
+ALTER TABLE assets ADD COLUMN IF NOT EXISTS origin_id bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS assets_origin_uq ON assets (origin, origin_id);
+
+COMMIT;
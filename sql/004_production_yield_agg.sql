@@ -0,0 +1,68 @@
+-- 004: tổng hợp hiệu suất sản xuất theo (công thức, cửa hàng, tuần).
+-- Trigger cộng dồn khi 1 lô chuyển sang DONE → màn "Hiệu suất" chỉ đọc bảng tổng hợp,
+-- không quét lịch sử production. Chi phí lô lấy từ wip_cost (CỐT cũng ghi wip_cost khi đóng lô).
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS production_yield_agg (
+  ct_code    text    NOT NULL,
+  store_code text    NOT NULL,
+  week       date    NOT NULL,          -- thứ Hai đầu tuần (date_trunc('week'))
+  batches    integer NOT NULL DEFAULT 0,
+  kg_tho     numeric NOT NULL DEFAULT 0,
+  kg_soche   numeric NOT NULL DEFAULT 0,
+  kg_tp      numeric NOT NULL DEFAULT 0,
+  cost_total numeric NOT NULL DEFAULT 0,
+  cups       numeric NOT NULL DEFAULT 0,
+  PRIMARY KEY (ct_code, store_code, week)
+);
+
+CREATE OR REPLACE FUNCTION production_yield_bump() RETURNS trigger AS $$
+BEGIN
+  IF NEW.status = 'DONE' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'DONE') THEN
+    INSERT INTO production_yield_agg AS a (ct_code, store_code, week, batches, kg_tho, kg_soche, kg_tp, cost_total, cups)
+    SELECT NEW.ct_code, NEW.store_code,
+           date_trunc('week', COALESCE(NEW.ts_done, NEW.ts_create, now()))::date, 1,
+           COALESCE(NEW.kg_tho, 0), COALESCE(NEW.kg_soche, 0), COALESCE(NEW.kg_tp, 0),
+           COALESCE((SELECT cost_total FROM wip_cost WHERE batch_id = NEW.batch_id), 0),
+           COALESCE(NEW.kg_tp, 0) * COALESCE((SELECT cups_per_kg FROM formulas WHERE code = NEW.ct_code), 0)
+    ON CONFLICT (ct_code, store_code, week) DO UPDATE SET
+      batches    = a.batches    + 1,
+      kg_tho     = a.kg_tho     + EXCLUDED.kg_tho,
+      kg_soche   = a.kg_soche   + EXCLUDED.kg_soche,
+      kg_tp      = a.kg_tp      + EXCLUDED.kg_tp,
+      cost_total = a.cost_total + EXCLUDED.cost_total,
+      cups       = a.cups       + EXCLUDED.cups;
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS production_yield_trg ON production;
+CREATE TRIGGER production_yield_trg
+  AFTER INSERT OR UPDATE OF status ON production
+  FOR EACH ROW EXECUTE FUNCTION production_yield_bump();
+
+-- Dựng lại toàn bộ từ production (chạy lần đầu, hoặc sau khi sửa tay dữ liệu lô cũ)
+CREATE OR REPLACE FUNCTION production_yield_rebuild() RETURNS void AS $$
+  TRUNCATE production_yield_agg;
+  INSERT INTO production_yield_agg (ct_code, store_code, week, batches, kg_tho, kg_soche, kg_tp, cost_total, cups)
+  SELECT p.ct_code, p.store_code, date_trunc('week', COALESCE(p.ts_done, p.ts_create))::date, count(*),
+         SUM(COALESCE(p.kg_tho, 0)), SUM(COALESCE(p.kg_soche, 0)), SUM(COALESCE(p.kg_tp, 0)),
+         SUM(COALESCE(w.cost_total, 0)), SUM(COALESCE(p.kg_tp, 0) * COALESCE(f.cups_per_kg, 0))
+  FROM production p
+  LEFT JOIN wip_cost w ON w.batch_id = p.batch_id
+  LEFT JOIN formulas f ON f.code = p.ct_code
+  WHERE p.status = 'DONE'
+  GROUP BY 1, 2, 3;
+$$ LANGUAGE sql;
+
+-- Lô CỐT cũ chưa có wip_cost: lấy chi phí từ dòng nhập TP ("COT <ct> <lô> TP")
+INSERT INTO wip_cost (batch_id, cost_total, qty_tp)
+SELECT p.batch_id, t.qty * COALESCE(t.price_in, 0), t.qty
+FROM production p
+JOIN transactions t ON t.type = 'IN' AND t.note = 'COT ' || p.ct_code || ' ' || p.batch_id || ' TP'
+WHERE p.kind = 'COT'
+ON CONFLICT (batch_id) DO NOTHING;
+
+SELECT production_yield_rebuild();
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- 005: báo thay đổi theo cửa hàng cho live.py (LISTEN erp_live).
+-- payload = '<bảng>:<store_code>'. Postgres gộp các NOTIFY trùng trong cùng transaction
+-- → ghi nhiều dòng 1 lần chỉ phát 1 sự kiện cho mỗi (bảng, cửa hàng).
+BEGIN;
+
+CREATE OR REPLACE FUNCTION live_notify() RETURNS trigger AS $$
+DECLARE r record;
+BEGIN
+  IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+  PERFORM pg_notify('erp_live', TG_TABLE_NAME || ':' || COALESCE(r.store_code, ''));
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS live_notify_trg ON transactions;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON transactions
+  FOR EACH ROW EXECUTE FUNCTION live_notify();
+
+DROP TRIGGER IF EXISTS live_notify_trg ON production;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON production
+  FOR EACH ROW EXECUTE FUNCTION live_notify();
+
+DROP TRIGGER IF EXISTS live_notify_trg ON cashbook;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON cashbook
+  FOR EACH ROW EXECUTE FUNCTION live_notify();
+
+COMMIT;
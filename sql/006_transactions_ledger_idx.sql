@@ -0,0 +1,4 @@
+-- 006: thẻ kho phân trang keyset theo (ts, id) trong 1 (cửa hàng, SP) → index có đủ id.
+-- Thay index (store_code, pcode, ts) của 002: cùng tiền tố nên các truy vấn theo khoảng ts vẫn dùng được.
+CREATE INDEX IF NOT EXISTS transactions_store_pcode_ts_id_idx ON transactions (store_code, pcode, ts, id);
+DROP INDEX IF EXISTS transactions_store_pcode_ts_idx;
@@ -0,0 +1,4 @@
+-- 008: phiếu nhập / xuất nhiều dòng (inventory.post_document): các dòng cùng phiếu chung doc_id.
+-- Dòng nhập/xuất lẻ, sản xuất, kiểm kê để NULL → index một phần chỉ chứa dòng có phiếu.
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS doc_id text;
+CREATE INDEX IF NOT EXISTS transactions_doc_id_idx ON transactions (doc_id) WHERE doc_id IS NOT NULL;
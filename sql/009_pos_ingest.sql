@@ -0,0 +1,17 @@
+-- 009: nhập bán hàng POS (pos_ingest.py).
+-- idem_key: khoá của 1 dòng OUT gộp (nguồn, lô, cửa hàng, SP, khung giờ) → phát lại không ghi trùng.
+-- Bảng phân vùng theo ts → unique index phải kèm ts (ts của dòng gộp = đầu khung, cố định khi phát lại).
+BEGIN;
+
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS idem_key text;
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_idem_uq ON transactions (idem_key, ts);
+
+-- vị trí (số thứ tự sự kiện) đã ghi xong của từng nguồn, cập nhật cùng transaction với lô
+CREATE TABLE IF NOT EXISTS pos_ingest_offsets (
+  source text PRIMARY KEY,
+  pos    bigint NOT NULL,
+  events bigint NOT NULL DEFAULT 0,
+  ts     timestamptz NOT NULL DEFAULT now()
+);
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- 010: nhập POS — vị trí sự kiện đã cộng của từng khung (nguồn, cửa hàng, SP, khung giờ).
+-- idem_key của dòng OUT không còn chứa vị trí đầu lô (009): chia lô khác khi phát lại / chạy tiếp
+-- từ checkpoint lệch bội số --batch sẽ ghi trùng. Mỗi lô chỉ cộng sự kiện có số thứ tự >= pos của khung.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS pos_ingest_windows (
+  k   text PRIMARY KEY,        -- pos:<nguồn>:<cửa hàng>:<SP>:<đầu khung YYYYmmddHHMMSS>
+  pos bigint NOT NULL          -- số thứ tự sự kiện kế tiếp chưa cộng
+);
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- 011: sửa 005 — transactions phân vùng theo tháng (002) → trigger dòng chạy trên bảng con,
+-- TG_TABLE_NAME là tên phân vùng (vd transactions_y2026m10), live.py không nhận ra chủ đề.
+-- Tên bảng truyền vào qua tham số trigger (TG_ARGV[0]); thiếu tham số thì giữ TG_TABLE_NAME.
+BEGIN;
+
+CREATE OR REPLACE FUNCTION live_notify() RETURNS trigger AS $$
+DECLARE r record;
+BEGIN
+  IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+  PERFORM pg_notify('erp_live', COALESCE(TG_ARGV[0], TG_TABLE_NAME) || ':' || COALESCE(r.store_code, ''));
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS live_notify_trg ON transactions;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON transactions
+  FOR EACH ROW EXECUTE FUNCTION live_notify('transactions');
+
+DROP TRIGGER IF EXISTS live_notify_trg ON production;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON production
+  FOR EACH ROW EXECUTE FUNCTION live_notify('production');
+
+DROP TRIGGER IF EXISTS live_notify_trg ON cashbook;
+CREATE TRIGGER live_notify_trg AFTER INSERT OR UPDATE OR DELETE ON cashbook
+  FOR EACH ROW EXECUTE FUNCTION live_notify('cashbook');
+
+COMMIT;
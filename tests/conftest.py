@@ -0,0 +1,38 @@
+# Test chạy trên SQLite trong bộ nhớ, không cần Postgres / Streamlit server.
+import os, sys
+os.environ.setdefault("CACHE_PATH", ":memory:")
+os.environ.setdefault("LIVE_REFRESH", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+
+@pytest.fixture
+def conn():
+    eng = create_engine("sqlite://")
+    with eng.connect() as c:
+        yield c
+
+@pytest.fixture
+def local_conn(tmp_path, monkeypatch):
+    """SQLite local-first (localdb: schema, trigger outbox, hàm NOW/DATE_TRUNC) — không chạy worker đồng bộ."""
+    import localdb
+    from sqlalchemy import event
+    path = str(tmp_path / "erp.db")
+    monkeypatch.setenv("LOCAL_DB_PATH", path)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.delenv("DATABASE_URL_RO", raising=False)
+    raw = localdb._raw(); localdb.init_schema(raw); raw.close()
+    eng = create_engine(f"sqlite:///{path}", future=True, connect_args={"check_same_thread": False})
+    event.listen(eng, "connect", lambda dbapi_conn, _rec: localdb._register(dbapi_conn))
+    with eng.connect() as c:
+        yield c
+    eng.dispose()
+
+@pytest.fixture(autouse=True)
+def _fresh_cache():
+    """Mỗi test 1 cache :memory: mới (phiên bản namespace dùng chung giữa các DB test sẽ trả giá trị cũ)."""
+    import cache
+    with cache._LOCK:
+        cache._DB.update(pid=None); cache._VER.clear()
+    yield
@@ -0,0 +1,29 @@
+import core
+from catalog import _sync_inputs
+
+def _rows(conn):
+    df = core.fetch_df(conn, "SELECT formula_code,pcode,qty_per_kg,kind FROM formula_inputs ORDER BY 1,2")
+    return {(r.formula_code, r.pcode): (r.qty_per_kg, r.kind) for r in df.itertuples()}
+
+def test_sync_inputs_diffs_against_stored_rows(local_conn):
+    c = local_conn
+    with core.tx(c):
+        assert _sync_inputs(c, {"CT1": {"CAM": (0, "SRC"), "DUONG": (0.1, "OTHER")},
+                                "CT2": {"QUYT": (0, "SRC")}}) == {"insert": 3, "update": 0, "delete": 0}
+    with core.tx(c):
+        stats = _sync_inputs(c, {"CT1": {"CAM": (0, "SRC"), "DUONG": (0.2, "OTHER"), "MUOI": (0.01, "OTHER")}})
+    assert stats == {"insert": 1, "update": 1, "delete": 0}
+    assert _rows(c) == {("CT1","CAM"): (0.0, "SRC"), ("CT1","DUONG"): (0.2, "OTHER"),
+                        ("CT1","MUOI"): (0.01, "OTHER"), ("CT2","QUYT"): (0.0, "SRC")}   # CT2 không gửi → giữ nguyên
+    with core.tx(c):
+        assert _sync_inputs(c, {"CT1": {"CAM": (0, "SRC")}}) == {"insert": 0, "update": 0, "delete": 2}
+    assert set(_rows(c)) == {("CT1","CAM"), ("CT2","QUYT")}
+
+def test_sync_inputs_noop_and_outbox(local_conn):
+    c = local_conn
+    with core.tx(c): _sync_inputs(c, {"CT1": {"CAM": (0, "SRC")}})
+    n = c.exec_driver_sql("SELECT COUNT(*) FROM _outbox").scalar()
+    with core.tx(c):
+        assert _sync_inputs(c, {"CT1": {"CAM": (0, "SRC")}}) == {"insert": 0, "update": 0, "delete": 0}
+        assert _sync_inputs(c, {}) == {"insert": 0, "update": 0, "delete": 0}
+    assert c.exec_driver_sql("SELECT COUNT(*) FROM _outbox").scalar() == n   # không đổi → không sinh thay đổi đồng bộ
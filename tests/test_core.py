@@ -0,0 +1,69 @@
+import pytest
+import core
+
+# ===== _limited =====
+def test_limited_appends_after_order_by():
+    q = core._limited("SELECT id FROM t ORDER BY ts DESC;", 10)
+    assert q.rstrip().endswith("ORDER BY ts DESC\nLIMIT 11")
+    assert "_q" not in q
+
+def test_limited_keeps_smaller_literal_limit():
+    assert core._limited("SELECT id FROM t ORDER BY id LIMIT 5", 10).endswith("LIMIT 5")
+    assert core._limited("SELECT id FROM t ORDER BY id LIMIT 50 OFFSET 3", 10).endswith("LIMIT 11 OFFSET 3")
+
+def test_limited_leaves_param_limit_and_non_select():
+    assert core._limited("SELECT id FROM t LIMIT :n", 10) == "SELECT id FROM t LIMIT :n"
+    assert core._limited("UPDATE t SET x=1", 10) == "UPDATE t SET x=1"
+    assert core._limited("SELECT 1", 0) == "SELECT 1"
+
+def test_fetch_df_truncates_in_caller_order(conn):
+    conn.exec_driver_sql("CREATE TABLE t(id INTEGER, ts INTEGER)")
+    conn.exec_driver_sql("INSERT INTO t VALUES " + ",".join(f"({i},{i})" for i in range(50)))
+    df = core.fetch_df(conn, "SELECT id FROM t ORDER BY ts DESC", max_rows=5)
+    assert df["id"].tolist() == [49, 48, 47, 46, 45]
+    assert df.attrs["truncated"]
+
+# ===== _left: thuộc tính riêng của Streamlit =====
+def _requests():
+    try:
+        from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequests, RerunData
+    except ImportError:
+        from streamlit.runtime.scriptrunner.script_requests import ScriptRequests, RerunData
+    return ScriptRequests, RerunData
+
+@pytest.fixture(autouse=True)
+def _left_ok():
+    core._LEFT["ok"] = True
+    yield
+    core._LEFT["ok"] = True
+
+def test_left_matches_installed_streamlit():
+    # lỗi ở đây sau khi nâng Streamlit = _left cần sửa theo bản mới
+    ScriptRequests, RerunData = _requests()
+    r = ScriptRequests()
+    assert not core._left(r)
+    r.request_rerun(RerunData(fragment_id="frag"))
+    assert not core._left(r)                  # rerun riêng fragment → không huỷ
+    r = ScriptRequests(); r.request_rerun(RerunData())
+    assert core._left(r)                      # chạy lại cả trang
+    r = ScriptRequests(); r.request_stop()
+    assert core._left(r)
+    assert core._LEFT["ok"]
+
+def test_left_falls_back_when_internals_change():
+    class Other:                              # Streamlit đổi tên / kiểu thuộc tính riêng
+        _state = "STOP"
+    assert core._left(Other()) is False
+    assert core._LEFT["ok"] is False
+    ScriptRequests, _ = _requests()
+    r = ScriptRequests(); r.request_stop()
+    assert core._left(r) is False             # đã tắt → chỉ còn huỷ theo hạn giờ
+    assert core._left(None) is False
+
+# ===== replica =====
+def test_report_engine_needs_explicit_replica(monkeypatch):
+    monkeypatch.setattr(core, "_RO_ENGINE", None)
+    monkeypatch.setenv("LOCAL_DB_PATH", "/tmp/erp_local_test.db")
+    monkeypatch.setenv("DATABASE_URL", "postgresql://user:pw@db.example.com/erp")
+    monkeypatch.delenv("DATABASE_URL_RO", raising=False)
+    assert core._report_engine() is None      # local-first: báo cáo đọc SQLite local
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import core, costing, planner
+
+# 2 CT: CT0 (CỐT) từ 2 NVL mua; CT1 (MỨT) dùng 0.5 kg TP của CT0 + 1 NVL mua
+A = np.array([[2.0, 0.1, 0.0, 0.0],
+              [0.0, 0.0, 0.5, 0.3]])
+MAKE = np.array([-1, -1, 0, -1])
+PRICES = np.array([20000.0, 15000.0, 0.0, 10000.0])
+
+def test_rollup_solves_intermediates():
+    x = costing.rollup(A, MAKE, PRICES)
+    ct0 = 2 * 20000 + 0.1 * 15000
+    assert x == pytest.approx([ct0, 0.5 * ct0 + 0.3 * 10000])
+
+def test_rollup_many_scenarios_and_fixed_price():
+    P = np.stack([PRICES, PRICES * 1.1], axis=1)
+    x = costing.rollup(A, MAKE, P)
+    assert x.shape == (2, 2) and x[:, 1] == pytest.approx(x[:, 0] * 1.1)
+    fixed = np.array([False, False, True, False])
+    over = PRICES.copy(); over[2] = 50000.0                               # ghi đè giá CỐT
+    assert costing.rollup(A, MAKE, over, fixed)[1] == pytest.approx(0.5 * 50000 + 0.3 * 10000)
+
+def test_rollup_rejects_cycles():
+    A2 = np.array([[0.0, 1.0], [1.0, 0.0]])                               # CT0 dùng TP CT1 và ngược lại, 1:1
+    with pytest.raises(ValueError):
+        costing.rollup(A2, np.array([0, 1]), np.zeros(2))
+
+@pytest.fixture
+def cost_conn(local_conn):
+    planner.invalidate_dag()
+    c = local_conn
+    core.run_sql(c, """INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES
+        ('CAM','Cam','TRAI_CAY','kg',0,20000), ('DUONG','Đường','PHU_GIA','kg',0,15000),
+        ('COT_CAM','Cốt cam','COT','kg',40,0), ('MUT_CAM','Mứt cam','MUT','kg',20,0)""")
+    core.run_sql(c, """INSERT INTO formulas(code,name,type,output_pcode,output_uom,recovery,cups_per_kg,note) VALUES
+        ('CT1','Cốt cam','COT','COT_CAM','kg',0.5,40,''), ('MT1','Mứt cam','MUT','MUT_CAM','kg',1.0,20,'')""")
+    core.run_sql(c, """INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind) VALUES
+        ('CT1','CAM',0,'SRC'), ('CT1','DUONG',0.1,'OTHER'), ('MT1','COT_CAM',0,'SRC'), ('MT1','DUONG',0.5,'OTHER')""")
+    core.run_sql(c, "INSERT INTO transactions(store_code,pcode,qty,type,price_in) VALUES ('S1','CAM',10,'IN',22000)")
+    yield c
+    planner.invalidate_dag()
+
+def test_simulate_matches_manual_rollup(cost_conn):
+    df = costing.simulate(cost_conn, "S1", cat_factor={"TRAI_CAY": 1.1}).set_index("ct_code")
+    ct1 = 2 * 22000 + 0.2 * 15000                                         # HSTH 0.5 → 2 kg sơ chế / kg TP
+    mt1 = ct1 + 0.5 * 15000
+    assert df.loc["CT1", "cost_kg"] == pytest.approx(ct1)
+    assert df.loc["CT1", "cost_cup"] == pytest.approx(ct1 / 40)
+    assert df.loc["MT1", "cost_kg"] == pytest.approx(mt1)
+    assert df.loc["CT1", "wi_cost_kg"] == pytest.approx(2 * 22000 * 1.1 + 0.2 * 15000)
+    assert df.loc["MT1", "delta_pct"] == pytest.approx((2 * 22000 * 0.1) / mt1 * 100)
+    assert df["missing"].tolist() == [0, 0]
+    over = costing.simulate(cost_conn, "S1", overrides={"COT_CAM": 30000}).set_index("ct_code")
+    assert over.loc["MT1", "wi_cost_kg"] == pytest.approx(30000 + 0.5 * 15000)
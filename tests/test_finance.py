@@ -0,0 +1,43 @@
+from datetime import datetime
+import pytest
+import core, finance
+
+def _seed(c):
+    core.run_sql(c, "INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES ('P1','Cam','TRAI_CAY','kg',0,1000)")
+    core.run_sql(c, """INSERT INTO transactions_opening(store_code,pcode,as_of,qty_in,qty_out,cost_in,qty_in_priced)
+        VALUES ('S1','P1','2026-01-01 00:00:00',10,4,100000,10)""")
+    core.run_sql(c, """INSERT INTO transactions(store_code,pcode,qty,type,price_in,ts) VALUES
+        ('S1','P1',5,'IN',20000,'2026-02-01 08:00:00'), ('S1','P1',3,'OUT',NULL,'2026-02-10 08:00:00')""")
+
+def test_balances_from_archive_cut(local_conn):
+    _seed(local_conn)
+    assert finance.onhand_qty(local_conn, "S1", "P1") == pytest.approx(8.0)
+    assert finance.onhand_qty(local_conn, "S1", "P1", datetime(2026, 2, 5)) == pytest.approx(11.0)
+    assert finance.avg_cost(local_conn, "S1", "P1", datetime(2026, 2, 5)) == pytest.approx(200000 / 15)
+    assert finance.avg_cost_many(local_conn, "S1", ["P1"], datetime(2026, 2, 5)) == {"P1": pytest.approx(200000 / 15)}
+
+def test_dates_before_cut_are_rejected(local_conn):
+    _seed(local_conn)
+    assert finance.archived_until(local_conn, "S1") == datetime(2026, 1, 1)
+    for fn in (lambda t: finance.onhand_qty(local_conn, "S1", "P1", t),
+               lambda t: finance.onhand_many(local_conn, "S1", ["P1"], t),
+               lambda t: finance.avg_cost(local_conn, "S1", "P1", t),
+               lambda t: finance.avg_cost_many(local_conn, "S1", ["P1"], t)):
+        with pytest.raises(ValueError, match="01/01/2026"):
+            fn(datetime(2025, 12, 31))
+    finance.check_history(local_conn, "S1", datetime(2026, 1, 1))   # đúng mốc: được
+    finance.check_history(local_conn, "S2", datetime(2020, 1, 1))   # cửa hàng chưa lưu trữ
+
+def test_archive_refreshes_cached_cut(local_conn, monkeypatch):
+    _seed(local_conn)
+    assert finance.archived_until(local_conn) == datetime(2026, 1, 1)
+    def fake_drop(conn, table, keep, archive_dir=None, before_drop=None):
+        # như drop_old_partitions + _carry_forward: đẩy mốc chuyển kỳ lên 01/02
+        core.run_sql(conn, "UPDATE transactions_opening SET as_of='2026-02-01 00:00:00'")
+        return ["transactions_y2026m01"]
+    monkeypatch.setattr(finance, "ensure_month_partitions", lambda conn, table: None)
+    monkeypatch.setattr(finance, "drop_old_partitions", fake_drop)
+    assert finance.archive_transactions(local_conn, archive_dir="/tmp") == ["transactions_y2026m01"]
+    assert finance.archived_until(local_conn) == datetime(2026, 2, 1)   # cache "archive" đã bump
+    with pytest.raises(ValueError):
+        finance.onhand_qty(local_conn, "S1", "P1", datetime(2026, 1, 15))
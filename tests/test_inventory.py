@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+import pytest
+import core, inventory
+
+def _seed(c, n=7):
+    core.run_sql(c, """INSERT INTO transactions_opening(store_code,pcode,as_of,qty_in,qty_out,cost_in,qty_in_priced)
+        VALUES ('S1','P1','2026-01-01 00:00:00',10,0,100000,10)""")
+    t0, rows = datetime(2026, 2, 1), []
+    for i in range(n):
+        typ, q, pr = ("IN", 4.0, 12000.0) if i % 3 == 0 else ("OUT", 1.5, None)
+        rows.append((typ, q, pr))
+        core.run_sql(c, "INSERT INTO transactions(store_code,pcode,qty,type,price_in,ts) VALUES ('S1','P1',:q,:t,:p,:ts)",
+                     {"q": q, "t": typ, "p": pr, "ts": (t0 + timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S")})
+    core.run_sql(c, "INSERT INTO transactions(store_code,pcode,qty,type,ts) VALUES ('S2','P1',99,'IN','2026-02-01 05:00:00')")
+    bal, out = 10.0, []
+    for typ, q, _ in rows:
+        bal += q if typ == "IN" else -q; out.append(bal)
+    return out[::-1]          # số dư sau từng dòng, mới → cũ
+
+def _walk(c, limit):
+    pages, cur = [], None
+    while True:
+        df, cur = inventory.ledger_page(c, "S1", "P1", cur, limit)
+        pages.append(df)
+        if cur is None: return pages
+
+def test_keyset_pages_carry_running_balance(local_conn):
+    want = _seed(local_conn)
+    pages = _walk(local_conn, 3)
+    assert [len(p) for p in pages] == [3, 3, 2]                          # trang cuối: 1 dòng + số dư chuyển kỳ
+    got = [b for p in pages for b, t in zip(p["bal_qty"], p["type"]) if t != "OPEN"]
+    assert got == pytest.approx(want)
+    assert pages[0].attrs["totals"][0] == pytest.approx(want[0])
+    op = pages[-1].iloc[-1]
+    assert op["type"] == "OPEN" and op["bal_qty"] == pytest.approx(10.0) and op["bal_avg"] == 10000
+
+def test_first_page_refreshes_after_write(local_conn):
+    want = _seed(local_conn)
+    df, _ = inventory.ledger_page(local_conn, "S1", "P1", None, 3)
+    assert df.attrs["totals"][0] == pytest.approx(want[0])
+    core.run_sql(local_conn, "INSERT INTO transactions(store_code,pcode,qty,type,ts) VALUES ('S1','P1',2,'OUT','2026-03-01 00:00:00')")
+    inventory.stock_changed("S1")
+    df, _ = inventory.ledger_page(local_conn, "S1", "P1", None, 3)
+    assert df.iloc[0]["bal_qty"] == pytest.approx(want[0] - 2)
+    assert df.attrs["totals"][0] == pytest.approx(want[0] - 2)
+
+def test_single_page_without_history(local_conn):
+    df, nxt = inventory.ledger_page(local_conn, "S1", "NONE", None, 3)
+    assert nxt is None and df.empty and df.attrs["totals"] == (0.0, 0.0, 0.0)
@@ -0,0 +1,75 @@
+import json
+import pytest
+from sqlalchemy import create_engine, text
+import core, localdb
+
+@pytest.fixture
+def remote(tmp_path):
+    """'Postgres' đích đồng bộ dựng bằng SQLite: bảng phát sinh có (origin, origin_id) unique (sql/003)."""
+    eng = create_engine(f"sqlite:///{tmp_path / 'remote.db'}", future=True)
+    with eng.begin() as c:
+        for tbl, (ddl, key) in localdb.TABLES.items():
+            extra = ", origin TEXT, origin_id INTEGER, UNIQUE (origin, origin_id)" if key is None else ""
+            c.exec_driver_sql(f"CREATE TABLE {tbl} ({ddl}{extra})")
+        c.exec_driver_sql("CREATE TABLE transactions_opening (store_code TEXT, pcode TEXT, as_of TEXT, qty_in REAL, "
+                          "qty_out REAL, cost_in REAL, qty_in_priced REAL, PRIMARY KEY (store_code, pcode))")
+    yield eng
+    eng.dispose()
+
+@pytest.fixture
+def raw(local_conn):
+    c = localdb._raw()
+    yield c
+    c.close()
+
+def _count(eng, sql):
+    with eng.connect() as c: return c.execute(text(sql)).scalar()
+
+def _outbox(raw):
+    return raw.execute("SELECT COUNT(*) FROM _outbox").fetchone()[0]
+
+def test_push_applies_outbox_and_is_idempotent(local_conn, raw, remote):
+    core.run_sql(local_conn, "INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES ('P1','Cam','TRAI_CAY','kg',0,1)")
+    core.run_sql(local_conn, "UPDATE products SET name='Cam sành' WHERE code='P1'")
+    core.run_sql(local_conn, "INSERT INTO transactions(store_code,pcode,qty,type,price_in) VALUES ('S1','P1',5,'IN',20000), ('S1','P1',2,'OUT',NULL)")
+    pending = raw.execute("SELECT tbl,op,row FROM _outbox ORDER BY id").fetchall()
+    assert [(r["tbl"], r["op"]) for r in pending] == [("products","I"), ("products","U"), ("transactions","I"), ("transactions","I")]
+    assert localdb.push_once(remote, raw) == 4
+    assert _outbox(raw) == 0
+    assert _count(remote, "SELECT name FROM products WHERE code='P1'") == "Cam sành"
+    assert _count(remote, "SELECT SUM(CASE WHEN type='IN' THEN qty ELSE -qty END) FROM transactions") == 5 - 2
+    # mất kết quả sau khi đẩy (chưa kịp xoá outbox) → đẩy lại không ghi trùng
+    raw.executemany("INSERT INTO _outbox(tbl,op,row) VALUES (?,?,?)", [(r["tbl"], r["op"], r["row"]) for r in pending])
+    assert localdb.push_once(remote, raw) == 4
+    assert _count(remote, "SELECT COUNT(*) FROM transactions") == 2
+    assert _count(remote, "SELECT COUNT(*) FROM products") == 1
+
+def test_push_isolates_conflicts(local_conn, raw, remote):
+    with remote.begin() as c:
+        c.exec_driver_sql("INSERT INTO production(batch_id,status,store_code) VALUES ('B1','DONE','S1')")
+    core.run_sql(local_conn, "INSERT INTO production(batch_id,status,store_code,kg_tp) VALUES ('B1','WIP','S1',3)")
+    core.run_sql(local_conn, "INSERT INTO stores(code,name) VALUES ('S1','Cửa hàng 1')")
+    assert localdb.push_once(remote, raw) == 2
+    assert _outbox(raw) == 0
+    conf = raw.execute("SELECT tbl,row FROM _sync_conflicts").fetchall()
+    assert [(r["tbl"], json.loads(r["row"])["batch_id"]) for r in conf] == [("production", "B1")]
+    assert _count(remote, "SELECT status FROM production WHERE batch_id='B1'") == "DONE"   # lô đã đóng nơi khác giữ nguyên
+    assert _count(remote, "SELECT name FROM stores WHERE code='S1'") == "Cửa hàng 1"         # dòng không xung đột vẫn đẩy
+
+def test_pull_replaces_reference_data_and_opening(local_conn, raw, remote):
+    with remote.begin() as c:
+        c.exec_driver_sql("INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES ('P1','Cam','TRAI_CAY','kg',0,1)")
+        c.exec_driver_sql("INSERT INTO transactions(store_code,pcode,qty,type,price_in) VALUES ('S1','P1',10,'IN',20000), ('S1','P1',4,'OUT',NULL)")
+        c.exec_driver_sql("INSERT INTO transactions_opening VALUES ('S1','P1','2026-01-01',3,0,30000,3)")
+    core.run_sql(local_conn, "INSERT INTO categories(code,name) VALUES ('X','chưa đẩy')")
+    assert localdb.pull_once(remote, raw) is False              # outbox còn thay đổi → không đè
+    assert localdb.push_once(remote, raw) == 1
+    assert localdb.pull_once(remote, raw) is True
+    assert _outbox(raw) == 0                                    # dữ liệu kéo về không sinh outbox
+    assert core.fetch_df(local_conn, "SELECT code FROM products")["code"].tolist() == ["P1"]
+    r = raw.execute("SELECT qty_in,qty_out,cost_in,qty_in_priced FROM transactions_opening WHERE pcode='P1'").fetchone()
+    assert tuple(r) == (13, 4, 230000, 13)
+    assert raw.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 0
+    local_conn.rollback()
+    import finance
+    assert finance.onhand_qty(local_conn, "S1", "P1") == pytest.approx(9.0)
@@ -0,0 +1,49 @@
+import pytest
+import core, planner
+
+@pytest.fixture(autouse=True)
+def _fresh_dag():
+    planner.invalidate_dag()
+    yield
+    planner.invalidate_dag()
+
+@pytest.fixture
+def dag_conn(local_conn):
+    c = local_conn
+    core.run_sql(c, """INSERT INTO products(code,name,cat_code,uom,cups_per_kg,price_ref) VALUES
+        ('CAM','Cam','TRAI_CAY','kg',0,20000), ('QUYT','Quýt','TRAI_CAY','kg',0,30000),
+        ('DUONG','Đường','PHU_GIA','kg',0,15000), ('COT_CAM','Cốt cam','COT','kg',40,0),
+        ('MUT_CAM','Mứt cam','MUT','kg',20,0)""")
+    core.run_sql(c, """INSERT INTO formulas(code,name,type,output_pcode,output_uom,recovery,cups_per_kg,note) VALUES
+        ('CT1','Cốt cam','COT','COT_CAM','kg',0.5,40,''), ('MT1','Mứt cam','MUT','MUT_CAM','kg',1.0,20,'')""")
+    core.run_sql(c, """INSERT INTO formula_inputs(formula_code,pcode,qty_per_kg,kind) VALUES
+        ('CT1','CAM',0,'SRC'), ('CT1','QUYT',0,'SRC'), ('CT1','DUONG',0.1,'OTHER'),
+        ('MT1','COT_CAM',0,'SRC'), ('MT1','DUONG',0.5,'OTHER')""")
+    return c
+
+def test_load_dag_uses_formula_recovery_by_default(dag_conn):
+    core.run_sql(dag_conn, """INSERT INTO production_yield_agg(ct_code,store_code,week,batches,kg_tho,kg_soche,kg_tp)
+        VALUES ('CT1','S1','2026-01-05',1,30,10,8)""")
+    dag = planner.load_dag(dag_conn)
+    # HSTH 0.5 → 2 kg sơ chế / kg TP, chia đều 2 nguồn SRC
+    assert dag["per_kg"]["CT1"] == pytest.approx({"CAM": 1.0, "QUYT": 1.0, "DUONG": 0.2})
+    assert dag["maker"] == {"COT_CAM": "CT1", "MUT_CAM": "MT1"}
+    act = planner.load_dag(dag_conn, actual=True)
+    # thực tế: kg_tp/kg_soche = 0.8, kg_tho/kg_soche = 3
+    assert act["per_kg"]["CT1"] == pytest.approx({"CAM": 3 / 0.8 / 2, "QUYT": 3 / 0.8 / 2, "DUONG": 0.1 / 0.8})
+    assert act["per_kg"]["MT1"] == pytest.approx(dag["per_kg"]["MT1"])   # chưa có lô → HSTH
+
+def test_explode_nets_stock_per_level(dag_conn):
+    core.run_sql(dag_conn, "INSERT INTO transactions(store_code,pcode,qty,type,price_in) VALUES ('S1','COT_CAM',0.5,'IN',0)")
+    rows = {r["pcode"]: r for r in planner.explode(dag_conn, "S1", [{"ct_code": "MT1", "qty": 40, "unit": "cốc"}])}
+    assert rows["MUT_CAM"]["net"] == pytest.approx(2.0)                  # 40 cốc / 20 cốc/kg
+    assert rows["COT_CAM"]["gross"] == pytest.approx(2.0)
+    assert rows["COT_CAM"]["net"] == pytest.approx(1.5)                  # trừ 0.5 kg tồn
+    assert rows["DUONG"]["gross"] == pytest.approx(2.0 * 0.5 + 1.5 * 0.2)
+    assert rows["CAM"]["short"] == pytest.approx(1.5)
+
+def test_explode_rejects_missing_cups(dag_conn):
+    core.run_sql(dag_conn, "UPDATE formulas SET cups_per_kg=0 WHERE code='MT1'")
+    core.run_sql(dag_conn, "UPDATE products SET cups_per_kg=0 WHERE code='MUT_CAM'")
+    with pytest.raises(ValueError):
+        planner.explode(dag_conn, "S1", [{"ct_code": "MT1", "qty": 1, "unit": "cốc"}])
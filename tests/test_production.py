@@ -0,0 +1,29 @@
+import pytest
+import core
+from production import finish_batches
+
+def _wip(c, b, store="S1", cost=60000.0):
+    core.run_sql(c, """INSERT INTO production(batch_id,ct_code,store_code,kind,status,kg_soche,out_pcode,ts_create)
+        VALUES (:b,'MT1',:s,'MUT','WIP',3,'MUT_CAM',NOW())""", {"b": b, "s": store})
+    core.run_sql(c, "INSERT INTO wip_cost(batch_id,cost_total,qty_tp) VALUES (:b,:c,0)", {"b": b, "c": cost})
+
+def test_finish_batches_closes_and_posts_tp(local_conn):
+    c = local_conn
+    _wip(c, "B1"); _wip(c, "B2", cost=0.0); _wip(c, "B3", store="S2")
+    done = finish_batches(c, "S1", {"B1": 2.0, "B2": 1.5, "B3": 1.0, "NOPE": 1.0})
+    assert sorted(done) == ["B1", "B2"]                                   # lô cửa hàng khác / không có → bỏ qua
+    st_ = core.fetch_df(c, "SELECT batch_id,status,kg_tp FROM production ORDER BY batch_id").set_index("batch_id")
+    assert st_.loc["B1", "status"] == "DONE" and st_.loc["B1", "kg_tp"] == 2.0
+    assert st_.loc["B3", "status"] == "WIP"
+    tin = core.fetch_df(c, "SELECT note,qty,price_in FROM transactions WHERE type='IN' ORDER BY note").set_index("note")
+    assert tin.loc["B1 TP MUT", "price_in"] == pytest.approx(30000.0)     # chi phí lô / kg TP
+    assert tin.loc["B2 TP MUT", "price_in"] == 0
+    assert core.fetch_df(c, "SELECT qty_tp FROM wip_cost WHERE batch_id='B1'").iloc[0, 0] == 2.0
+
+def test_finish_batches_skips_already_closed(local_conn):
+    c = local_conn
+    _wip(c, "B1")
+    assert finish_batches(c, "S1", {"B1": 2.0}) == ["B1"]
+    assert finish_batches(c, "S1", {"B1": 5.0}) == []                     # đóng ở phiên khác rồi
+    assert core.fetch_df(c, "SELECT COUNT(*) AS n FROM transactions").iloc[0, 0] == 1
+    assert finish_batches(c, "S1", {}) == []
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import core, replenish
+from finance import REPORT_TZ
+
+@pytest.fixture(autouse=True)
+def _fresh_state():
+    replenish._STATE.update(day=None)
+    yield
+    replenish._STATE.update(day=None)
+
+def _out(conn, ts, qty, store="S1", pcode="P1"):
+    core.run_sql(conn, "INSERT INTO transactions(store_code,pcode,qty,type,ts) VALUES (:s,:p,:q,'OUT',:t)",
+                 {"s": store, "p": pcode, "q": qty, "t": ts})
+
+def _daily():
+    d = replenish._STATE["daily"]
+    return {k[2].date(): v for k, v in d.items()}
+
+def test_days_split_in_report_tz(local_conn):
+    today = datetime.now(REPORT_TZ).date()
+    early = datetime.combine(today, datetime.min.time(), tzinfo=REPORT_TZ) + timedelta(minutes=30)
+    if early > datetime.now(REPORT_TZ) - timedelta(minutes=20): pytest.skip("quá sát nửa đêm giờ báo cáo")
+    _out(local_conn, early, 2.0)                          # 00:30 giờ báo cáo = hôm trước theo UTC
+    _out(local_conn, early - timedelta(hours=12), 5.0)    # hôm qua giờ báo cáo
+    replenish.refresh(local_conn)
+    assert _daily() == {today: 2.0, today - timedelta(days=1): 5.0}
+
+def test_overlap_counts_recent_and_late_rows_once(local_conn):
+    now = datetime.now(timezone.utc)
+    _out(local_conn, now - timedelta(minutes=1), 1.0)
+    v1 = replenish.refresh(local_conn)
+    assert replenish.refresh(local_conn) == v1            # đọc lại vùng chồng lấp không cộng trùng
+    _out(local_conn, now - timedelta(minutes=2), 3.0)     # dòng đến muộn, ts cũ hơn dòng đã đọc
+    assert replenish.refresh(local_conn) > v1
+    assert sum(_daily().values()) == pytest.approx(4.0)
+
+def test_consumption_stats_window(local_conn):
+    now = datetime.now(timezone.utc)
+    for k in range(7): _out(local_conn, now - timedelta(days=k, hours=1), 7.0)
+    st_ = replenish.consumption_stats(local_conn, window=7).set_index(["store_code","pcode"])
+    assert st_.loc[("S1","P1"), "avg_daily"] == pytest.approx(7.0, rel=0.2)